@@ -0,0 +1,6 @@
+from palm.trajectory_store import convert_directory_file_to_store
+
+# Pack the csv files listed in traj_paths.txt into a single binary file.
+# Load it with palm.trajectory_store.StoredBlinkCollectionTargetData.
+convert_directory_file_to_store('traj_paths.txt', 'traj_store.bin')
+print "Wrote traj_store.bin"
@@ -7,6 +7,7 @@ from palm.blink_parameter_set import SingleDarkParameterSet
 from palm.score_function import ScoreFunction
 from palm.linalg import ScipyMatrixExponential2
 from palm.util import randomize_parameter
+from palm.moment_estimator import MomentEstimator
 
 def run_optimization(N, traj_filename):
     # ============================
@@ -39,6 +40,14 @@ def run_optimization(N, traj_filename):
     traj_data = BlinkCollectionTargetData()
     traj_data.load_data(traj_filename)
 
+    # ===================================================================
+    # = Uncomment this block to start from moment estimates of the data =
+    # ===================================================================
+    '''
+    parameters, N_range = MomentEstimator().fill_parameter_set(
+                            parameters, traj_data, N=N)
+    '''
+
     # =======================================================================
     # = Initialize model factory, likelihood predictor and likelihood judge =
     # =======================================================================
@@ -1,9 +1,10 @@
 import numpy
+import scipy.linalg
 import pandas
 from palm.base.data_predictor import DataPredictor
 from palm.likelihood_prediction import LikelihoodPrediction
 from palm.backward_calculator import BackwardCalculator
-from palm.linalg import DiagonalExpm, vector_product
+from palm.linalg import DiagonalExpm, EigenGridExpm, vector_product
 from palm.probability_vector import VectorTrajectory, ProbabilityVector
 from palm.rate_matrix import RateMatrixTrajectory
 from palm.util import ALMOST_ZERO
@@ -44,6 +45,10 @@ class BackwardPredictor(DataPredictor):
     archive_matrices : bool, optional
         Whether to save the intermediate results of the calculation for
         later plotting, debugging, etc.
+    diagonal_dark : bool, optional
+        Whether to exponentiate only the diagonal of the dark block of
+        the rate matrix, which is exact when dark states do not
+        interconvert. Batches do the same.
     noisy : bool, optional
         Whether to print additional ouput, such as intermediate values
         of likelihood calculation. Intended for debugging purposes.
@@ -180,6 +185,87 @@ class BackwardPredictor(DataPredictor):
             self.vector_trajectory.add_vector(0.0, scaled_total_beta)
         return scaling_factor_set
 
+    def can_predict_batch(self, model_factory=None):
+        """
+        Batches use one rate matrix per model for every trajectory, so
+        rates must not vary with time. `predict_data` builds the rate
+        matrix at the end of each trajectory, which gives different
+        likelihoods when they do.
+
+        Parameters
+        ----------
+        model_factory : ModelFactory, optional
+            Checked for time-dependent rates, such as fermi activation.
+        """
+        if self.always_rebuild_rate_matrix:
+            return False
+        return not getattr(model_factory, 'fermi_activation', False)
+
+    def prepare_batch(self, model_list):
+        """
+        Parameters
+        ----------
+        model_list : list of BlinkModel
+
+        Returns
+        -------
+        batch : BatchRateBlocks
+        """
+        assert not any(getattr(model, 'fermi_activation', False)
+                       for model in model_list),\
+               "Batches need models whose rates do not vary with time."
+        if self.diagonal_dark:
+            diagonal_classes = ['dark']
+        else:
+            diagonal_classes = []
+        return BatchRateBlocks(model_list, diagonal_classes=diagonal_classes)
+
+    def predict_data_batch(self, batch, trajectory):
+        """
+        Runs the backward recursion of `compute_backward_vectors` for
+        every model of a batch at once.
+
+        Parameters
+        ----------
+        batch : BatchRateBlocks
+        trajectory : DiscreteStateTrajectory
+
+        Returns
+        -------
+        log_likelihoods : ndarray
+            Log10 likelihood of the trajectory for each model.
+        """
+        class_names = trajectory.class_names
+        class_list = [class_names[c] for c in trajectory.class_codes]
+        assert class_list[-1] == 'dark',\
+               "Trajectories must end in the dark class."
+        log_factor_sums = numpy.zeros(batch.num_models)
+        beta = numpy.tile(batch.final_vec, (batch.num_models, 1))
+        beta = scale_batch_vectors(beta, log_factor_sums)
+        end_class = None
+        for segment_number in xrange(len(class_list) - 1, -1, -1):
+            start_class = class_list[segment_number]
+            if end_class is None:
+                bwd_vec = beta
+            else:
+                bwd_vec = numpy.einsum(
+                            'kab,kb->ka',
+                            batch.block_dict[(start_class, end_class)], beta)
+            beta = batch.compute_expv(start_class,
+                                      trajectory.durations[segment_number],
+                                      bwd_vec)
+            if not numpy.isfinite(beta).all():
+                print "Likelihood calculation failure"
+                raise RuntimeError
+            beta = scale_batch_vectors(beta, log_factor_sums)
+            end_class = start_class
+        total_beta = numpy.dot(beta, batch.initial_vec)
+        scale_batch_vectors(total_beta[:, None], log_factor_sums)
+        log_likelihoods = -log_factor_sums
+        log_likelihoods[log_likelihoods < numpy.log10(ALMOST_ZERO)] =\
+            numpy.log10(ALMOST_ZERO)
+        return log_likelihoods
+
     def _compute_beta(self, rate_matrix_aa, rate_matrix_ab, segment_number,
                        segment_duration, start_class, end_class, next_beta):
         if self.diagonal_dark and start_class == 'dark':
@@ -246,3 +332,125 @@ class RateMatrixOrganizer(object):
         else:
             submatrix = None
         return submatrix
+
+
+class BatchRateBlocks(object):
+    """
+    The rate matrices of a batch of models that share their states, such
+    as the models made by one factory for different parameter values,
+    split into class blocks and stacked along a first, model, axis.
+
+    Each diagonal block is decomposed once per model, ``Q = V * D * V_i``,
+    so that ``exp(Q t) * v`` for every segment is two batched
+    matrix-vector products and an exponential. Blocks that cannot be
+    diagonalized accurately fall back to `scipy.linalg.expm`.
+
+    Parameters
+    ----------
+    model_list : list of AggregatedKineticModel
+        Models with time-independent rates.
+    max_relative_error : float, optional
+        Passed to `EigenGridExpm`.
+    diagonal_classes : list, optional
+        Classes whose diagonal blocks are treated as diagonal, like
+        the `diagonal_dark` option of `BackwardPredictor`; only their
+        diagonals are exponentiated.
+    """
+    def __init__(self, model_list, max_relative_error=1e-8,
+                 diagonal_classes=()):
+        super(BatchRateBlocks, self).__init__()
+        first_model = model_list[0]
+        first_matrix = first_model.build_rate_matrix(time=0.0)
+        state_id_list = first_matrix.get_index_id_list()
+        Q_list = [first_matrix.as_npy_array()]
+        for model in model_list[1:]:
+            rate_matrix = model.build_rate_matrix(time=0.0)
+            assert rate_matrix.get_index_id_list() == state_id_list,\
+                   "Models of a batch must have the same states."
+            Q_list.append(rate_matrix.as_npy_array())
+        Q_stack = numpy.array(Q_list)
+        self.num_models = len(model_list)
+        self.class_inds_dict = {}
+        for class_name, state_id_collection in\
+                first_model.state_ids_by_class_dict.iteritems():
+            class_ids = set(state_id_collection.as_list())
+            self.class_inds_dict[class_name] = numpy.array(
+                [i for i, s in enumerate(state_id_list) if s in class_ids])
+        self.block_dict = {}
+        for start_class, start_inds in self.class_inds_dict.iteritems():
+            for end_class, end_inds in self.class_inds_dict.iteritems():
+                self.block_dict[(start_class, end_class)] =\
+                    Q_stack[:, start_inds[:, None], end_inds[None, :]]
+        expm = EigenGridExpm(max_relative_error)
+        self.diagonal_dict = {}
+        self.decomposition_dict = {}
+        for class_name, class_inds in self.class_inds_dict.iteritems():
+            if class_name in diagonal_classes:
+                self.diagonal_dict[class_name] = numpy.diagonal(
+                    self.block_dict[(class_name, class_name)], axis1=1,
+                    axis2=2)
+                continue
+            num_class_states = len(class_inds)
+            eig_vals = numpy.zeros((self.num_models, num_class_states),
+                                   dtype=complex)
+            eig_vecs = numpy.zeros((self.num_models, num_class_states,
+                                    num_class_states), dtype=complex)
+            vec_inv = numpy.zeros_like(eig_vecs)
+            is_decomposed = numpy.ones(self.num_models, dtype=bool)
+            Q_aa_stack = self.block_dict[(class_name, class_name)]
+            for k in xrange(self.num_models):
+                decomposition = expm.decompose(Q_aa_stack[k])
+                if decomposition[0] is None:
+                    is_decomposed[k] = False
+                else:
+                    eig_vals[k], eig_vecs[k], vec_inv[k] = decomposition
+            self.decomposition_dict[class_name] = (eig_vals, eig_vecs,
+                                                   vec_inv, is_decomposed)
+        self.initial_vec = self._make_class_vector(
+                            first_model.get_initial_probability_vector(),
+                            state_id_list, 'dark')
+        self.final_vec = self._make_class_vector(
+                            first_model.get_final_probability_vector(),
+                            state_id_list, 'dark')
+
+    def _make_class_vector(self, prob_vec, state_id_list, class_name):
+        class_ids = [state_id_list[i] for i in self.class_inds_dict[class_name]]
+        return prob_vec.series.reindex(class_ids).fillna(0.0).values
+
+    def compute_expv(self, class_name, dwell_time, vec):
+        """
+        Parameters
+        ----------
+        class_name : string
+        dwell_time : float
+        vec : ndarray
+            One vector per model.
+
+        Returns
+        -------
+        expv : ndarray
+            ``exp(Q_aa * dwell_time) * vec`` for each model.
+        """
+        if class_name in self.diagonal_dict:
+            return numpy.exp(self.diagonal_dict[class_name] * dwell_time) *\
+                   vec
+        eig_vals, eig_vecs, vec_inv, is_decomposed =\
+            self.decomposition_dict[class_name]
+        coefficients = numpy.einsum('kij,kj->ki', vec_inv, vec) *\
+                       numpy.exp(eig_vals * dwell_time)
+        expv = numpy.einsum('kij,kj->ki', eig_vecs, coefficients).real
+        Q_aa_stack = self.block_dict[(class_name, class_name)]
+        for k in numpy.flatnonzero(~is_decomposed):
+            expv[k] = numpy.dot(scipy.linalg.expm(Q_aa_stack[k] * dwell_time),
+                                vec[k])
+        return expv
+
+
+def scale_batch_vectors(vec, log_factor_sums):
+    """
+    Scales each row like `ScalingFactorSet.scale_vector` and adds the
+    log10 scaling factors to `log_factor_sums` in place.
+    """
+    factors = 1. / numpy.maximum(vec.sum(axis=1), ALMOST_ZERO)
+    log_factor_sums += numpy.log10(factors)
+    return vec * factors[:, None]
@@ -0,0 +1,179 @@
+import numpy
+import scipy.linalg
+from palm.linalg import EigenGridExpm
+
+class BlinkDistributionEngine(object):
+    """
+    Computes the distributions that a BlinkModel predicts for the
+    statistics of `BlinkCollectionTargetData`: dark and bright dwell
+    times, number of blinks, activation time and bleach time.
+
+    The rate matrix is split into blocks by class: transient dark
+    states (every dark state except the all-bleached state), bright
+    states, and the all-bleached state. Each dwell time is then
+    phase-type: a dwell that starts in the distribution `alpha` over
+    the states of a block `S` and leaves through the exit rates `s`
+    has density ``alpha * exp(S t) * s``. Dwell start distributions are
+    averaged over all dwells of a trajectory, as the collection
+    statistics pool the dwells of all trajectories. Densities for
+    a whole time grid come from one decomposition of the block.
+
+    Dwell statistics follow the collection statistics: dark dwells
+    exclude the first dwell (before activation) and the last dwell
+    (after bleaching), and the number of blinks counts those interior
+    dark dwells. Bleach time is the time from the first activation
+    until the all-bleached state is reached.
+
+    With Fermi activation the rates depend on time; the distributions
+    are computed with the rates at `rate_time`.
+
+    Parameters
+    ----------
+    model : BlinkModel
+    rate_time : float, optional
+    """
+    def __init__(self, model, rate_time=0.0):
+        super(BlinkDistributionEngine, self).__init__()
+        self.expm = EigenGridExpm()
+        rate_matrix = model.build_rate_matrix(time=rate_time)
+        Q = rate_matrix.as_npy_array()
+        state_id_list = rate_matrix.get_index_id_list()
+        state_classes = numpy.array([model.state_class_by_id_dict[s]
+                                     for s in state_id_list])
+        final_index = state_id_list.index(model.final_state_id)
+        is_final = numpy.zeros(len(state_id_list), dtype=bool)
+        is_final[final_index] = True
+        dark_inds = numpy.flatnonzero((state_classes == 'dark') & ~is_final)
+        bright_inds = numpy.flatnonzero(state_classes == 'bright')
+        self.dark_inds = dark_inds
+        self.bright_inds = bright_inds
+        self.T_dd = Q[numpy.ix_(dark_inds, dark_inds)]
+        self.T_db = Q[numpy.ix_(dark_inds, bright_inds)]
+        self.T_bd = Q[numpy.ix_(bright_inds, dark_inds)]
+        self.T_bb = Q[numpy.ix_(bright_inds, bright_inds)]
+        self.h_d = Q[dark_inds, final_index]
+        self.h_b = Q[bright_inds, final_index]
+        initial_index = state_id_list.index(model.initial_state_id)
+        self.initial_dark_vec = (dark_inds == initial_index).astype(float)
+        self._compute_entry_measures()
+
+    def _compute_entry_measures(self):
+        num_bright = len(self.bright_inds)
+        # (-T)^-1 applied on the right of a row vector `v` is
+        # solve(-T.T, v); on the left of a matrix `M` it is solve(-T, M)
+        dark_to_bright = scipy.linalg.solve(-self.T_dd, self.T_db)
+        bright_to_dark = scipy.linalg.solve(-self.T_bb, self.T_bd)
+        bright_to_end = scipy.linalg.solve(-self.T_bb, self.h_b)
+        dark_to_end = scipy.linalg.solve(-self.T_dd, self.h_d)
+        # bright entry distribution after the first dark dwell
+        self.first_bright_entry = numpy.dot(self.initial_dark_vec,
+                                            dark_to_bright)
+        # one blink cycle: bright dwell, interior dark dwell, bright again
+        self.blink_cycle = numpy.dot(bright_to_dark, dark_to_bright)
+        # ending without another interior dark dwell: bleach from bright,
+        # or go dark and bleach before turning bright again
+        self.bright_end_prob = bright_to_end +\
+                               numpy.dot(bright_to_dark, dark_to_end)
+        # expected number of entries into each bright state
+        self.bright_entry_measure = scipy.linalg.solve(
+                                        (numpy.eye(num_bright) -
+                                         self.blink_cycle).T,
+                                        self.first_bright_entry)
+        # expected number of entries into each dark state from bright
+        self.dark_entry_measure = numpy.dot(self.bright_entry_measure,
+                                            bright_to_dark)
+
+    def _compute_phase_type(self, S, alpha, exit_vec, time_array,
+                            total_exit_vec=None):
+        """
+        Returns
+        -------
+        pdf, cdf : ndarray
+            Density and cumulative distribution of the dwells that
+            leave through `exit_vec`. Normalized to the probability of
+            leaving through `exit_vec`, or, if `total_exit_vec` is given,
+            of leaving through `total_exit_vec`, which makes them the
+            joint distribution of duration and exit.
+        """
+        exit_weights = scipy.linalg.solve(-S, exit_vec)
+        exit_prob = numpy.dot(alpha, exit_weights)
+        if total_exit_vec is None:
+            normalization = exit_prob
+        else:
+            normalization = numpy.dot(alpha,
+                                      scipy.linalg.solve(-S, total_exit_vec))
+        row_grid = self.expm.compute_vector_expm_grid(S, alpha, time_array)
+        pdf = numpy.dot(row_grid, exit_vec) / normalization
+        cdf = (exit_prob - numpy.dot(row_grid, exit_weights)) / normalization
+        return pdf, cdf
+
+    def get_dark_time_distribution(self, time_array):
+        """
+        Returns
+        -------
+        pdf, cdf : ndarray
+            Of interior dark dwell durations, at each time.
+        """
+        return self._compute_phase_type(self.T_dd, self.dark_entry_measure,
+                                        self.T_db.sum(axis=1), time_array)
+
+    def get_bright_time_distribution(self, time_array):
+        exit_vec = self.T_bd.sum(axis=1) + self.h_b
+        return self._compute_phase_type(self.T_bb, self.bright_entry_measure,
+                                        exit_vec, time_array)
+
+    def get_bright_exit_distributions(self, time_array):
+        """
+        Splits the bright dwell distribution by how the dwell ends.
+
+        Returns
+        -------
+        blink_pdf, blink_cdf : ndarray
+            Joint distribution of the duration of a bright dwell and
+            its ending in a dark dwell.
+        bleach_pdf, bleach_cdf : ndarray
+            Joint distribution of the duration of a bright dwell and
+            its ending in the all-bleached state. The two cdfs add up
+            to the bright dwell cdf.
+        """
+        to_dark_vec = self.T_bd.sum(axis=1)
+        total_exit_vec = to_dark_vec + self.h_b
+        blink_pdf, blink_cdf = self._compute_phase_type(
+                                self.T_bb, self.bright_entry_measure,
+                                to_dark_vec, time_array, total_exit_vec)
+        bleach_pdf, bleach_cdf = self._compute_phase_type(
+                                    self.T_bb, self.bright_entry_measure,
+                                    self.h_b, time_array, total_exit_vec)
+        return blink_pdf, blink_cdf, bleach_pdf, bleach_cdf
+
+    def get_activation_time_distribution(self, time_array):
+        return self._compute_phase_type(self.T_dd, self.initial_dark_vec,
+                                        self.T_db.sum(axis=1), time_array)
+
+    def get_bleach_time_distribution(self, time_array):
+        num_dark = len(self.dark_inds)
+        S = numpy.vstack([numpy.hstack([self.T_dd, self.T_db]),
+                          numpy.hstack([self.T_bd, self.T_bb])])
+        alpha = numpy.append(numpy.zeros(num_dark), self.first_bright_entry)
+        exit_vec = numpy.append(self.h_d, self.h_b)
+        return self._compute_phase_type(S, alpha, exit_vec, time_array)
+
+    def get_num_blink_distribution(self, max_num_blinks):
+        """
+        Parameters
+        ----------
+        max_num_blinks : int
+
+        Returns
+        -------
+        pmf : ndarray
+            `pmf[k]` is the probability of `k` interior dark dwells,
+            for `k` from 0 to `max_num_blinks`, given activation.
+        """
+        activation_prob = self.first_bright_entry.sum()
+        pmf = numpy.zeros(max_num_blinks + 1)
+        bright_entry = self.first_bright_entry
+        for k in xrange(max_num_blinks + 1):
+            pmf[k] = numpy.dot(bright_entry, self.bright_end_prob)
+            bright_entry = numpy.dot(bright_entry, self.blink_cycle)
+        return pmf / activation_prob
@@ -70,6 +70,16 @@ class SingleDarkParameterSet(ParameterSet):
                                    fermi_T, fermi_tf])
         return param_array
 
+    def get_parameter_names(self):
+        """
+        Returns
+        -------
+        parameter_names : list
+            Names in the order of `as_array`.
+        """
+        return ['log_ka', 'log_kd', 'log_kr', 'log_kb', 'N', 'fermi_T',
+                'fermi_tf']
+
     def update_from_array(self, parameter_array):
         """
         Set parameter values from a numpy array. Useful because numpy arrays
@@ -180,6 +190,16 @@ class DoubleDarkParameterSet(ParameterSet):
         return numpy.array([log_ka, log_kd1, log_kr1, log_kd2, log_kr_diff,
                             log_kb, N, fermi_T, fermi_tf])
 
+    def get_parameter_names(self):
+        """
+        Returns
+        -------
+        parameter_names : list
+            Names in the order of `as_array`.
+        """
+        return ['log_ka', 'log_kd1', 'log_kr1', 'log_kd2', 'log_kr_diff',
+                'log_kb', 'N', 'fermi_T', 'fermi_tf']
+
     def update_from_array(self, parameter_array):
         """
         Set parameter values from a numpy array. Useful because numpy arrays
@@ -295,6 +315,16 @@ class ConnectedDarkParameterSet(ParameterSet):
         return numpy.array([log_ka, log_kd1, log_kr1, log_kd2, log_kr2,
                             log_kb, N, fermi_T, fermi_tf])
 
+    def get_parameter_names(self):
+        """
+        Returns
+        -------
+        parameter_names : list
+            Names in the order of `as_array`.
+        """
+        return ['log_ka', 'log_kd1', 'log_kr1', 'log_kd2', 'log_kr2',
+                'log_kb', 'N', 'fermi_T', 'fermi_tf']
+
     def update_from_array(self, parameter_array):
         """
         Set parameter values from a numpy array. Useful because numpy arrays
@@ -0,0 +1,243 @@
+import os
+import numpy
+from palm.rate_fcn import rate_from_rate_id, fermi_activation_rate,\
+                          get_max_fermi_activation_rate
+from palm.discrete_state_trajectory import TrajectorySegmentArrays,\
+                                           DEFAULT_CLASS_NAMES,\
+                                           CLASS_CODE_TYPE
+from palm.blink_target_data import make_collection_from_segment_arrays
+from palm.trajectory_store import write_segment_arrays_to_store
+from palm.util import make_random_state
+
+class BlinkSimulator(object):
+    """
+    Simulates aggregated dark/bright trajectories of a BlinkModel with
+    the Gillespie algorithm. All molecules are advanced in lockstep,
+    one reaction per molecule per step, with numpy operations over the
+    molecules rather than a Python loop.
+
+    With `fermi_activation`, activation rates vary with time. They rise
+    to a maximum at the stability limit of the Fermi function, so
+    activations are drawn at that maximum rate and accepted with
+    probability `ka(t) / ka_max` (thinning), which is exact.
+
+    Each simulated trajectory ends with a dark dwell that lasts from
+    the last class change until `post_bleach_time` after the molecule
+    reaches the all-bleached state, like an observation that continues
+    after the last fluorophore has bleached.
+
+    Attributes
+    ----------
+    state_id_list : list
+    class_names : list
+    state_class_codes : ndarray
+        Code in `class_names` of the aggregated class of each state.
+    constant_rates : ndarray
+        Rates between states that do not vary with time, without the
+        diagonal.
+    activation_multiplicity : ndarray
+        Multiplicity of the time-dependent activation routes.
+
+    Parameters
+    ----------
+    model : BlinkModel
+    post_bleach_time : float, optional
+    max_time : float, optional
+        Trajectories still unbleached at `max_time` are cut off there.
+    random_state : None, int or numpy.random.RandomState, optional
+    """
+    def __init__(self, model, post_bleach_time=1.0, max_time=None,
+                 random_state=None):
+        super(BlinkSimulator, self).__init__()
+        assert post_bleach_time > 0.0, "post_bleach_time must be positive."
+        self.post_bleach_time = post_bleach_time
+        self.max_time = max_time
+        self.random_state = make_random_state(random_state)
+        self.parameter_set = model.parameter_set
+        self.fermi_activation = model.fermi_activation
+        self.state_id_list = model.state_id_collection.as_list()
+        self.class_names = list(DEFAULT_CLASS_NAMES)
+        self.state_class_codes = numpy.array(
+            [self.class_names.index(model.state_class_by_id_dict[s])
+             for s in self.state_id_list], dtype=CLASS_CODE_TYPE)
+        self.initial_index = self.state_id_list.index(model.initial_state_id)
+        self.final_index = self.state_id_list.index(model.final_state_id)
+        num_states = len(self.state_id_list)
+        state_index_dict = dict((s, i) for i, s in
+                                enumerate(self.state_id_list))
+        self.constant_rates = numpy.zeros((num_states, num_states))
+        self.activation_multiplicity = numpy.zeros((num_states, num_states))
+        for r_id, r in model.route_collection.iter_routes():
+            i = state_index_dict[r['start_state']]
+            j = state_index_dict[r['end_state']]
+            rate_id = r['rate_id']
+            multiplicity = r['multiplicity']
+            if rate_id == 'ka' and self.fermi_activation:
+                self.activation_multiplicity[i, j] += multiplicity
+            else:
+                self.constant_rates[i, j] += multiplicity * rate_from_rate_id(
+                                                rate_id, 0.0,
+                                                self.parameter_set,
+                                                self.fermi_activation)
+        if self.fermi_activation:
+            self.max_activation_rate = get_max_fermi_activation_rate(
+                                        self.parameter_set)
+        else:
+            self.max_activation_rate = 0.0
+        self._build_jump_table()
+
+    def _build_jump_table(self):
+        # Each row lists the constant routes, then the activation routes
+        # at their maximum rate. A jump is drawn from the cumulative row.
+        bounding_rates = numpy.hstack([
+                            self.constant_rates,
+                            self.max_activation_rate *\
+                            self.activation_multiplicity])
+        self.bounding_exit_rates = bounding_rates.sum(axis=1)
+        is_absorbing = (self.bounding_exit_rates == 0.0)
+        self.bounding_exit_rates[is_absorbing] = 1.0
+        self.cumulative_jump_probs = numpy.cumsum(bounding_rates, axis=1) /\
+                                     self.bounding_exit_rates[:, None]
+        self.is_absorbing = is_absorbing
+
+    def simulate(self, num_molecules):
+        """
+        Parameters
+        ----------
+        num_molecules : int
+
+        Returns
+        -------
+        segment_arrays : TrajectorySegmentArrays
+            One trajectory per molecule.
+        """
+        random_state = self.random_state
+        num_states = len(self.state_id_list)
+        state = numpy.repeat(self.initial_index, num_molecules)
+        time = numpy.zeros(num_molecules)
+        end_time = numpy.zeros(num_molecules)
+        is_running = numpy.ones(num_molecules, dtype=bool)
+        is_running &= ~self.is_absorbing[state]
+        event_molecule_list = []
+        event_time_list = []
+        event_class_list = []
+        while is_running.any():
+            running_inds = numpy.flatnonzero(is_running)
+            current_state = state[running_inds]
+            step_time = time[running_inds] + random_state.exponential(
+                            1.0 / self.bounding_exit_rates[current_state])
+            if self.max_time is not None:
+                is_cut_off = step_time >= self.max_time
+                cut_off_inds = running_inds[is_cut_off]
+                end_time[cut_off_inds] = self.max_time
+                is_running[cut_off_inds] = False
+                running_inds = running_inds[~is_cut_off]
+                current_state = current_state[~is_cut_off]
+                step_time = step_time[~is_cut_off]
+            time[running_inds] = step_time
+            jump_probs = self.cumulative_jump_probs[current_state]
+            # scale by the row total so that rounding error in the
+            # cumulative sum cannot select a route with zero rate
+            u = random_state.rand(len(running_inds)) * jump_probs[:, -1]
+            jump = (jump_probs <= u[:, None]).sum(axis=1)
+            next_state = jump % num_states
+            is_accepted = (jump < num_states)
+            is_activation = ~is_accepted
+            if is_activation.any():
+                acceptance_prob = fermi_activation_rate(
+                                    step_time[is_activation],
+                                    self.parameter_set) /\
+                                  self.max_activation_rate
+                is_accepted[is_activation] =\
+                    random_state.rand(is_activation.sum()) < acceptance_prob
+            moved_inds = running_inds[is_accepted]
+            next_state = next_state[is_accepted]
+            moved_time = step_time[is_accepted]
+            next_class = self.state_class_codes[next_state]
+            is_class_change = (next_class !=
+                               self.state_class_codes[state[moved_inds]])
+            event_molecule_list.append(moved_inds[is_class_change])
+            event_time_list.append(moved_time[is_class_change])
+            event_class_list.append(next_class[is_class_change])
+            state[moved_inds] = next_state
+            is_finished = self.is_absorbing[next_state]
+            end_time[moved_inds[is_finished]] = moved_time[is_finished] +\
+                                                self.post_bleach_time
+            is_running[moved_inds[is_finished]] = False
+        return self._make_segment_arrays(
+                    num_molecules, end_time, event_molecule_list,
+                    event_time_list, event_class_list)
+
+    def _make_segment_arrays(self, num_molecules, end_time,
+                             event_molecule_list, event_time_list,
+                             event_class_list):
+        if len(event_molecule_list) > 0:
+            event_molecule = numpy.concatenate(event_molecule_list)
+            event_time = numpy.concatenate(event_time_list)
+            event_class = numpy.concatenate(event_class_list)
+        else:
+            event_molecule = numpy.zeros(0, dtype=int)
+            event_time = numpy.zeros(0)
+            event_class = numpy.zeros(0, dtype=CLASS_CODE_TYPE)
+        # events were recorded in time order, so a stable sort by
+        # molecule keeps each molecule's events in time order
+        order = numpy.argsort(event_molecule, kind='mergesort')
+        event_molecule = event_molecule[order]
+        event_time = event_time[order]
+        event_class = event_class[order]
+        num_events = numpy.bincount(event_molecule, minlength=num_molecules)
+        offsets = numpy.zeros(num_molecules + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum(num_events + 1)
+        num_segments = offsets[-1]
+        # every trajectory starts in the class of the initial state
+        start_times = numpy.zeros(num_segments)
+        class_codes = numpy.zeros(num_segments, dtype=CLASS_CODE_TYPE)
+        class_codes[offsets[:-1]] = self.state_class_codes[self.initial_index]
+        event_position = numpy.arange(len(event_molecule)) + event_molecule + 1
+        start_times[event_position] = event_time
+        class_codes[event_position] = event_class
+        stop_times = numpy.zeros(num_segments)
+        stop_times[:-1] = start_times[1:]
+        stop_times[offsets[1:] - 1] = end_time
+        durations = stop_times - start_times
+        return TrajectorySegmentArrays(class_codes, durations, offsets,
+                                       self.class_names)
+
+    def simulate_collection(self, num_molecules):
+        """
+        Returns
+        -------
+        collection : BlinkCollectionTargetData
+        """
+        segment_arrays = self.simulate(num_molecules)
+        return make_collection_from_segment_arrays(segment_arrays)
+
+    def simulate_to_store(self, num_molecules, store_file):
+        """
+        Simulates trajectories straight into a trajectory store.
+        """
+        segment_arrays = self.simulate(num_molecules)
+        write_segment_arrays_to_store(store_file, segment_arrays)
+
+    def simulate_to_csv_files(self, num_molecules, output_dir,
+                              file_prefix='sim_traj'):
+        """
+        Writes one csv file per trajectory, in the format read by
+        `BlinkTargetData`, plus a `traj_paths.txt` file listing them,
+        in the format read by `BlinkCollectionTargetData`.
+
+        Returns
+        -------
+        directory_file : string
+            Path of the list of csv files.
+        """
+        collection = self.simulate_collection(num_molecules)
+        directory_file = os.path.join(output_dir, 'traj_paths.txt')
+        with open(directory_file, 'w') as path_file:
+            for i, trajectory in enumerate(collection):
+                traj_path = os.path.join(output_dir,
+                                         "%s_%06d.csv" % (file_prefix, i))
+                with open(traj_path, 'w') as f:
+                    f.write(trajectory.to_csv_str())
+                path_file.write("%s\n" % traj_path)
+        return directory_file
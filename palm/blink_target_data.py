@@ -1,8 +1,46 @@
+import itertools
+import numpy
 import pandas
-from copy import deepcopy
 from palm.base.target_data import TargetData
 from palm.discrete_state_trajectory import DiscreteStateTrajectory,\
-                                           DiscreteDwellSegment
+                                           DiscreteDwellSegment,\
+                                           load_trajectory_from_csv,\
+                                           concatenate_trajectories
+
+def make_collection_from_segment_arrays(segment_arrays, paths=None):
+    """
+    Splits concatenated trajectories into a collection of trajectory
+    objects. The trajectories' arrays are slices of `segment_arrays`.
+
+    Parameters
+    ----------
+    segment_arrays : TrajectorySegmentArrays
+    paths : list, optional
+        Source of each trajectory, if any.
+
+    Returns
+    -------
+    collection : BlinkCollectionTargetData
+    """
+    collection = BlinkCollectionTargetData()
+    collection.target_data_collection = []
+    if paths is None:
+        paths = [''] * len(segment_arrays)
+    offsets = segment_arrays.offsets
+    for i in xrange(len(segment_arrays)):
+        trajectory_data = collection.trajectory_data_factory()
+        trajectory = trajectory_data.trajectory_factory(
+                        segment_arrays.class_names)
+        trajectory.segment_factory = trajectory_data.segment_factory
+        trajectory.set_segment_arrays(
+            segment_arrays.class_codes[offsets[i]:offsets[i+1]],
+            segment_arrays.durations[offsets[i]:offsets[i+1]])
+        trajectory_data.trajectory = trajectory
+        trajectory_data.filename = paths[i]
+        collection.target_data_collection.append(trajectory_data)
+    collection.paths = list(paths)
+    collection.segment_arrays = segment_arrays
+    return collection
 
 class BlinkTargetData(TargetData):
     """
@@ -29,6 +67,9 @@ class BlinkTargetData(TargetData):
         Represents a time trace of dark and bright observations.
     filename : string
         The trajectory data is loaded from this path.
+    preprocessor : TrajectoryPreprocessor or None
+        If set, applied to the trajectory when it is loaded.
+    preprocessing_report : PreprocessingReport or None
     """
     def __init__(self):
         super(BlinkTargetData, self).__init__()
@@ -36,6 +77,8 @@ class BlinkTargetData(TargetData):
         self.segment_factory = DiscreteDwellSegment
         self.trajectory = None
         self.filename = None
+        self.preprocessor = None
+        self.preprocessing_report = None
 
     def __len__(self):
         return len(self.trajectory)
@@ -50,14 +93,12 @@ class BlinkTargetData(TargetData):
             Path of file to load.
         """
         self.filename = data_file
-        data_table = pandas.read_csv(data_file, header=0)
-        self.trajectory = self.trajectory_factory()
-        for segment_data in data_table.itertuples():
-            segment_class = str(segment_data[1])
-            segment_dwell_time = float(segment_data[2])
-            new_segment = self.segment_factory(segment_class,
-                                               segment_dwell_time)
-            self.trajectory.add_segment(new_segment)
+        self.trajectory = load_trajectory_from_csv(data_file,
+                                                   self.trajectory_factory)
+        self.trajectory.segment_factory = self.segment_factory
+        if self.preprocessor is not None:
+            self.trajectory, self.preprocessing_report =\
+                self.preprocessor.preprocess_trajectory(self.trajectory)
 
     def get_feature(self):
         return self.trajectory
@@ -85,12 +126,31 @@ class BlinkCollectionTargetData(TargetData):
     paths : list
         Each trajectory is loaded from a file. `paths` is a list
         of the paths for these files.
+    weights : ndarray or None
+        Multiplicity of each trajectory, e.g. the number of times it
+        was drawn in a bootstrap resample. None means every trajectory
+        counts once.
+    segment_arrays : TrajectorySegmentArrays or None
+        Concatenated segments of all trajectories, built on first use
+        by `get_segment_arrays`.
+    preprocessor : TrajectoryPreprocessor or None
+        If set, applied to all trajectories at once after loading.
+    preprocessing_report : PreprocessingReport or None
+        Segments removed from each loaded trajectory. Trajectories
+        dropped as invalid are listed in the report but not loaded.
     """
+    # whether pickles refer to a file rather than hold the trajectories
+    is_store_backed = False
+
     def __init__(self):
         super(BlinkCollectionTargetData, self).__init__()
         self.trajectory_data_factory = BlinkTargetData
         self.target_data_collection = None
         self.paths = None
+        self.weights = None
+        self.segment_arrays = None
+        self.preprocessor = None
+        self.preprocessing_report = None
 
     def __len__(self):
         return len(self.target_data_collection)
@@ -112,6 +172,35 @@ class BlinkCollectionTargetData(TargetData):
             trajectory = blink_target.get_feature()
             yield trajectory
 
+    def iter_weighted_feature(self):
+        """
+        Iterate over trajectories in collection, along with their weights.
+
+        Returns
+        -------
+        trajectory : Trajectory
+        weight : float
+        """
+        for trajectory, weight in itertools.izip(self.iter_feature(),
+                                                 self.get_weights()):
+            yield trajectory, weight
+
+    def get_weights(self):
+        """
+        Returns
+        -------
+        weights : ndarray
+            Multiplicity of each trajectory. All ones if the collection
+            is unweighted.
+        """
+        if self.weights is None:
+            return numpy.ones(len(self))
+        else:
+            return self.weights
+
+    def get_total_weight(self):
+        return self.get_weights().sum()
+
     def get_total_number_of_trajectory_segments(self):
         """
         Each trajectory is made up of segments (aka dwells).
@@ -126,6 +215,22 @@ class BlinkCollectionTargetData(TargetData):
     def get_feature_by_index(self, index):
         return self.target_data_collection[index]
 
+    def get_segment_arrays(self):
+        """
+        The segments of every trajectory, concatenated. Built once and
+        kept; call `clear_segment_arrays` after changing trajectories.
+
+        Returns
+        -------
+        segment_arrays : TrajectorySegmentArrays
+        """
+        if self.segment_arrays is None:
+            self.segment_arrays = concatenate_trajectories(self.iter_feature())
+        return self.segment_arrays
+
+    def clear_segment_arrays(self):
+        self.segment_arrays = None
+
     def load_data(self, data_file):
         """
         Load a trajectory and add it to the collection.
@@ -137,12 +242,50 @@ class BlinkCollectionTargetData(TargetData):
         """
         self.target_data_collection = []
         self.paths = []
+        self.segment_arrays = None
         for traj_path in open(data_file, 'r'):
             traj_path = traj_path.strip()
             trajectory_data = self.trajectory_data_factory()
             trajectory_data.load_data(traj_path)
             self.target_data_collection.append(trajectory_data)
             self.paths.append(traj_path)
+        if self.preprocessor is not None:
+            self.apply_preprocessor(self.preprocessor)
+
+    def apply_preprocessor(self, preprocessor):
+        """
+        Preprocess every trajectory of the collection in one pass over
+        the concatenated segment arrays.
+
+        Parameters
+        ----------
+        preprocessor : TrajectoryPreprocessor
+
+        Returns
+        -------
+        report : PreprocessingReport
+        """
+        segment_arrays = concatenate_trajectories(self.iter_feature())
+        new_arrays, report = preprocessor.preprocess_arrays(segment_arrays)
+        offsets = new_arrays.offsets
+        for i, trajectory_data in enumerate(self.target_data_collection):
+            old_trajectory = trajectory_data.get_feature()
+            trajectory = old_trajectory.__class__(new_arrays.class_names)
+            trajectory.segment_factory = old_trajectory.segment_factory
+            trajectory.set_segment_arrays(
+                new_arrays.class_codes[offsets[i]:offsets[i+1]],
+                new_arrays.durations[offsets[i]:offsets[i+1]])
+            trajectory_data.trajectory = trajectory
+        if preprocessor.invalid_policy == 'drop':
+            valid_inds = numpy.flatnonzero(report.is_valid)
+            self.target_data_collection = [self.target_data_collection[i]
+                                           for i in valid_inds]
+            self.paths = [self.paths[i] for i in valid_inds]
+            if self.weights is not None:
+                self.weights = self.weights[valid_inds]
+        self.segment_arrays = None
+        self.preprocessing_report = report
+        return report
 
     def get_feature(self):
         return self.target_data_collection
@@ -159,7 +302,9 @@ class BlinkCollectionTargetData(TargetData):
     def make_copy_from_selection(self, inds):
         """
         Make a new collection with a subset of the trajectories
-        in this collection.
+        in this collection. The new collection is a view: it refers
+        to the trajectories of this collection by index and copies
+        none of them, so changes to a trajectory are seen by both.
 
         Parameters
         ----------
@@ -168,19 +313,40 @@ class BlinkCollectionTargetData(TargetData):
 
         Returns
         -------
-        my_clone : BlinkCollectionTargetData
+        my_clone : BlinkCollectionView
             New collection which contains only the selected trajectories.
         """
-        my_clone = deepcopy(self)
-        new_data_collection = []
-        new_paths = []
-        for i in inds:
-            this_traj = my_clone.target_data_collection[i]
-            this_path = my_clone.paths[i]
-            new_data_collection.append(this_traj)
-            new_paths.append(this_path)
-        my_clone.target_data_collection = new_data_collection
-        my_clone.paths = new_paths
+        inds = numpy.asarray(inds, dtype=int)
+        if self.weights is None:
+            new_weights = None
+        else:
+            new_weights = self.weights[inds]
+        my_clone = BlinkCollectionView(self, inds, new_weights)
+        return my_clone
+
+    def make_weighted_copy_from_selection(self, inds, weights):
+        """
+        Make a new collection with a subset of the trajectories in
+        this collection, each included once and weighted by its
+        multiplicity. Useful for bootstrap resamples, in which the
+        same trajectory is often drawn more than once.
+
+        Parameters
+        ----------
+        inds : list
+            The unique indices of the trajectories to include.
+        weights : list
+            Multiplicity of each selected trajectory.
+
+        Returns
+        -------
+        my_clone : BlinkCollectionTargetData
+        """
+        my_clone = self.make_copy_from_selection(inds)
+        new_weights = numpy.asarray(weights, dtype=numpy.float64)
+        if my_clone.weights is not None:
+            new_weights = new_weights * my_clone.weights
+        my_clone.weights = new_weights
         return my_clone
 
     def has_element(self, trajectory_to_search_for):
@@ -195,49 +361,118 @@ class BlinkCollectionTargetData(TargetData):
         return is_found
 
     def get_bright_time_distribution(self):
-        t_dist = []
-        for traj in self:
-            this_dist = traj.get_bright_time_distribution()
-            t_dist += this_dist
-        return pandas.Series(t_dist)
+        segment_arrays = self.get_segment_arrays()
+        return pandas.Series(segment_arrays.get_bright_times())
 
     def get_dark_time_distribution(self, exclude_first_dwell=True,
                                    exclude_last_dwell=True):
-        t_dist = []
-        for traj in self:
-            excluded_dwells = []
-            if exclude_first_dwell:
-                excluded_dwells.append(0)
-            if exclude_last_dwell:
-                excluded_dwells.append(traj.get_last_segment_number())
-            this_dist = traj.get_dark_time_distribution(excluded_dwells)
-            t_dist += this_dist
-        return pandas.Series(t_dist)
+        segment_arrays = self.get_segment_arrays()
+        return pandas.Series(segment_arrays.get_dark_times(
+                                exclude_first_dwell, exclude_last_dwell))
 
     def get_num_blink_distribution(self, exclude_first_dwell=True,
                                    exclude_last_dwell=True):
-        num_blink_dist = []
-        for traj in self:
-            excluded_dwells = []
-            if exclude_first_dwell:
-                excluded_dwells.append(0)
-            if exclude_last_dwell:
-                excluded_dwells.append(traj.get_last_segment_number())
-            this_num_blink = traj.get_num_blink(excluded_dwells)
-            num_blink_dist.append(this_num_blink)
-        return pandas.Series(num_blink_dist)
+        segment_arrays = self.get_segment_arrays()
+        num_blinks = segment_arrays.get_num_blinks(exclude_first_dwell,
+                                                   exclude_last_dwell)
+        return pandas.Series(num_blinks.astype(int))
 
     def get_bleach_time_distribution(self):
-        t_dist = []
-        for traj in self:
-            this_bleach_time = traj.get_bleach_time()
-            t_dist.append(this_bleach_time)
-        return pandas.Series(t_dist)            
+        segment_arrays = self.get_segment_arrays()
+        return pandas.Series(segment_arrays.get_bleach_times())
 
     def get_activation_time_distribution(self):
-        t_dist = []
-        for traj in self:
-            this_activation_time = traj.get_activation_time()
-            t_dist.append(this_activation_time)
-        return pandas.Series(t_dist)            
+        segment_arrays = self.get_segment_arrays()
+        return pandas.Series(segment_arrays.get_activation_times())
+
 
+class BlinkCollectionView(BlinkCollectionTargetData):
+    """
+    A subset of the trajectories of another collection. The view
+    stores the indices of the selected trajectories and a reference
+    to the parent collection; no trajectory data is copied.
+
+    Attributes
+    ----------
+    parent_collection : BlinkCollectionTargetData
+        The collection that owns the trajectories.
+    inds : ndarray
+        Indices into `parent_collection` of the trajectories in the view.
+
+    Parameters
+    ----------
+    parent_collection : BlinkCollectionTargetData
+    inds : list
+    weights : ndarray, optional
+    """
+    def __init__(self, parent_collection, inds, weights=None):
+        super(BlinkCollectionView, self).__init__()
+        self.trajectory_data_factory = parent_collection.trajectory_data_factory
+        self.parent_collection = parent_collection
+        self.inds = numpy.asarray(inds, dtype=int)
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.inds)
+
+    def __getstate__(self):
+        # a store-backed parent pickles as the path of its store; any
+        # other parent is replaced by a collection of just the selected
+        # trajectories, so that sending a small view to a worker process
+        # does not send the whole collection
+        state = self.__dict__.copy()
+        if not self.parent_collection.is_store_backed:
+            subset = BlinkCollectionTargetData()
+            subset.trajectory_data_factory = self.trajectory_data_factory
+            subset.target_data_collection = self.get_feature()
+            if self.parent_collection.get_paths() is not None:
+                subset.paths = self.get_paths()
+            state['parent_collection'] = subset
+            state['inds'] = numpy.arange(len(self.inds))
+        return state
+
+    def iter_feature(self):
+        for i in self.inds:
+            blink_target = self.parent_collection.get_feature_by_index(i)
+            yield blink_target.get_feature()
+
+    def get_feature_by_index(self, index):
+        return self.parent_collection.get_feature_by_index(self.inds[index])
+
+    def load_data(self, data_file):
+        assert False, "A view cannot load data, load the parent collection."
+
+    def get_segment_arrays(self):
+        parent_arrays = self.parent_collection.get_segment_arrays()
+        return parent_arrays.select(self.inds)
+
+    def get_feature(self):
+        return [self.parent_collection.get_feature_by_index(i)
+                for i in self.inds]
+
+    def get_paths(self):
+        parent_paths = self.parent_collection.get_paths()
+        return [parent_paths[i] for i in self.inds]
+
+    def make_copy_from_selection(self, inds):
+        """
+        Make a view of a subset of this view. The new view refers
+        directly to the parent collection, so views never nest.
+
+        Parameters
+        ----------
+        inds : list
+            Indices into this view.
+
+        Returns
+        -------
+        my_clone : BlinkCollectionView
+        """
+        inds = numpy.asarray(inds, dtype=int)
+        if self.weights is None:
+            new_weights = None
+        else:
+            new_weights = self.weights[inds]
+        my_clone = BlinkCollectionView(self.parent_collection,
+                                       self.inds[inds], new_weights)
+        return my_clone
@@ -1,17 +1,128 @@
-from sklearn.cross_validation import Bootstrap
+import numpy
 from palm.base.data_selector import DataSelector
+from palm.util import make_random_state
+
+class BootstrapSelection(object):
+    """
+    One bootstrap resample of a data set. Rather than listing every
+    drawn index, including duplicates, the resample is stored as the
+    unique indices that were drawn and the number of times each one
+    was drawn.
+
+    Parameters
+    ----------
+    inds : ndarray
+        Sorted, unique indices of the selected elements.
+    weights : ndarray
+        Multiplicity of each selected element. `weights[i]` is the
+        number of times `inds[i]` was drawn.
+    """
+    def __init__(self, inds, weights):
+        super(BootstrapSelection, self).__init__()
+        self.inds = inds
+        self.weights = weights
+
+    def __len__(self):
+        return int(self.weights.sum())
+
+    def __str__(self):
+        return "%s\n%s" % (self.inds, self.weights)
+
+    def get_num_unique(self):
+        return len(self.inds)
+
+    def as_index_array(self):
+        """
+        Expands the selection to one index per draw.
+
+        Returns
+        -------
+        index_array : ndarray
+        """
+        return numpy.repeat(self.inds, self.weights)
+
 
 class BootstrapSelector(DataSelector):
-    """Randomly samples a data set with replacement."""
-    def __init__(self):
+    """
+    Randomly samples a data set with replacement.
+
+    Parameters
+    ----------
+    random_state : None, int or numpy.random.RandomState, optional
+        Source of random numbers. Pass an int or a RandomState
+        to make the resamples reproducible.
+    """
+    def __init__(self, random_state=None):
         super(BootstrapSelector, self).__init__()
+        self.random_state = make_random_state(random_state)
+
+    def draw_selections(self, n, size, num_replicates=1):
+        """
+        Draws all bootstrap replicates at once.
+
+        Parameters
+        ----------
+        n : int
+            Number of elements in the data set.
+        size : int
+            Number of draws per replicate.
+        num_replicates : int, optional
+
+        Returns
+        -------
+        selection_list : list
+            One BootstrapSelection per replicate.
+        """
+        assert n > 0, "Cannot resample an empty data set."
+        draws = self.random_state.randint(0, n, size=(num_replicates, size))
+        draws.sort(axis=1)
+        # mark the first occurrence of each index within a replicate
+        is_new_index = numpy.ones(draws.shape, dtype=bool)
+        is_new_index[:, 1:] = (draws[:, 1:] != draws[:, :-1])
+        selection_list = []
+        for replicate_draws, replicate_is_new in zip(draws, is_new_index):
+            starts = numpy.flatnonzero(replicate_is_new)
+            inds = replicate_draws[starts]
+            weights = numpy.diff(numpy.append(starts, size))
+            selection_list.append(BootstrapSelection(inds, weights))
+        return selection_list
 
     def select_data(self, target_data, size):
-        n = len(target_data)
-        assert size <= n-1
-        bs = Bootstrap(n, 1, train_size=n-1)
-        train_index, test_index = bs.__iter__().next()
-        train_index = list(train_index)
-        inds = train_index[:size]
+        """
+        Resamples `target_data`, repeating elements that were drawn
+        more than once.
+
+        Returns
+        -------
+        new_target_data : TargetData
+        """
+        selection = self.draw_selections(len(target_data), size)[0]
+        inds = list(selection.as_index_array())
         new_target_data = target_data.make_copy_from_selection(inds)
         return new_target_data
+
+    def select_weighted_data(self, target_data, size, num_replicates=1):
+        """
+        Resamples `target_data`, keeping each drawn element once and
+        recording how many times it was drawn as its weight.
+
+        Parameters
+        ----------
+        target_data : BlinkCollectionTargetData
+        size : int
+            Number of draws per replicate.
+        num_replicates : int, optional
+
+        Returns
+        -------
+        new_target_data_list : list
+            One weighted collection per replicate.
+        """
+        selection_list = self.draw_selections(len(target_data), size,
+                                              num_replicates)
+        new_target_data_list = []
+        for selection in selection_list:
+            new_target_data = target_data.make_weighted_copy_from_selection(
+                                selection.inds, selection.weights)
+            new_target_data_list.append(new_target_data)
+        return new_target_data_list
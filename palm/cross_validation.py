@@ -0,0 +1,193 @@
+import copy
+import multiprocessing
+import numpy
+import pandas
+from palm.likelihood_judge import CollectionLikelihoodJudge
+from palm.scipy_optimizer import ScipyOptimizer
+from palm.score_function import ScoreFunction, make_worker_pool,\
+                                get_pool_worker_state
+from palm.util import make_random_state
+
+def _fit_fold(task):
+    return fit_fold(get_pool_worker_state(), *task)
+
+def fit_fold(state, candidate_index, N, fold_index):
+    """
+    Fits one candidate model with `N` fluorophores to all folds but one,
+    and computes the log likelihood of the held out fold in one pass.
+
+    Parameters
+    ----------
+    state : dict
+        The candidates, folds, target data, judge, data predictor and
+        optimizer of a CrossValidator.
+    candidate_index : int
+    N : int
+    fold_index : int
+
+    Returns
+    -------
+    row : dict
+    """
+    name, model_factory, initial_parameter_set =\
+        state['candidates'][candidate_index]
+    fold_list = state['fold_list']
+    target_data = state['target_data']
+    held_out_inds = fold_list[fold_index]
+    training_inds = numpy.sort(numpy.concatenate(
+                        [fold for i, fold in enumerate(fold_list)
+                         if i != fold_index]))
+    parameter_set = copy.deepcopy(initial_parameter_set)
+    parameter_set.set_parameter('N', N)
+    parameter_set.set_parameter_bounds('N', N, N)
+    training_data = target_data.make_copy_from_selection(training_inds)
+    score_fcn = ScoreFunction(model_factory, parameter_set, state['judge'],
+                              state['data_predictor'], training_data)
+    parameter_set, training_score = state['optimizer'].optimize_parameters(
+                                        score_fcn.compute_score,
+                                        parameter_set)
+    model = model_factory.create_model(parameter_set)
+    held_out_data = target_data.make_copy_from_selection(held_out_inds)
+    contributions = state['judge'].compute_contributions(
+                        model, state['data_predictor'], held_out_data)
+    weights = contributions.get_weights()
+    return {'model':name, 'N':N, 'fold':fold_index,
+            'training_score':training_score,
+            'held_out_log_likelihood':
+                (weights * contributions.get_log_likelihoods()).sum(),
+            'held_out_weight':weights.sum(),
+            'held_out_score':contributions.compute_score(),
+            'parameter_array':parameter_set.as_array()}
+
+
+class CrossValidator(object):
+    """
+    Compares models by k-fold cross-validation. The trajectories are
+    split at random into `num_folds` folds. For every candidate model,
+    every number of fluorophores `N` and every fold, the model is fitted
+    to the other folds, and the log likelihood of each held out
+    trajectory is computed in one pass with
+    `CollectionLikelihoodJudge.compute_contributions`. All fits run in
+    a process pool.
+
+    Attributes
+    ----------
+    fold_table : pandas.DataFrame
+        One row per fit, with the training score, the total and mean
+        held out log10 likelihood and the fitted parameter array.
+    summary_table : pandas.DataFrame
+        One row per model and `N`, best first, with the mean held out
+        log10 likelihood per trajectory over all folds, and its
+        standard deviation across folds.
+
+    Parameters
+    ----------
+    candidates : list
+        Tuples of a name, a ModelFactory and an initial ParameterSet.
+    N_values : list
+    data_predictor : DataPredictor
+    num_folds : int, optional
+    judge : CollectionLikelihoodJudge, optional
+    optimizer : ParameterOptimizer, optional
+        Defaults to ScipyOptimizer.
+    num_processes : int, optional
+        Defaults to the number of cpus. With one process, the fits run
+        in this process.
+    random_state : None, int or numpy.random.RandomState, optional
+    """
+    def __init__(self, candidates, N_values, data_predictor, num_folds=5,
+                 judge=None, optimizer=None, num_processes=None,
+                 random_state=None):
+        super(CrossValidator, self).__init__()
+        self.candidates = candidates
+        self.N_values = N_values
+        self.data_predictor = data_predictor
+        self.num_folds = num_folds
+        if judge is None:
+            judge = CollectionLikelihoodJudge()
+        self.judge = judge
+        if optimizer is None:
+            optimizer = ScipyOptimizer()
+        self.optimizer = optimizer
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+        self.num_processes = num_processes
+        self.random_state = make_random_state(random_state)
+        self.fold_list = None
+        self.fold_table = None
+        self.summary_table = None
+
+    def make_folds(self, target_data):
+        """
+        Returns
+        -------
+        fold_list : list
+            Sorted trajectory indices of each fold.
+        """
+        assert self.num_folds <= len(target_data),\
+               "More folds than trajectories."
+        order = self.random_state.permutation(len(target_data))
+        return [numpy.sort(fold) for fold in
+                numpy.array_split(order, self.num_folds)]
+
+    def cross_validate(self, target_data, noisy=False):
+        """
+        Parameters
+        ----------
+        target_data : BlinkCollectionTargetData
+        noisy : bool, optional
+
+        Returns
+        -------
+        summary_table : pandas.DataFrame
+        """
+        self.fold_list = self.make_folds(target_data)
+        state = {'candidates':self.candidates, 'fold_list':self.fold_list,
+                 'target_data':target_data, 'judge':self.judge,
+                 'data_predictor':self.data_predictor,
+                 'optimizer':self.optimizer}
+        task_list = [(candidate_index, N, fold_index)
+                     for candidate_index in xrange(len(self.candidates))
+                     for N in self.N_values
+                     for fold_index in xrange(self.num_folds)]
+        if self.num_processes > 1:
+            pool = make_worker_pool(self.num_processes, state)
+            try:
+                row_list = pool.map(_fit_fold, task_list)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            row_list = [fit_fold(state, *task) for task in task_list]
+        if noisy:
+            for row in row_list:
+                print "%s, N=%d, fold %d: held out score %.6f" %\
+                      (row['model'], row['N'], row['fold'],
+                       row['held_out_score'])
+        self.fold_table = pandas.DataFrame(
+                            row_list, columns=['model', 'N', 'fold',
+                                               'training_score',
+                                               'held_out_log_likelihood',
+                                               'held_out_weight',
+                                               'held_out_score',
+                                               'parameter_array'])
+        summary_list = []
+        for (name, N), group in self.fold_table.groupby(['model', 'N']):
+            fold_means = group['held_out_log_likelihood'] /\
+                         group['held_out_weight']
+            summary_list.append(
+                {'model':name, 'N':N,
+                 'mean_held_out_log_likelihood':
+                    group['held_out_log_likelihood'].sum() /\
+                    group['held_out_weight'].sum(),
+                 'fold_std':fold_means.std()})
+        summary_table = pandas.DataFrame(
+                            summary_list,
+                            columns=['model', 'N',
+                                     'mean_held_out_log_likelihood',
+                                     'fold_std'])
+        summary_table = summary_table.sort_index(
+                            by='mean_held_out_log_likelihood',
+                            ascending=False)
+        self.summary_table = summary_table.reset_index(drop=True)
+        return self.summary_table
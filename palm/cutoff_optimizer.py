@@ -0,0 +1,43 @@
+import numpy
+from palm.base.parameter_optimizer import ParameterOptimizer
+from palm.cutoff_predictor import make_cutoff_engine
+
+class ExactCutoffOptimizer(ParameterOptimizer):
+    """
+    Finds the best `tau` for a cutoff model exactly, rather than with
+    a gradient-based search of the piecewise-constant cutoff score.
+    `N` is held fixed and `tau` stays within its bounds. Takes the same
+    arguments as `ScipyOptimizer`, so it can replace it for a
+    `CutoffScoreFunction`.
+    """
+    def __init__(self):
+        super(ExactCutoffOptimizer, self).__init__()
+
+    def optimize_parameters(self, score_fcn, parameter_set, noisy=False):
+        """
+        Parameters
+        ----------
+        score_fcn : CutoffScoreFunction
+            Supplies the target data, a trajectory or a collection.
+        parameter_set : CutoffParameterSet
+            `tau` is modified in place.
+        noisy : bool, optional
+
+        Returns
+        -------
+        parameter_set : CutoffParameterSet
+        score : float
+        """
+        cutoff_engine = make_cutoff_engine(score_fcn.target_data)
+        N = parameter_set.get_parameter('N')
+        tau_bounds = parameter_set.get_parameter_bounds()[0]
+        lower, upper, score = cutoff_engine.find_best_tau_interval(
+                                N, tau_bounds)
+        if numpy.isinf(upper):
+            tau = lower
+        else:
+            tau = 0.5 * (lower + upper)
+        parameter_set.set_parameter('tau', tau)
+        if noisy:
+            print "tau in [%.4f, %.4f), score %.1f" % (lower, upper, score)
+        return parameter_set, score
@@ -78,6 +78,7 @@ class CutoffParameterSet(ParameterSet):
 
     def get_parameter_bounds(self):
         tau_bounds = self.bounds_dict['tau']
+        N = self.get_parameter('N')
         N_bounds = (N, N)
         bounds = [tau_bounds, N_bounds]
         return bounds
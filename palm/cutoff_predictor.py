@@ -1,6 +1,8 @@
 import numpy
 from palm.base.data_predictor import DataPredictor
 from palm.base.prediction import Prediction
+from palm.discrete_state_trajectory import DiscreteStateTrajectory,\
+                                           concatenate_trajectories
 
 class CutoffPrediction(Prediction):
     """docstring for CutoffPrediction"""
@@ -31,23 +33,225 @@ class CutoffPredictor(DataPredictor):
         return self.count_bundles(trajectory, tau)
 
     def count_bundles(self, trajectory, tau):
-        dark_dwell_list = []
-        # loop through trajectory segments, save dark dwell durations
-        for segment_number, segment in enumerate(trajectory):
-            if segment_number == 0:
-                assert segment.get_class() == 'dark'
-                continue
-            elif segment_number == 1:
-                assert segment.get_class() == 'bright'
-            elif segment_number == (len(trajectory) - 1):
-                assert segment.get_class() == 'dark'
-                continue
-            else:
-                if segment.get_class() == 'dark':
-                    dark_dwell_list.append(segment.get_duration())
-                else:
-                    continue
-        dd_array = numpy.array(dark_dwell_list)
-        num_bundles = len(numpy.where(dd_array > tau)[0])
+        segment_arrays = concatenate_trajectories([trajectory])
+        validate_cutoff_trajectories(segment_arrays)
+        dark_mask = segment_arrays.get_class_mask('dark') &\
+                    segment_arrays.make_interior_mask()
+        num_bundles = int(numpy.count_nonzero(
+                            segment_arrays.durations[dark_mask] > tau))
         num_bundles += 1  # trajectory starts with a dark dwell and an activation event
         return CutoffPrediction(num_bundles)
+
+
+def validate_cutoff_trajectories(segment_arrays):
+    """
+    Checks that every trajectory starts dark, then turns bright,
+    and ends dark.
+    """
+    segment_counts = segment_arrays.get_segment_counts()
+    assert (segment_counts > 0).all(), "Found an empty trajectory."
+    dark_mask = segment_arrays.get_class_mask('dark')
+    bright_mask = segment_arrays.get_class_mask('bright')
+    first_inds = segment_arrays.get_first_segment_inds()
+    last_inds = segment_arrays.get_last_segment_inds()
+    assert dark_mask[first_inds].all()
+    assert bright_mask[first_inds[segment_counts > 1] + 1].all()
+    assert dark_mask[last_inds[segment_counts > 2]].all()
+
+def make_cutoff_engine(target_data):
+    """
+    Parameters
+    ----------
+    target_data : DiscreteStateTrajectory, BlinkTargetData or
+                  BlinkCollectionTargetData
+
+    Returns
+    -------
+    cutoff_engine : CutoffEngine
+    """
+    if hasattr(target_data, 'get_segment_arrays'):
+        segment_arrays = target_data.get_segment_arrays()
+    elif isinstance(target_data, DiscreteStateTrajectory):
+        segment_arrays = concatenate_trajectories([target_data])
+    else:
+        segment_arrays = concatenate_trajectories([target_data.get_feature()])
+    return CutoffEngine(segment_arrays)
+
+
+class CutoffEngine(object):
+    """
+    Counts bundles for any number of cutoffs without revisiting the
+    trajectories. The interior dark dwells of each trajectory (all dark
+    dwells except the first and last) are sorted once, so the number
+    of dwells longer than `tau` is found by binary search.
+
+    Attributes
+    ----------
+    dark_dwells : ndarray
+        Interior dark dwells, sorted within each trajectory.
+    dwell_offsets : ndarray
+        The dwells of trajectory `i` are `dark_dwells[dwell_offsets[i]:
+        dwell_offsets[i+1]]`.
+
+    Parameters
+    ----------
+    segment_arrays : TrajectorySegmentArrays
+    """
+    def __init__(self, segment_arrays):
+        super(CutoffEngine, self).__init__()
+        validate_cutoff_trajectories(segment_arrays)
+        dark_mask = segment_arrays.get_class_mask('dark') &\
+                    segment_arrays.make_interior_mask()
+        dwells = segment_arrays.durations[dark_mask]
+        trajectory_index = segment_arrays.get_trajectory_index()[dark_mask]
+        order = numpy.lexsort((dwells, trajectory_index))
+        self.dark_dwells = dwells[order]
+        self.dwell_trajectory_index = trajectory_index[order]
+        self.num_trajectories = len(segment_arrays)
+        self.dwell_offsets = numpy.zeros(self.num_trajectories + 1,
+                                         dtype=numpy.int64)
+        if self.num_trajectories > 0:
+            self.dwell_offsets[1:] = numpy.cumsum(numpy.bincount(
+                trajectory_index, minlength=self.num_trajectories))
+
+    def __len__(self):
+        return self.num_trajectories
+
+    def get_num_dark_dwells(self):
+        return numpy.diff(self.dwell_offsets)
+
+    def search_dwells(self, tau):
+        """
+        Binary search of every trajectory's sorted dwells at once.
+
+        Parameters
+        ----------
+        tau : float or ndarray
+            One cutoff, or one cutoff per trajectory.
+
+        Returns
+        -------
+        inds : ndarray
+            For each trajectory, the index in `dark_dwells` of its
+            first dwell longer than `tau`.
+        """
+        lower = self.dwell_offsets[:-1].copy()
+        upper = self.dwell_offsets[1:].copy()
+        last_ind = max(len(self.dark_dwells) - 1, 0)
+        while True:
+            is_active = lower < upper
+            if not is_active.any():
+                break
+            middle = numpy.minimum((lower + upper) // 2, last_ind)
+            go_up = is_active & (self.dark_dwells[middle] <= tau)
+            go_down = is_active & ~go_up
+            lower[go_up] = middle[go_up] + 1
+            upper[go_down] = middle[go_down]
+        return lower
+
+    def count_bundles(self, tau):
+        """
+        Parameters
+        ----------
+        tau : float
+
+        Returns
+        -------
+        num_bundles : ndarray
+            Number of bundles of each trajectory.
+        """
+        first_long_inds = self.search_dwells(tau)
+        return 1 + self.dwell_offsets[1:] - first_long_inds
+
+    def count_bundles_for_taus(self, tau_array):
+        """
+        Parameters
+        ----------
+        tau_array : ndarray
+
+        Returns
+        -------
+        num_bundles : ndarray
+            `num_bundles[i, j]` is the number of bundles of trajectory
+            `i` at cutoff `tau_array[j]`.
+        """
+        tau_array = numpy.asarray(tau_array, dtype=numpy.float64)
+        tau_order = numpy.argsort(tau_array)
+        sorted_taus = tau_array[tau_order]
+        num_taus = len(tau_array)
+        # a dwell is longer than the first `tau_bin` cutoffs
+        tau_bin = numpy.searchsorted(sorted_taus, self.dark_dwells,
+                                     side='left')
+        flat_bin = self.dwell_trajectory_index * (num_taus + 1) + tau_bin
+        bin_counts = numpy.bincount(
+                        flat_bin,
+                        minlength=self.num_trajectories * (num_taus + 1))
+        bin_counts = bin_counts.reshape(self.num_trajectories, num_taus + 1)
+        # dwells longer than cutoff j are those in bins j+1 and above
+        longer_counts = numpy.cumsum(bin_counts[:, ::-1], axis=1)[:, ::-1]
+        num_bundles = numpy.zeros((self.num_trajectories, num_taus),
+                                  dtype=numpy.int64)
+        num_bundles[:, tau_order] = 1 + longer_counts[:, 1:]
+        return num_bundles
+
+    def find_best_tau_interval(self, N, tau_bounds=(None, None)):
+        """
+        Finds the cutoffs that minimize `sum(abs(num_bundles - N))` over
+        the trajectories, which for one trajectory is the score of
+        `CutoffJudge`. The score only changes where `tau` crosses a dark
+        dwell, so every distinct dwell is checked exactly.
+
+        Parameters
+        ----------
+        N : int
+        tau_bounds : tuple, optional
+            Lower and upper bound of `tau`, or None for no bound. Only
+            cutoffs within the bounds are searched.
+
+        Returns
+        -------
+        lower, upper : float
+            Every `tau` in `[lower, upper)` gives the best score within
+            the bounds, and so does `upper` when it is the upper bound.
+            The first such interval is returned.
+        score : float
+        """
+        num_dwells = self.get_num_dark_dwells()
+        num_bundles_at_zero = 1 + num_dwells
+        score_at_zero = numpy.abs(num_bundles_at_zero - N).sum()
+        if len(self.dark_dwells) == 0:
+            lower_list = numpy.array([0.0])
+            score_list = numpy.array([score_at_zero])
+        else:
+            # as tau passes the k-th shortest dwell of trajectory i,
+            # its bundle count drops from 1 + n_i - k to n_i - k
+            rank = numpy.arange(len(self.dark_dwells)) -\
+                   numpy.repeat(self.dwell_offsets[:-1], num_dwells)
+            count_before = 1 + num_dwells[self.dwell_trajectory_index] - rank
+            score_change = numpy.abs(count_before - 1 - N) -\
+                           numpy.abs(count_before - N)
+            order = numpy.argsort(self.dark_dwells, kind='mergesort')
+            sorted_dwells = self.dark_dwells[order]
+            scores = score_at_zero + numpy.cumsum(score_change[order])
+            # tied dwells are passed together
+            is_last_of_tie = numpy.ones(len(sorted_dwells), dtype=bool)
+            is_last_of_tie[:-1] = (sorted_dwells[1:] != sorted_dwells[:-1])
+            lower_list = numpy.append(0.0, sorted_dwells[is_last_of_tie])
+            score_list = numpy.append(score_at_zero, scores[is_last_of_tie])
+        upper_list = numpy.append(lower_list[1:], numpy.inf)
+        min_tau, max_tau = tau_bounds
+        if min_tau is not None:
+            lower_list = numpy.maximum(lower_list, min_tau)
+        if max_tau is not None:
+            assert min_tau is None or min_tau <= max_tau,\
+                   "Empty tau bounds %s." % str(tau_bounds)
+            upper_list = numpy.minimum(upper_list, max_tau)
+            # the upper bound itself is a valid cutoff
+            is_in_bounds = (lower_list < upper_list) |\
+                           (lower_list == max_tau)
+        else:
+            is_in_bounds = (lower_list < upper_list)
+        scores_in_bounds = numpy.where(is_in_bounds, score_list, numpy.inf)
+        best_ind = numpy.argmin(scores_in_bounds)
+        return lower_list[best_ind], upper_list[best_ind],\
+               float(score_list[best_ind])
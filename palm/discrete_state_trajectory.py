@@ -1,6 +1,293 @@
+import hashlib
 import numpy
+import pandas
 from palm.base.trajectory import TrajectorySegment, Trajectory
 
+DEFAULT_CLASS_NAMES = ('dark', 'bright')
+CLASS_CODE_TYPE = numpy.uint8
+
+def encode_class_labels(class_labels, class_names=DEFAULT_CLASS_NAMES):
+    """
+    Converts class names to integer class codes.
+
+    Parameters
+    ----------
+    class_labels : ndarray
+        The class name of each segment.
+    class_names : list, optional
+        Known class names. The code of a class is its index in this list.
+        Labels that are not in the list are appended to it.
+
+    Returns
+    -------
+    class_codes : ndarray
+    class_names : list
+    """
+    class_names = list(class_names)
+    unique_labels, inverse = numpy.unique(class_labels, return_inverse=True)
+    unique_codes = []
+    for label in unique_labels:
+        if label not in class_names:
+            class_names.append(label)
+        unique_codes.append(class_names.index(label))
+    unique_codes = numpy.array(unique_codes, dtype=CLASS_CODE_TYPE)
+    class_codes = unique_codes[inverse]
+    return class_codes, class_names
+
+def make_trajectory_from_arrays(class_codes, durations,
+                                class_names=DEFAULT_CLASS_NAMES,
+                                cumulative_times=None):
+    traj = DiscreteStateTrajectory(class_names)
+    traj.set_segment_arrays(class_codes, durations, cumulative_times)
+    return traj
+
+def load_trajectory_from_csv(data_file, trajectory_factory=None):
+    """
+    Loads a trajectory from a csv file in one pass, without creating
+    an object for each segment.
+    Expecting csv file with this format:
+        class,dwell time
+        dark,1.5
+        bright,0.3
+
+    Parameters
+    ----------
+    data_file : string
+    trajectory_factory : class, optional
+        A class that makes DiscreteStateTrajectory objects.
+
+    Returns
+    -------
+    trajectory : DiscreteStateTrajectory
+    """
+    if trajectory_factory is None:
+        trajectory_factory = DiscreteStateTrajectory
+    data_table = pandas.read_csv(data_file, header=0)
+    class_labels = data_table.iloc[:, 0].values.astype(str)
+    durations = data_table.iloc[:, 1].values.astype(numpy.float64)
+    class_codes, class_names = encode_class_labels(class_labels)
+    trajectory = trajectory_factory(class_names)
+    trajectory.set_segment_arrays(class_codes, durations)
+    return trajectory
+
+def concatenate_trajectories(trajectory_iter, class_names=DEFAULT_CLASS_NAMES):
+    """
+    Joins the segment arrays of many trajectories end to end.
+
+    Parameters
+    ----------
+    trajectory_iter : iterable of DiscreteStateTrajectory
+    class_names : list, optional
+        Class names to encode against. Classes that are not in the
+        list are appended to it.
+
+    Returns
+    -------
+    segment_arrays : TrajectorySegmentArrays
+    """
+    class_names = list(class_names)
+    code_list = []
+    duration_list = []
+    for trajectory in trajectory_iter:
+        # trajectories may number their classes differently,
+        # so re-encode them against the shared class names
+        translation = numpy.zeros(len(trajectory.class_names),
+                                  dtype=CLASS_CODE_TYPE)
+        for i, class_name in enumerate(trajectory.class_names):
+            if class_name not in class_names:
+                class_names.append(class_name)
+            translation[i] = class_names.index(class_name)
+        code_list.append(translation[trajectory.class_codes])
+        duration_list.append(trajectory.durations)
+    segment_counts = numpy.array([len(d) for d in duration_list],
+                                 dtype=numpy.int64)
+    offsets = numpy.zeros(len(segment_counts) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum(segment_counts)
+    if len(duration_list) > 0:
+        class_codes = numpy.concatenate(code_list).astype(CLASS_CODE_TYPE)
+        durations = numpy.concatenate(duration_list).astype(numpy.float64)
+    else:
+        class_codes = numpy.zeros(0, dtype=CLASS_CODE_TYPE)
+        durations = numpy.zeros(0, dtype=numpy.float64)
+    return TrajectorySegmentArrays(class_codes, durations, offsets,
+                                   class_names)
+
+
+class TrajectorySegmentArrays(object):
+    """
+    The segments of a collection of trajectories, concatenated into
+    flat arrays. Trajectory `i` is made of segments
+    `offsets[i]:offsets[i+1]`. Statistics of the collection are
+    computed with masks over these arrays rather than by visiting
+    each segment.
+
+    Parameters
+    ----------
+    class_codes : ndarray
+    durations : ndarray
+    offsets : ndarray
+        Length is one more than the number of trajectories.
+    class_names : list
+    """
+    def __init__(self, class_codes, durations, offsets,
+                 class_names=DEFAULT_CLASS_NAMES):
+        super(TrajectorySegmentArrays, self).__init__()
+        self.class_codes = class_codes
+        self.durations = durations
+        self.offsets = offsets
+        self.class_names = list(class_names)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_num_segments(self):
+        return len(self.durations)
+
+    def get_fingerprint(self):
+        """
+        Returns
+        -------
+        fingerprint : string
+            Hex digest of the segment arrays; equal for collections with
+            the same segments, across processes and runs.
+        """
+        digest = hashlib.sha1()
+        digest.update(",".join(self.class_names))
+        for a, dtype in [(self.class_codes, CLASS_CODE_TYPE),
+                         (self.durations, numpy.float64),
+                         (self.offsets, numpy.int64)]:
+            digest.update(numpy.ascontiguousarray(a, dtype=dtype).tostring())
+        return digest.hexdigest()
+
+    def get_segment_counts(self):
+        return numpy.diff(self.offsets)
+
+    def get_class_mask(self, class_name):
+        if class_name in self.class_names:
+            return (self.class_codes == self.class_names.index(class_name))
+        else:
+            return numpy.zeros(len(self.class_codes), dtype=bool)
+
+    def get_trajectory_index(self):
+        """
+        Returns
+        -------
+        trajectory_index : ndarray
+            The trajectory that each segment belongs to.
+        """
+        return numpy.repeat(numpy.arange(len(self)), self.get_segment_counts())
+
+    def get_first_segment_inds(self):
+        return self.offsets[:-1]
+
+    def get_last_segment_inds(self):
+        return self.offsets[1:] - 1
+
+    def make_interior_mask(self, exclude_first_dwell=True,
+                           exclude_last_dwell=True):
+        mask = numpy.ones(self.get_num_segments(), dtype=bool)
+        nonempty = self.get_segment_counts() > 0
+        if exclude_first_dwell:
+            mask[self.get_first_segment_inds()[nonempty]] = False
+        if exclude_last_dwell:
+            mask[self.get_last_segment_inds()[nonempty]] = False
+        return mask
+
+    def select(self, inds):
+        """
+        Gathers the segments of some of the trajectories.
+
+        Parameters
+        ----------
+        inds : ndarray
+            Indices of the trajectories to keep, in the order to keep them.
+
+        Returns
+        -------
+        segment_arrays : TrajectorySegmentArrays
+        """
+        inds = numpy.asarray(inds, dtype=numpy.int64)
+        starts = self.offsets[inds]
+        counts = self.offsets[inds + 1] - starts
+        new_offsets = numpy.zeros(len(inds) + 1, dtype=numpy.int64)
+        new_offsets[1:] = numpy.cumsum(counts)
+        segment_inds = numpy.arange(new_offsets[-1]) +\
+                       numpy.repeat(starts - new_offsets[:-1], counts)
+        return TrajectorySegmentArrays(self.class_codes[segment_inds],
+                                       self.durations[segment_inds],
+                                       new_offsets, self.class_names)
+
+    def get_cumulative_times(self):
+        """
+        Returns
+        -------
+        cumulative_times : ndarray
+            Time at the end of each segment, measured from the start
+            of its own trajectory.
+        """
+        cumulative_times = numpy.cumsum(self.durations)
+        segment_counts = self.get_segment_counts()
+        nonempty = segment_counts > 0
+        start_inds = self.get_first_segment_inds()[nonempty]
+        time_before_trajectory = numpy.zeros(len(self))
+        time_before_trajectory[nonempty] = cumulative_times[start_inds] -\
+                                           self.durations[start_inds]
+        cumulative_times -= numpy.repeat(time_before_trajectory,
+                                         segment_counts)
+        return cumulative_times
+
+    def sum_by_trajectory(self, segment_mask=None, weights=None):
+        """
+        Adds up `weights` (or counts segments, if no weights are given)
+        separately for each trajectory, using only the segments
+        selected by `segment_mask`.
+
+        Returns
+        -------
+        totals : ndarray
+        """
+        trajectory_index = self.get_trajectory_index()
+        if segment_mask is not None:
+            trajectory_index = trajectory_index[segment_mask]
+            if weights is not None:
+                weights = weights[segment_mask]
+        if len(self) == 0:
+            return numpy.zeros(0)
+        return numpy.bincount(trajectory_index, weights=weights,
+                              minlength=len(self))
+
+    def get_end_times(self):
+        return self.sum_by_trajectory(weights=self.durations)
+
+    def get_bright_times(self):
+        return self.durations[self.get_class_mask('bright')]
+
+    def get_dark_times(self, exclude_first_dwell=True,
+                       exclude_last_dwell=True):
+        mask = self.get_class_mask('dark') &\
+               self.make_interior_mask(exclude_first_dwell, exclude_last_dwell)
+        return self.durations[mask]
+
+    def get_num_blinks(self, exclude_first_dwell=True,
+                       exclude_last_dwell=True):
+        mask = self.get_class_mask('dark') &\
+               self.make_interior_mask(exclude_first_dwell, exclude_last_dwell)
+        return self.sum_by_trajectory(mask)
+
+    def get_activation_times(self):
+        first_inds = self.get_first_segment_inds()
+        assert self.get_class_mask('dark')[first_inds].all(),\
+               "Expected every trajectory to start dark."
+        return self.durations[first_inds]
+
+    def get_bleach_times(self):
+        last_inds = self.get_last_segment_inds()
+        assert self.get_class_mask('dark')[last_inds].all(),\
+               "Expected every trajectory to end dark."
+        return self.get_end_times() - self.get_activation_times() -\
+               self.durations[last_inds]
+
+
 class DiscreteDwellSegment(TrajectorySegment):
     """
     Dwells consist of an aggregated class and a dwell duration.
@@ -35,84 +322,164 @@ class DiscreteStateTrajectory(Trajectory):
     is made, which corresponds to one of a finite number of discrete
     aggregated classes. Each segment lasts for a finite length of time.
 
+    The segments are stored as arrays rather than as segment objects.
+    Segment objects are created on demand by `get_segment`, `__iter__`
+    and `reverse_iter`.
+
     Attributes
     ----------
-    segment_list : list
-        The segments that make up the trajectory.
-    cumulative_time_list : list
+    class_names : list
+        Aggregated class names. The class of a segment is stored as
+        its index in this list.
+    class_codes : ndarray
+        The class code (uint8) of each segment.
+    durations : ndarray
+        The duration (float64) of each segment.
+    cumulative_times : ndarray
         The time elapsed since the start of the trajectory.
         Element `i` is the time elapsed up to the end of segment `i`.
+    segment_factory : class
+        A class that makes TrajectorySegment objects.
+
+    Parameters
+    ----------
+    class_names : list, optional
     """
-    def __init__(self):
+    def __init__(self, class_names=DEFAULT_CLASS_NAMES):
         super(DiscreteStateTrajectory, self).__init__()
-        self.segment_list = []
-        self.cumulative_time_list = []
+        self.class_names = list(class_names)
+        self.class_codes = numpy.zeros(0, dtype=CLASS_CODE_TYPE)
+        self.durations = numpy.zeros(0, dtype=numpy.float64)
+        self.cumulative_times = numpy.zeros(0, dtype=numpy.float64)
+        self.segment_factory = DiscreteDwellSegment
 
     def __len__(self):
-        return len(self.segment_list)
+        return len(self.durations)
 
     def __str__(self):
         full_str = ""
-        for segment in self.segment_list:
+        for segment in self:
             segment_class = segment.get_class()
             segment_duration = segment.get_duration()
             full_str += "%s,%.4e\n" % (segment_class, segment_duration)
         return full_str
 
     def __iter__(self):
-        for segment in self.segment_list:
-            yield segment
+        class_code_list = self.class_codes.tolist()
+        duration_list = self.durations.tolist()
+        for class_code, duration in zip(class_code_list, duration_list):
+            yield self.segment_factory(self.class_names[class_code], duration)
 
     def __eq__(self, other_trajectory):
-        is_equal = True
-        for my_segment, other_segment in zip(self, other_trajectory):
-            if my_segment == other_segment:
-                continue
-            else:
-                is_equal = False
-                break
-        return is_equal
+        if len(self) != len(other_trajectory):
+            return False
+        classes_are_equal = numpy.array_equal(
+                                self.get_class_array(),
+                                other_trajectory.get_class_array())
+        durations_are_equal = numpy.array_equal(
+                                self.durations, other_trajectory.durations)
+        return classes_are_equal and durations_are_equal
+
+    def set_segment_arrays(self, class_codes, durations,
+                           cumulative_times=None):
+        """
+        Replace all segments of the trajectory at once.
+
+        Parameters
+        ----------
+        class_codes : ndarray
+            Index into `class_names` of the class of each segment.
+        durations : ndarray
+            Duration of each segment.
+        cumulative_times : ndarray, optional
+            Cumulative sum of `durations`. Computed if not given.
+        """
+        self.class_codes = numpy.asarray(class_codes, dtype=CLASS_CODE_TYPE)
+        self.durations = numpy.asarray(durations, dtype=numpy.float64)
+        if cumulative_times is None:
+            self.cumulative_times = numpy.cumsum(self.durations)
+        else:
+            self.cumulative_times = numpy.asarray(cumulative_times,
+                                                  dtype=numpy.float64)
 
     def add_segment(self, segment):
         """
         Add segment to trajectory. Assumes that this new segment comes after
-        the previously added segments.
+        the previously added segments. Each call copies the segment arrays,
+        so build long trajectories with `set_segment_arrays` instead.
 
         Parameters
         ----------
         segment : TrajectorySegment
         """
-        self.segment_list.append(segment)
+        class_code = self.get_class_code(segment.get_class(),
+                                         add_missing_class=True)
         segment_duration = segment.get_duration()
-        if len(self.cumulative_time_list) == 0:
+        if len(self) == 0:
             cumulative_time = 0.0 + segment_duration
         else:
-            cumulative_time = self.cumulative_time_list[-1] + segment_duration
-        self.cumulative_time_list.append(cumulative_time)
+            cumulative_time = self.cumulative_times[-1] + segment_duration
+        self.class_codes = numpy.append(self.class_codes, class_code).astype(
+                                CLASS_CODE_TYPE)
+        self.durations = numpy.append(self.durations, segment_duration)
+        self.cumulative_times = numpy.append(self.cumulative_times,
+                                             cumulative_time)
+
+    def get_class_code(self, class_name, add_missing_class=False):
+        """
+        Returns
+        -------
+        class_code : int
+            Index of `class_name` in `class_names`, or None if the class
+            is unknown and `add_missing_class` is False.
+        """
+        if class_name in self.class_names:
+            return self.class_names.index(class_name)
+        elif add_missing_class:
+            self.class_names.append(class_name)
+            return len(self.class_names) - 1
+        else:
+            return None
+
+    def get_class_array(self):
+        """
+        Returns
+        -------
+        class_array : ndarray
+            The class name of each segment.
+        """
+        return numpy.array(self.class_names)[self.class_codes]
 
     def get_segment(self, segment_number):
-        if segment_number < len(self.segment_list) and segment_number >= 0:
-            return self.segment_list[segment_number]
+        if segment_number < len(self) and segment_number >= 0:
+            class_code = self.class_codes[segment_number]
+            return self.segment_factory(
+                        self.class_names[class_code],
+                        float(self.durations[segment_number]))
         else:
             return None
 
+    def get_segment_class(self, segment_number):
+        return self.class_names[self.class_codes[segment_number]]
+
+    def get_segment_duration(self, segment_number):
+        return float(self.durations[segment_number])
+
     def get_cumulative_time(self, segment_number):
-        if segment_number < len(self.segment_list):
-            return self.cumulative_time_list[segment_number]
+        if segment_number < len(self):
+            return float(self.cumulative_times[segment_number])
         else:
             return None
 
     def get_end_time(self):
-        return self.cumulative_time_list[-1]
+        return float(self.cumulative_times[-1])
 
     def get_last_segment_number(self):
         return len(self) - 1
 
     def reverse_iter(self):
-        reverse_range = range(len(self.segment_list))
-        reverse_range.reverse()
-        for i in reverse_range:
-            yield (i, self.segment_list[i])
+        for i in xrange(len(self) - 1, -1, -1):
+            yield (i, self.get_segment(i))
 
     def to_csv_str(self):
         csv_str = "class,dwell time\n"
@@ -163,25 +530,22 @@ class DiscreteStateTrajectory(Trajectory):
         assert traj_array.shape[1] == 2
         return traj_array
 
+    def get_class_mask(self, class_name):
+        class_code = self.get_class_code(class_name)
+        if class_code is None:
+            return numpy.zeros(len(self), dtype=bool)
+        else:
+            return (self.class_codes == class_code)
+
     def get_bright_time_distribution(self):
-        t_dist = []
-        for segment in self:
-            if segment.get_class() == 'bright':
-                t_dist.append(segment.get_duration())
-        return t_dist
+        return self.durations[self.get_class_mask('bright')]
 
     def get_dark_time_distribution(self, excluded_dwells=[0,]):
-        t_dist = []
-        for i, segment in enumerate(self):
-            if i in excluded_dwells:
-                continue
-            else:
-                pass
-            if segment.get_class() == 'dark':
-                t_dist.append(segment.get_duration())
-            else:
-                pass
-        return t_dist
+        mask = self.get_class_mask('dark')
+        excluded_dwells = numpy.asarray(excluded_dwells, dtype=int)
+        in_range = (excluded_dwells >= 0) & (excluded_dwells < len(self))
+        mask[excluded_dwells[in_range]] = False
+        return self.durations[mask]
 
     def get_num_blink(self, excluded_dwells=[0,]):
         num_blink = len(self.get_dark_time_distribution(excluded_dwells))
@@ -1,15 +1,33 @@
-from palm.linalg import ScipyMatrixExponential2
-from palm.linalg import vector_matrix_product
-from palm.probability_vector import VectorTrajectory
-from palm.probability_vector import make_prob_vec_from_state_ids
+import numpy
+import pandas
+from palm.linalg import EigenGridExpm
 
 class Dynamics(object):
-    """docstring for Dynamics"""
+    """
+    Computes how the state occupancy probabilities of a model evolve
+    from its initial probability vector. All time points are computed
+    together by `EigenGridExpm`, from one decomposition of the rate matrix.
+
+    Parameters
+    ----------
+    noisy : bool, optional
+    """
     def __init__(self, noisy=False):
-        self.expm = ScipyMatrixExponential2()
+        self.expm = EigenGridExpm()
         self.noisy = noisy
 
     def compute_trajectory(self, model, time_array):
+        """
+        Parameters
+        ----------
+        model : AggregatedKineticModel
+        time_array : ndarray
+
+        Returns
+        -------
+        occupancy_frame : pandas.DataFrame
+            Probability of each state (columns) at each time (rows).
+        """
         init_prob_vec = model.get_initial_probability_vector()
         Q = model.build_rate_matrix(0.0)
 
@@ -17,16 +35,15 @@ class Dynamics(object):
             print init_prob_vec
             print Q
 
-        vec_traj = VectorTrajectory(model.state_id_collection)
-        for i,t in enumerate(time_array):
-            try:
-                eQt = self.expm.compute_matrix_exp(Q, t)
-            except ValueError:
-                print "eQt not finite at %d, %.2e" % (i, t)
-                print Q
-                break
-            prob_vec_at_time_t = vector_matrix_product(
-                                    init_prob_vec, eQt,
-                                    do_alignment=True)
-            vec_traj.add_vector(t, prob_vec_at_time_t)
-        return vec_traj
+        state_id_list = Q.get_index_id_list()
+        init_prob_array = init_prob_vec.series.reindex(
+                            state_id_list).fillna(0.0).values
+        occupancy_array = self.expm.compute_vector_expm_grid(
+                            Q.as_npy_array(), init_prob_array, time_array)
+        if not numpy.isfinite(occupancy_array).all():
+            print "Occupancy probabilities not finite."
+        occupancy_frame = pandas.DataFrame(occupancy_array,
+                                           index=numpy.asarray(time_array),
+                                           columns=state_id_list)
+        occupancy_frame.index.name = 'time'
+        return occupancy_frame
@@ -0,0 +1,301 @@
+import cPickle
+import numpy
+from palm.parameter_set_distribution import ParamSetDistFactory
+from palm.score_function import compute_scores, make_worker_pool,\
+                                get_pool_worker_state
+from palm.util import make_random_state
+
+def _evaluate_block(parameter_matrix):
+    return compute_scores(get_pool_worker_state(), parameter_matrix)
+
+
+class EnsembleSampler(object):
+    """
+    Samples the posterior distribution of the free parameters with the
+    affine-invariant ensemble sampler of Goodman and Weare (stretch
+    moves). The prior is uniform within the parameter bounds, which for
+    log rates is a log-uniform prior on the rates.
+
+    The log posterior is computed from the score of a ScoreFunction,
+    minus the average log10 likelihood per trajectory, as
+    ``-score * total_weight * ln(10)``, where `total_weight` is the
+    number of trajectories of the target data (or the sum of their
+    weights).
+
+    The walkers are split into two halves that are moved in turn, each
+    with respect to the other, so all proposals of a half are scored
+    together. They are split into one block per process, and each block
+    is scored by `ScoreFunction.compute_scores`, in one pass over the
+    data if the judge and predictor support batches.
+
+    Attributes
+    ----------
+    chain_list : list
+        Full parameter arrays of every walker, one array per step.
+    log_posterior_list : list
+        Log posterior of every walker, one array per step.
+    num_accepted : ndarray
+        Accepted moves of each walker.
+
+    Parameters
+    ----------
+    score_fcn : ScoreFunction
+    num_walkers : int, optional
+        Defaults to four times the number of free parameters. Must be
+        even and more than twice the number of free parameters.
+    num_processes : int, optional
+    stretch_scale : float, optional
+        The `a` parameter of the stretch move.
+    initial_spread : float, optional
+        Walkers start in a Gaussian ball of this width around the
+        parameter set of `score_fcn`, such as a maximum likelihood fit.
+    default_bounds : tuple, optional
+        Prior range for parameters without bounds.
+    total_weight : float, optional
+        Defaults to the sum of the weights of the target data.
+    random_state : None, int or numpy.random.RandomState, optional
+    """
+    def __init__(self, score_fcn, num_walkers=None, num_processes=1,
+                 stretch_scale=2.0, initial_spread=1e-2,
+                 default_bounds=(-3.0, 3.0), total_weight=None,
+                 random_state=None):
+        super(EnsembleSampler, self).__init__()
+        self.score_fcn = score_fcn
+        self.parameter_set = score_fcn.parameter_set
+        self.num_processes = num_processes
+        self.stretch_scale = stretch_scale
+        self.initial_spread = initial_spread
+        self.random_state = make_random_state(random_state)
+        if total_weight is None:
+            total_weight = float(score_fcn.target_data.get_weights().sum())
+        self.log_likelihood_scale = total_weight * numpy.log(10.0)
+        self.template_array = numpy.asarray(self.parameter_set.as_array(),
+                                            dtype=float)
+        free_inds = []
+        lower_list = []
+        upper_list = []
+        for j, (lower, upper) in enumerate(
+                                    self.parameter_set.get_parameter_bounds()):
+            if lower is not None and lower == upper:
+                continue
+            free_inds.append(j)
+            lower_list.append(default_bounds[0] if lower is None else lower)
+            upper_list.append(default_bounds[1] if upper is None else upper)
+        self.free_inds = numpy.array(free_inds)
+        self.lower = numpy.array(lower_list, dtype=float)
+        self.upper = numpy.array(upper_list, dtype=float)
+        num_dims = len(self.free_inds)
+        if num_walkers is None:
+            num_walkers = 4 * num_dims
+        assert num_walkers % 2 == 0 and num_walkers > 2 * num_dims,\
+               "num_walkers must be even and more than twice the number"\
+               " of free parameters."
+        self.num_walkers = num_walkers
+        self.positions = None
+        self.log_posteriors = None
+        self.chain_list = []
+        self.log_posterior_list = []
+        self.num_accepted = numpy.zeros(num_walkers, dtype=int)
+        self.pool = None
+
+    def start(self):
+        if self.num_processes > 1 and self.pool is None:
+            self.pool = make_worker_pool(self.num_processes, self.score_fcn)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def to_parameter_array(self, position):
+        parameter_array = self.template_array.copy()
+        parameter_array[self.free_inds] = position
+        return parameter_array
+
+    def compute_log_posteriors(self, positions):
+        """
+        Parameters
+        ----------
+        positions : ndarray
+            Free parameter values, one row per walker.
+
+        Returns
+        -------
+        log_posteriors : ndarray
+            Minus infinity outside the bounds.
+        """
+        is_inside = ((positions >= self.lower) &
+                     (positions <= self.upper)).all(axis=1)
+        log_posteriors = -numpy.inf * numpy.ones(len(positions))
+        inside_inds = numpy.flatnonzero(is_inside)
+        if len(inside_inds) == 0:
+            return log_posteriors
+        parameter_matrix = numpy.array([self.to_parameter_array(p) for p in
+                                        positions[inside_inds]])
+        if self.pool is not None:
+            blocks = numpy.array_split(parameter_matrix,
+                                       min(self.num_processes,
+                                           len(parameter_matrix)))
+            scores = numpy.concatenate(self.pool.map(_evaluate_block,
+                                                     blocks))
+        else:
+            scores = compute_scores(self.score_fcn, parameter_matrix)
+        log_posteriors[inside_inds] = -self.log_likelihood_scale * scores
+        return log_posteriors
+
+    def initialize_walkers(self):
+        center = self.template_array[self.free_inds]
+        positions = center + self.initial_spread *\
+                    self.random_state.randn(self.num_walkers, len(center))
+        self.positions = numpy.clip(positions, self.lower, self.upper)
+        self.log_posteriors = self.compute_log_posteriors(self.positions)
+
+    def step(self):
+        """
+        Moves each half of the walkers once.
+        """
+        num_dims = len(self.free_inds)
+        half = self.num_walkers // 2
+        a = self.stretch_scale
+        for moving, fixed in [(slice(0, half), slice(half, None)),
+                              (slice(half, None), slice(0, half))]:
+            moving_positions = self.positions[moving]
+            fixed_positions = self.positions[fixed]
+            num_moving = len(moving_positions)
+            z = ((a - 1.0) * self.random_state.rand(num_moving) + 1.0)**2 / a
+            partners = fixed_positions[self.random_state.randint(
+                                        len(fixed_positions),
+                                        size=num_moving)]
+            proposals = partners + z[:, None] * (moving_positions - partners)
+            proposal_log_posteriors = self.compute_log_posteriors(proposals)
+            log_accept_prob = (num_dims - 1.0) * numpy.log(z) +\
+                              proposal_log_posteriors -\
+                              self.log_posteriors[moving]
+            is_accepted = numpy.log(self.random_state.rand(num_moving)) <\
+                          log_accept_prob
+            moving_inds = numpy.arange(self.num_walkers)[moving][is_accepted]
+            self.positions[moving_inds] = proposals[is_accepted]
+            self.log_posteriors[moving_inds] =\
+                proposal_log_posteriors[is_accepted]
+            self.num_accepted[moving_inds] += 1
+
+    def run(self, num_steps, checkpoint_file=None, checkpoint_interval=10,
+            noisy=False):
+        """
+        Runs `num_steps` more steps, continuing from the current walkers
+        (for instance, after `load_checkpoint`).
+
+        Parameters
+        ----------
+        num_steps : int
+        checkpoint_file : string, optional
+            Written every `checkpoint_interval` steps and at the end.
+        checkpoint_interval : int, optional
+        noisy : bool, optional
+
+        Returns
+        -------
+        chain : ndarray
+            See `get_chain`.
+        """
+        self.start()
+        try:
+            if self.positions is None:
+                self.initialize_walkers()
+            for i in xrange(num_steps):
+                self.step()
+                self.chain_list.append(numpy.array(
+                    [self.to_parameter_array(p) for p in self.positions]))
+                self.log_posterior_list.append(self.log_posteriors.copy())
+                if noisy:
+                    print "step %d, max log posterior %.4f" %\
+                          (len(self.chain_list) - 1,
+                           self.log_posteriors.max())
+                if checkpoint_file is not None and\
+                   (i + 1) % checkpoint_interval == 0:
+                    self.save_checkpoint(checkpoint_file)
+            if checkpoint_file is not None:
+                self.save_checkpoint(checkpoint_file)
+        finally:
+            self.stop()
+        return self.get_chain()
+
+    def get_chain(self):
+        """
+        Returns
+        -------
+        chain : ndarray
+            Full parameter arrays of every walker at every step, with
+            shape (steps, walkers, parameters).
+        """
+        return numpy.array(self.chain_list).reshape(
+                (len(self.chain_list), self.num_walkers,
+                 len(self.template_array)))
+
+    def get_log_posterior_chain(self):
+        return numpy.array(self.log_posterior_list).reshape(
+                (len(self.log_posterior_list), self.num_walkers))
+
+    def get_acceptance_fraction(self):
+        num_steps = max(len(self.chain_list), 1)
+        return self.num_accepted / float(num_steps)
+
+    def save_checkpoint(self, filename):
+        """
+        Saves the chains, the walkers and the state of the random
+        number generator, so that `run` can continue after
+        `load_checkpoint` as if it had not stopped.
+        """
+        state = {'positions':self.positions,
+                 'log_posteriors':self.log_posteriors,
+                 'chain_list':self.chain_list,
+                 'log_posterior_list':self.log_posterior_list,
+                 'num_accepted':self.num_accepted,
+                 'random_state':self.random_state.get_state()}
+        with open(filename, 'wb') as f:
+            cPickle.dump(state, f, 2)
+
+    def load_checkpoint(self, filename):
+        with open(filename, 'rb') as f:
+            state = cPickle.load(f)
+        assert state['positions'].shape ==\
+               (self.num_walkers, len(self.free_inds)),\
+               "Checkpoint does not match the walkers of this sampler."
+        self.positions = state['positions']
+        self.log_posteriors = state['log_posteriors']
+        self.chain_list = state['chain_list']
+        self.log_posterior_list = state['log_posterior_list']
+        self.num_accepted = state['num_accepted']
+        self.random_state.set_state(state['random_state'])
+
+    def make_parameter_set_distribution(self, burn_in=0, thin=1):
+        """
+        Parameters
+        ----------
+        burn_in : int, optional
+            Steps discarded from the start of the chains.
+        thin : int, optional
+            Keep every `thin`-th step.
+
+        Returns
+        -------
+        psd : ParameterSetDistribution
+            One row per kept sample, with every parameter, the log
+            posterior, and the walker and step of the sample.
+        """
+        psd_factory = ParamSetDistFactory()
+        parameter_set = self.parameter_set
+        saved_array = parameter_set.as_array()
+        for step_index in xrange(burn_in, len(self.chain_list), thin):
+            for walker_index in xrange(self.num_walkers):
+                parameter_set.update_from_array(
+                    self.chain_list[step_index][walker_index])
+                psd_factory.add_parameter_set(parameter_set)
+                psd_factory.add_parameter(
+                    'log_posterior',
+                    self.log_posterior_list[step_index][walker_index])
+                psd_factory.add_parameter('walker', walker_index)
+                psd_factory.add_parameter('step', step_index)
+        parameter_set.update_from_array(saved_array)
+        return psd_factory.make_psd()
@@ -1,4 +1,10 @@
+import multiprocessing
+import time
+import numpy
+import pandas
 from palm.base.judge import Judge
+from palm.blink_distributions import BlinkDistributionEngine
+from palm.util import ALMOST_ZERO
 # import memory_profiler as mprof
 
 class LikelihoodJudge(Judge):
@@ -23,23 +29,418 @@ class CollectionLikelihoodJudge(Judge):
     """
     Judges how well a model fits a collection of data on the basis
     of log likelihood. This class delegates the calculation of the 
-    likelihood to the data predictor.
+    likelihood to the data predictor. If the collection is weighted,
+    as for a bootstrap resample, each unique trajectory is evaluated
+    once and its log likelihood is multiplied by its weight.
     """
     def __init__(self):
         super(CollectionLikelihoodJudge, self).__init__()
 
     def judge_prediction(self, model, data_predictor, target_data):
-        # pdb.set_trace()
         total_log_likelihood = 0.0
-        for i, trajectory in enumerate(target_data):
+        total_weight = 0.0
+        for trajectory, weight in target_data.iter_weighted_feature():
             prediction = data_predictor.predict_data(model, trajectory)
             prediction_array = prediction.as_array()
             log_likelihood = prediction_array[0]
-            total_log_likelihood += log_likelihood
-        avg_log_likelihood = total_log_likelihood / len(target_data)
+            total_log_likelihood += weight * log_likelihood
+            total_weight += weight
+        avg_log_likelihood = total_log_likelihood / total_weight
         score = -avg_log_likelihood
+        return score
+
+    def judge_predictions(self, model_list, data_predictor, target_data):
+        """
+        Judges a batch of models in one pass over the collection, with
+        a data predictor that has `prepare_batch` and
+        `predict_data_batch`, such as `BackwardPredictor`.
+
+        Returns
+        -------
+        scores : ndarray
+            The score of each model.
+        """
+        batch = data_predictor.prepare_batch(model_list)
+        total_log_likelihood = numpy.zeros(len(model_list))
+        total_weight = 0.0
+        for trajectory, weight in target_data.iter_weighted_feature():
+            log_likelihoods = data_predictor.predict_data_batch(batch,
+                                                                trajectory)
+            total_log_likelihood += weight * log_likelihoods
+            total_weight += weight
+        avg_log_likelihood = total_log_likelihood / total_weight
+        scores = -avg_log_likelihood
+        return scores
+
+    def compute_contributions(self, model, data_predictor, target_data):
+        """
+        Computes the log likelihood of each trajectory in one pass over
+        the collection, so that scores of subsets and reweightings of
+        the collection need no further likelihood calculations.
+
+        Returns
+        -------
+        contributions : TrajectoryContributions
+        """
+        log_likelihood_list = []
+        weight_list = []
+        num_segments_list = []
+        time_list = []
+        for trajectory, weight in target_data.iter_weighted_feature():
+            start_time = time.time()
+            prediction = data_predictor.predict_data(model, trajectory)
+            time_list.append(time.time() - start_time)
+            log_likelihood_list.append(prediction.as_array()[0])
+            weight_list.append(weight)
+            num_segments_list.append(len(trajectory))
+        return TrajectoryContributions(log_likelihood_list, weight_list,
+                                       num_segments_list, time_list)
+
+
+class TrajectoryContributions(object):
+    """
+    The log10 likelihood of each trajectory of a collection, with the
+    weight, the number of segments and the time spent computing the
+    likelihood of each trajectory.
+
+    Attributes
+    ----------
+    contribution_table : pandas.DataFrame
+        One row per trajectory, in the order of the collection.
+
+    Parameters
+    ----------
+    log_likelihoods : list
+    weights : list
+    num_segments : list
+    evaluation_times : list
+    """
+    def __init__(self, log_likelihoods, weights, num_segments,
+                 evaluation_times):
+        super(TrajectoryContributions, self).__init__()
+        self.contribution_table = pandas.DataFrame(
+                                    {'log_likelihood':log_likelihoods,
+                                     'weight':weights,
+                                     'num_segments':num_segments,
+                                     'evaluation_time':evaluation_times},
+                                    columns=['log_likelihood', 'weight',
+                                             'num_segments',
+                                             'evaluation_time'])
+
+    def __len__(self):
+        return len(self.contribution_table)
+
+    def get_log_likelihoods(self):
+        return self.contribution_table['log_likelihood'].values
+
+    def get_weights(self):
+        return self.contribution_table['weight'].values
+
+    def compute_score(self, weights=None, inds=None):
+        """
+        Computes the score, minus the weighted average log likelihood,
+        as `CollectionLikelihoodJudge` would for a subset or a
+        reweighting of the collection.
+
+        Parameters
+        ----------
+        weights : ndarray, optional
+            Weight of each trajectory; defaults to the collection weights.
+            Zero weights drop trajectories, as in a bootstrap resample.
+        inds : list, optional
+            Indices of the trajectories to include; defaults to all.
 
-        # print mprof.memory_usage()
-        # pdb.set_trace()
+        Returns
+        -------
+        score : float
+        """
+        log_likelihoods = self.get_log_likelihoods()
+        if weights is None:
+            weights = self.get_weights()
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        if inds is not None:
+            log_likelihoods = log_likelihoods[inds]
+            weights = weights[inds]
+        avg_log_likelihood = (weights * log_likelihoods).sum() / weights.sum()
+        return -avg_log_likelihood
+
+    def compute_jackknife_scores(self):
+        """
+        Returns
+        -------
+        scores : ndarray
+            The score of the collection without each trajectory in turn.
+        """
+        weighted_log_likelihoods = self.get_weights() *\
+                                   self.get_log_likelihoods()
+        total_weight = self.get_weights().sum()
+        return -(weighted_log_likelihoods.sum() - weighted_log_likelihoods) /\
+               (total_weight - self.get_weights())
+
+    def find_outliers(self, num_outliers=10):
+        """
+        Returns
+        -------
+        outlier_table : pandas.DataFrame
+            The rows of the trajectories with the lowest log likelihood
+            per segment, worst first, with that value as a column.
+        """
+        table = self.contribution_table.copy()
+        table['log_likelihood_per_segment'] = table['log_likelihood'] /\
+                                              table['num_segments']
+        table = table.sort_index(by='log_likelihood_per_segment')
+        return table[:num_outliers]
+
+
+class StreamingCollectionLikelihoodJudge(Judge):
+    """
+    Judges a collection that is read from disk chunk by chunk, such as
+    `StreamingBlinkCollectionTargetData`. Only the running sums and the
+    chunks currently in flight are held in memory. Trajectories are
+    scored in the same order as by `CollectionLikelihoodJudge`, so
+    both judges give the same score.
+    """
+    def __init__(self):
+        super(StreamingCollectionLikelihoodJudge, self).__init__()
+
+    def judge_prediction(self, model, data_predictor, target_data):
+        total_log_likelihood = 0.0
+        total_weight = 0.0
+        weights = target_data.get_weights()
+        trajectory_index = 0
+        for trajectory_list in target_data.iter_chunks():
+            for trajectory in trajectory_list:
+                prediction = data_predictor.predict_data(model, trajectory)
+                prediction_array = prediction.as_array()
+                log_likelihood = prediction_array[0]
+                weight = weights[trajectory_index]
+                total_log_likelihood += weight * log_likelihood
+                total_weight += weight
+                trajectory_index += 1
+        avg_log_likelihood = total_log_likelihood / total_weight
+        score = -avg_log_likelihood
+        return score
+
+
+def _judge_block(args):
+    model_factory, parameter_set, data_predictor, target_data = args
+    model = model_factory.create_model(parameter_set)
+    total_log_likelihood = 0.0
+    total_weight = 0.0
+    for trajectory, weight in target_data.iter_weighted_feature():
+        prediction = data_predictor.predict_data(model, trajectory)
+        prediction_array = prediction.as_array()
+        log_likelihood = prediction_array[0]
+        total_log_likelihood += weight * log_likelihood
+        total_weight += weight
+    return total_log_likelihood, total_weight
 
+
+class ParallelCollectionLikelihoodJudge(Judge):
+    """
+    Judges a collection with a pool of worker processes. The collection
+    is split into blocks of trajectories with `make_copy_from_selection`
+    and each block is scored by a worker. Models hold unpicklable route
+    mappers, so the workers rebuild the model from its parameter set.
+
+    For the data to be shared rather than copied, `target_data` should
+    be attached to a `SharedTrajectoryBuffer` (or be any other
+    `StoredBlinkCollectionTargetData`), so that each block is sent to
+    the workers as a store name and an index array.
+
+    Parameters
+    ----------
+    model_factory : ModelFactory
+        Factory that made the models being judged.
+    num_processes : int, optional
+        Defaults to the number of cpus.
+    num_blocks : int, optional
+        Number of blocks the collection is split into.
+        Defaults to `num_processes`.
+    """
+    def __init__(self, model_factory, num_processes=None, num_blocks=None):
+        super(ParallelCollectionLikelihoodJudge, self).__init__()
+        self.model_factory = model_factory
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+        self.num_processes = num_processes
+        if num_blocks is None:
+            num_blocks = num_processes
+        self.num_blocks = num_blocks
+        self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def start(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.num_processes)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def judge_prediction(self, model, data_predictor, target_data):
+        self.start()
+        all_inds = numpy.arange(len(target_data))
+        num_blocks = min(self.num_blocks, len(target_data))
+        task_list = []
+        for block_inds in numpy.array_split(all_inds, num_blocks):
+            block_data = target_data.make_copy_from_selection(block_inds)
+            task_list.append((self.model_factory, model.parameter_set,
+                              data_predictor, block_data))
+        result_list = self.pool.map(_judge_block, task_list)
+        total_log_likelihood = sum(r[0] for r in result_list)
+        total_weight = sum(r[1] for r in result_list)
+        avg_log_likelihood = total_log_likelihood / total_weight
+        score = -avg_log_likelihood
+        return score
+
+
+DWELL_CONTEXTS = ('activation', 'dark', 'bright_blink', 'bright_bleach')
+
+def make_dwell_histograms(segment_arrays, num_bins, weights=None):
+    """
+    Bins the dwells of a collection by context:
+        activation : the first dark dwell of each trajectory
+        dark : interior dark dwells
+        bright_blink : bright dwells followed by an interior dark dwell
+        bright_bleach : the last bright dwell of each trajectory
+    The dark dwell at the end of each trajectory is not used.
+    Bin edges are spaced logarithmically between the shortest and
+    longest dwell of each context, with a first bin starting at zero.
+
+    Parameters
+    ----------
+    segment_arrays : TrajectorySegmentArrays
+    num_bins : int
+    weights : ndarray, optional
+        Weight of each trajectory.
+
+    Returns
+    -------
+    histogram_dict : dict
+        `(bin_edges, counts)`, indexed by context.
+    """
+    dark_mask = segment_arrays.get_class_mask('dark')
+    bright_mask = segment_arrays.get_class_mask('bright')
+    first_inds = segment_arrays.get_first_segment_inds()
+    last_inds = segment_arrays.get_last_segment_inds()
+    is_first = numpy.zeros(len(dark_mask), dtype=bool)
+    is_first[first_inds] = True
+    is_before_last = numpy.zeros(len(dark_mask), dtype=bool)
+    is_before_last[last_inds - 1] = True
+    interior_mask = segment_arrays.make_interior_mask()
+    mask_dict = {'activation':is_first & dark_mask,
+                 'dark':interior_mask & dark_mask,
+                 'bright_blink':bright_mask & ~is_before_last,
+                 'bright_bleach':bright_mask & is_before_last}
+    if weights is None:
+        segment_weights = None
+    else:
+        segment_weights = numpy.repeat(weights,
+                                       segment_arrays.get_segment_counts())
+    histogram_dict = {}
+    for context in DWELL_CONTEXTS:
+        mask = mask_dict[context]
+        durations = segment_arrays.durations[mask]
+        if len(durations) == 0:
+            continue
+        shortest = max(durations.min(), ALMOST_ZERO)
+        longest = max(durations.max(), shortest)
+        bin_edges = numpy.append(0.0, numpy.logspace(
+                                        numpy.log10(shortest),
+                                        numpy.log10(longest) + 1e-9,
+                                        num_bins))
+        if segment_weights is None:
+            counts = numpy.histogram(durations, bins=bin_edges)[0]
+        else:
+            counts = numpy.histogram(durations, bins=bin_edges,
+                                     weights=segment_weights[mask])[0]
+        histogram_dict[context] = (bin_edges, counts.astype(numpy.float64))
+    return histogram_dict
+
+
+class HistogramLikelihoodJudge(Judge):
+    """
+    Judges a collection with an approximate, composite likelihood of
+    histograms of its dwells, rather than the likelihood of each
+    trajectory. Dwells are binned once per collection by
+    `make_dwell_histograms`, and each bin is scored by the probability
+    the model gives it, from the phase-type distributions of
+    `BlinkDistributionEngine`. The cost of a score depends on the number
+    of bins, not on the number of segments, so it suits a coarse fit of
+    a very large collection that is then refined with
+    `CollectionLikelihoodJudge`.
+
+    Like `CollectionLikelihoodJudge`, the score is minus the log10
+    likelihood per trajectory. The two scores are not equal, since the
+    dwells are treated as independent here. The data predictor is not
+    used.
+
+    Parameters
+    ----------
+    num_bins : int, optional
+        Number of bins per dwell context.
+    """
+    def __init__(self, num_bins=50):
+        super(HistogramLikelihoodJudge, self).__init__()
+        self.num_bins = num_bins
+        self.histogram_dict = None
+        self.histogram_target = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['histogram_target'] = None
+        return state
+
+    def get_histograms(self, target_data):
+        if self.histogram_dict is None or\
+           self.histogram_target is not target_data:
+            self.histogram_dict = make_dwell_histograms(
+                                    target_data.get_segment_arrays(),
+                                    self.num_bins, target_data.weights)
+            self.histogram_target = target_data
+        return self.histogram_dict
+
+    def compute_bin_probabilities(self, model, histogram_dict):
+        """
+        Returns
+        -------
+        bin_prob_dict : dict
+            Model probability of each bin, indexed by context.
+        """
+        engine = BlinkDistributionEngine(model)
+        bin_prob_dict = {}
+        for context, (bin_edges, counts) in histogram_dict.iteritems():
+            if context == 'activation':
+                pdf, cdf = engine.get_activation_time_distribution(bin_edges)
+            elif context == 'dark':
+                pdf, cdf = engine.get_dark_time_distribution(bin_edges)
+            else:
+                blink_pdf, blink_cdf, bleach_pdf, bleach_cdf =\
+                    engine.get_bright_exit_distributions(bin_edges)
+                if context == 'bright_blink':
+                    cdf = blink_cdf
+                else:
+                    cdf = bleach_cdf
+            bin_prob_dict[context] = numpy.maximum(numpy.diff(cdf),
+                                                   ALMOST_ZERO)
+        return bin_prob_dict
+
+    def judge_prediction(self, model, data_predictor, target_data):
+        histogram_dict = self.get_histograms(target_data)
+        bin_prob_dict = self.compute_bin_probabilities(model, histogram_dict)
+        total_log_likelihood = 0.0
+        for context, (bin_edges, counts) in histogram_dict.iteritems():
+            total_log_likelihood += numpy.dot(
+                                        counts,
+                                        numpy.log10(bin_prob_dict[context]))
+        avg_log_likelihood = total_log_likelihood /\
+                             target_data.get_total_weight()
+        score = -avg_log_likelihood
         return score
@@ -8,7 +8,7 @@ from pandas import Series
 import qit.utils
 from palm.probability_vector import make_prob_vec_from_panda_series
 from palm.probability_matrix import make_prob_matrix_from_panda_data_frame
-from palm.util import DATA_TYPE
+from palm.util import DATA_TYPE, ALMOST_ZERO
 
 # UNCOMMENT AFTER IMPLEMENTING PYCUDA CLASS
 # from pycuda import driver, compiler, gpuarray, tools
@@ -320,9 +320,15 @@ class QitMatrixExponential(object):
     This class can only compute the matrix exponential
     multiplied by a vector because qit doesn't implement
     the calculation of just the matrix exponential.
+
+    Parameters
+    ----------
+    tol : float, optional
+        Tolerance of the Krylov approximation.
     """
-    def __init__(self):
+    def __init__(self, tol=1e-7):
         super(QitMatrixExponential, self).__init__()
+        self.tol = tol
 
     def compute_matrix_expv(self, rate_matrix, dwell_time, vec):
         """
@@ -344,7 +350,7 @@ class QitMatrixExponential(object):
         v = numpy.array(aligned_series)
         Q = aligned_frame.values
         try:
-            r = qit.utils.expv(dwell_time, Q, v)
+            r = qit.utils.expv(dwell_time, Q, v, tol=self.tol)
         except:
             print "norm of Q:", scipy.linalg.norm(Q, numpy.inf)
             print "norm of v:", scipy.linalg.norm(v)
@@ -508,6 +514,96 @@ class TheanoEigenExpm(object):
         return expv
 
 
+class EigenGridExpm(object):
+    """
+    Computes ``vec * exp(Qt)`` for a whole array of times at once.
+
+    The matrix is decomposed once, ``Q = V * D * V_i``, and then
+    ``vec * exp(Qt) = ((vec * V) * exp(d t)) * V_i``
+    is evaluated for every `t` with one broadcast and one matrix product.
+    If `Q` cannot be diagonalized accurately (the eigen vectors are
+    nearly dependent), the times are stepped through instead, with one
+    ``exp(Q dt)`` per distinct time step, so a uniform grid costs one
+    matrix exponential and one vector-matrix product per time.
+
+    Parameters
+    ----------
+    max_relative_error : float, optional
+        Largest relative error of ``V * D * V_i`` with respect to `Q`
+        for which the decomposition is used.
+    """
+    def __init__(self, max_relative_error=1e-8):
+        super(EigenGridExpm, self).__init__()
+        self.max_relative_error = max_relative_error
+
+    def decompose(self, Q):
+        """
+        Returns
+        -------
+        eig_vals, eig_vecs, vec_inv : ndarray
+            Or None for each, if the decomposition is not accurate.
+        """
+        eig_vals, eig_vecs = scipy.linalg.eig(Q)
+        try:
+            vec_inv = scipy.linalg.inv(eig_vecs)
+        except (numpy.linalg.LinAlgError, ValueError):
+            return None, None, None
+        reconstructed_Q = numpy.dot(eig_vecs * eig_vals, vec_inv)
+        Q_norm = max(scipy.linalg.norm(Q, numpy.inf), ALMOST_ZERO)
+        relative_error = scipy.linalg.norm(reconstructed_Q - Q,
+                                           numpy.inf) / Q_norm
+        if not numpy.isfinite(relative_error) or\
+           relative_error > self.max_relative_error:
+            return None, None, None
+        return eig_vals, eig_vecs, vec_inv
+
+    def compute_vector_expm_grid(self, Q, vec, time_array):
+        """
+        Parameters
+        ----------
+        Q : ndarray
+            Square matrix.
+        vec : ndarray
+            Row vector, or a 2d array with one row vector per row.
+        time_array : ndarray
+
+        Returns
+        -------
+        result : ndarray
+            If `vec` is 1d, `result[i]` is ``vec * exp(Q * time_array[i])``.
+            If `vec` is 2d, `result[i, j]` is the same for row `j`.
+        """
+        time_array = numpy.asarray(time_array, dtype=numpy.float64)
+        vec = numpy.asarray(vec, dtype=numpy.float64)
+        eig_vals, eig_vecs, vec_inv = self.decompose(Q)
+        if eig_vals is None:
+            return self._step_through_times(Q, vec, time_array)
+        coefficients = numpy.dot(vec, eig_vecs)
+        exp_eig_vals = numpy.exp(numpy.outer(time_array, eig_vals))
+        if vec.ndim == 1:
+            result = numpy.dot(exp_eig_vals * coefficients, vec_inv)
+        else:
+            scaled = exp_eig_vals[:, None, :] * coefficients[None, :, :]
+            result = numpy.dot(scaled, vec_inv)
+        return result.real
+
+    def _step_through_times(self, Q, vec, time_array):
+        order = numpy.argsort(time_array, kind='mergesort')
+        sorted_times = time_array[order]
+        result = numpy.zeros((len(time_array),) + vec.shape)
+        time_steps = numpy.diff(numpy.append(0.0, sorted_times))
+        # grids with a constant step reuse one matrix exponential
+        step_expm_dict = {}
+        current_vec = vec
+        for i, time_step in enumerate(time_steps):
+            step_key = round(time_step, 12)
+            if step_key not in step_expm_dict:
+                step_expm_dict[step_key] = scipy.linalg.expm(Q * time_step)
+            current_vec = numpy.dot(current_vec, step_expm_dict[step_key])
+            result[order[i]] = current_vec
+        return result
+
+
 class CUDAMatrixExponential(object):
     """FOR BOB"""
     def __init__(self):
@@ -0,0 +1,187 @@
+import numpy
+from palm.blink_parameter_set import SingleDarkParameterSet,\
+                                     DoubleDarkParameterSet
+
+class MomentEstimator(object):
+    """
+    Derives starting values for a fit from the dwell statistics of a
+    collection, treating the `N` fluorophores of a molecule as
+    independent and rarely active at the same time:
+        activation time : the first of `N` activations, mean 1/(N ka)
+        bright dwell : ends at rate kd + kb
+        blinks : each fluorophore blinks kd/kb times on average, and
+            there are N - 1 dark gaps between the activations of
+            successive fluorophores
+        dark dwell : the blinks end at rate kr, which sets the median
+            dark dwell when blinks outnumber the gaps between activations
+        number of blinks : N - 1 gaps plus a sum of `N` geometric blink
+            counts, with variance N (kd/kb) (1 + kd/kb)
+    The number of fluorophores is estimated by comparing the observed
+    variance of the number of blinks with the one predicted by these
+    rates for each `N`. The estimates degrade when fluorophores of a
+    molecule are often active together; they are meant as starting
+    values for a fit, not as results.
+
+    Parameters
+    ----------
+    max_N : int, optional
+    log_rate_bounds : tuple, optional
+        Estimated log10 rates are clipped to these bounds.
+    N_tolerance : float, optional
+        `N` values whose predictions are within this relative error of
+        the observed statistics make up the `N` range.
+    """
+    def __init__(self, max_N=20, log_rate_bounds=(-3.0, 3.0),
+                 N_tolerance=0.35):
+        super(MomentEstimator, self).__init__()
+        self.max_N = max_N
+        self.log_rate_bounds = log_rate_bounds
+        self.N_tolerance = N_tolerance
+
+    def compute_statistics(self, target_data):
+        """
+        Parameters
+        ----------
+        target_data : BlinkCollectionTargetData
+
+        Returns
+        -------
+        statistics : dict
+        """
+        segment_arrays = target_data.get_segment_arrays()
+        dark_times = segment_arrays.get_dark_times()
+        num_blinks = segment_arrays.get_num_blinks()
+        statistics = {
+            'mean_activation_time':segment_arrays.get_activation_times().mean(),
+            'mean_bright_time':segment_arrays.get_bright_times().mean(),
+            'mean_num_blinks':num_blinks.mean(),
+            'var_num_blinks':num_blinks.var(),
+            'dark_times':dark_times}
+        return statistics
+
+    def estimate_rates(self, statistics, N):
+        """
+        Returns
+        -------
+        rate_dict : dict
+            Estimated rates `ka`, `kd`, `kr`, `kb`, not log10 rates.
+        """
+        ka = 1.0 / (N * statistics['mean_activation_time'])
+        num_gaps = N - 1
+        # mean blinks per fluorophore, kd / kb
+        blink_ratio = max(statistics['mean_num_blinks'] - num_gaps, 0.0) / N
+        blink_ratio = max(blink_ratio, 1e-3)
+        bright_exit_rate = 1.0 / statistics['mean_bright_time']
+        kd = bright_exit_rate * blink_ratio / (1.0 + blink_ratio)
+        kb = bright_exit_rate / (1.0 + blink_ratio)
+        dark_times = statistics['dark_times']
+        if len(dark_times) == 0:
+            kr = bright_exit_rate
+        else:
+            # the median is dominated by the blinks even when the longer
+            # gaps between activations are mixed in
+            kr = numpy.log(2.0) / numpy.median(dark_times)
+        rate_dict = {'ka':ka, 'kd':kd, 'kr':kr, 'kb':kb,
+                     'blink_ratio':blink_ratio}
+        return rate_dict
+
+    def predict_num_blink_variance(self, rate_dict, N):
+        # a sum of N geometric blink counts; the N - 1 gaps are fixed
+        blink_ratio = rate_dict['blink_ratio']
+        return N * blink_ratio * (1.0 + blink_ratio)
+
+    def estimate_N_range(self, statistics):
+        """
+        Scores each `N` by the relative error of the predicted variance
+        of the number of blinks.
+
+        Returns
+        -------
+        best_N : int
+        N_range : tuple
+            Smallest and largest plausible `N`.
+        """
+        # each fluorophore adds a gap, so N - 1 cannot exceed the blinks
+        largest_N = int(min(self.max_N,
+                            numpy.floor(statistics['mean_num_blinks']) + 1))
+        largest_N = max(largest_N, 1)
+        N_array = numpy.arange(1, largest_N + 1)
+        observed_variance = max(statistics['var_num_blinks'], 1e-3)
+        predicted_variance = numpy.array(
+            [self.predict_num_blink_variance(
+                self.estimate_rates(statistics, N), N) for N in N_array])
+        relative_error = abs(predicted_variance - observed_variance) /\
+                         observed_variance
+        best_N = int(N_array[numpy.argmin(relative_error)])
+        is_plausible = relative_error <= max(self.N_tolerance,
+                                             relative_error.min())
+        N_range = (int(N_array[is_plausible].min()),
+                   int(N_array[is_plausible].max()))
+        return best_N, N_range
+
+    def _to_log_rate(self, rate):
+        return float(numpy.clip(numpy.log10(rate), self.log_rate_bounds[0],
+                                self.log_rate_bounds[1]))
+
+    def fill_parameter_set(self, parameter_set, target_data, N=None):
+        """
+        Sets the log10 rates of a parameter set, and `N` if it is not
+        given, from the statistics of `target_data`.
+
+        Parameters
+        ----------
+        parameter_set : SingleDarkParameterSet or DoubleDarkParameterSet
+            Modified in place.
+        target_data : BlinkCollectionTargetData
+        N : int, optional
+            Defaults to the best `N` of `estimate_N_range`.
+
+        Returns
+        -------
+        parameter_set : ParameterSet
+        N_range : tuple
+        """
+        statistics = self.compute_statistics(target_data)
+        best_N, N_range = self.estimate_N_range(statistics)
+        if N is None:
+            N = best_N
+        rate_dict = self.estimate_rates(statistics, N)
+        parameter_set.set_parameter('N', N)
+        parameter_set.set_parameter('log_ka', self._to_log_rate(rate_dict['ka']))
+        parameter_set.set_parameter('log_kb', self._to_log_rate(rate_dict['kb']))
+        if isinstance(parameter_set, SingleDarkParameterSet):
+            parameter_set.set_parameter('log_kd',
+                                        self._to_log_rate(rate_dict['kd']))
+            parameter_set.set_parameter('log_kr',
+                                        self._to_log_rate(rate_dict['kr']))
+        elif isinstance(parameter_set, DoubleDarkParameterSet):
+            # split the dark dwells at their median into a fast and a
+            # slow dark state, each entered half of the time
+            dark_times = statistics['dark_times']
+            kr = rate_dict['kr']
+            if len(dark_times) > 1:
+                median_time = numpy.median(dark_times)
+                short_times = dark_times[dark_times <= median_time]
+                long_times = dark_times[dark_times > median_time]
+                kr1 = 1.0 / short_times.mean()
+                if len(long_times) > 0:
+                    kr2 = 1.0 / long_times.mean()
+                else:
+                    kr2 = kr1
+                # keep the overall dark rate of the single-dark estimate
+                scale = kr / (2.0 / (1.0 / kr1 + 1.0 / kr2))
+                kr1 *= scale
+                kr2 *= scale
+            else:
+                kr1 = kr2 = kr
+            log_kr1 = self._to_log_rate(kr1)
+            log_kd_half = self._to_log_rate(0.5 * rate_dict['kd'])
+            parameter_set.set_parameter('log_kd1', log_kd_half)
+            parameter_set.set_parameter('log_kd2', log_kd_half)
+            parameter_set.set_parameter('log_kr1', log_kr1)
+            parameter_set.set_parameter('log_kr_diff',
+                                        self._to_log_rate(kr2) - log_kr1)
+        else:
+            assert False, "Unsupported parameter set: %s" %\
+                          parameter_set.__class__.__name__
+        return parameter_set, N_range
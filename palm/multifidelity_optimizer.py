@@ -0,0 +1,253 @@
+import copy
+import numpy
+import pandas
+import scipy.optimize
+from palm.base.parameter_optimizer import ParameterOptimizer
+from palm.score_function import copy_score_function, get_score_object
+from palm.util import make_random_state
+
+class FidelityLevel(object):
+    """
+    Settings of a cheap approximation of a score function.
+
+    Parameters
+    ----------
+    MAX_A : int, optional
+        Largest number of active fluorophores of the models; capped at
+        the `MAX_A` of the model factory. None keeps the factory value.
+    expm_tolerance : float, optional
+        Tolerance of matrix exponential calculators that have a `tol`,
+        such as `QitMatrixExponential`. None keeps the calculator value.
+    data_fraction : float, optional
+        Fraction of the trajectories that are scored.
+    """
+    def __init__(self, MAX_A=None, expm_tolerance=None, data_fraction=1.0):
+        super(FidelityLevel, self).__init__()
+        self.MAX_A = MAX_A
+        self.expm_tolerance = expm_tolerance
+        self.data_fraction = data_fraction
+
+    def __str__(self):
+        return "MAX_A=%s, expm_tolerance=%s, data_fraction=%s" %\
+               (self.MAX_A, self.expm_tolerance, self.data_fraction)
+
+def set_expm_tolerance(data_predictor, expm_tolerance):
+    for calculator_name in ['backward_calculator', 'forward_calculator']:
+        calculator = getattr(data_predictor, calculator_name, None)
+        if calculator is None:
+            continue
+        expm_calculator = calculator.expm_calculator
+        if hasattr(expm_calculator, 'tol'):
+            expm_calculator.tol = expm_tolerance
+
+def make_fidelity_score_fcn(score_object, fidelity_level, trajectory_order):
+    """
+    Parameters
+    ----------
+    score_object : ScoreFunction
+    fidelity_level : FidelityLevel
+    trajectory_order : ndarray
+        A permutation of the trajectories. Each level scores the first
+        trajectories of it, so the subsets of the levels are nested.
+
+    Returns
+    -------
+    fidelity_score_fcn : ScoreFunction
+        A shallow copy of `score_object` with a copied model factory,
+        data predictor and target data where the level changes them.
+    """
+    fidelity_score_fcn = copy_score_function(score_object)
+    model_factory = score_object.model_factory
+    if fidelity_level.MAX_A is not None and hasattr(model_factory, 'MAX_A'):
+        fidelity_score_fcn.model_factory = copy.copy(model_factory)
+        fidelity_score_fcn.model_factory.MAX_A = min(fidelity_level.MAX_A,
+                                                     model_factory.MAX_A)
+    if fidelity_level.expm_tolerance is not None:
+        fidelity_score_fcn.data_predictor =\
+            copy.deepcopy(score_object.data_predictor)
+        set_expm_tolerance(fidelity_score_fcn.data_predictor,
+                           fidelity_level.expm_tolerance)
+    if fidelity_level.data_fraction < 1.0:
+        target_data = score_object.target_data
+        num_trajectories = max(1, int(round(fidelity_level.data_fraction *
+                                            len(target_data))))
+        inds = numpy.sort(trajectory_order[:num_trajectories])
+        fidelity_score_fcn.target_data =\
+            target_data.make_copy_from_selection(inds)
+    return fidelity_score_fcn
+
+
+class _EscalateFidelity(Exception):
+    pass
+
+
+class MultiFidelityOptimizer(ParameterOptimizer):
+    """
+    Optimizes parameters with bounded BFGS on a sequence of increasingly
+    accurate approximations of the score function: smaller `MAX_A`,
+    looser matrix exponential tolerances and nested subsets of the
+    trajectories. The optimizer moves to the next level, from the point
+    it has reached, as soon as the relative improvement of the score
+    between two BFGS iterations drops below `improvement_tolerance`.
+    The last stage always uses the unmodified score function and runs
+    to convergence, so the returned optimum and score are at full
+    fidelity.
+
+    Attributes
+    ----------
+    schedule_table : pandas.DataFrame
+        One row per stage, with the fidelity settings, the number of
+        trajectories, the number of iterations and score evaluations,
+        the final score at that fidelity and why the stage ended.
+    evaluation_table : pandas.DataFrame
+        One row per score evaluation, with its stage and score.
+
+    Parameters
+    ----------
+    fidelity_levels : list, optional
+        FidelityLevels, from cheapest to most accurate, before the full
+        fidelity stage.
+    improvement_tolerance : float, optional
+    max_iterations_per_level : int, optional
+    random_state : None, int or numpy.random.RandomState, optional
+        For the order in which trajectories are added to the subsets.
+    factr : float, optional
+    pgtol : float, optional
+    epsilon : float, optional
+    maxfun : int, optional
+        For the full fidelity stage.
+    """
+    def __init__(self, fidelity_levels=None, improvement_tolerance=1e-3,
+                 max_iterations_per_level=50, random_state=None, factr=1e6,
+                 pgtol=1e-5, epsilon=1e-8, maxfun=1000):
+        super(MultiFidelityOptimizer, self).__init__()
+        if fidelity_levels is None:
+            fidelity_levels = [FidelityLevel(MAX_A=3, expm_tolerance=1e-4,
+                                             data_fraction=0.25),
+                               FidelityLevel(MAX_A=6, expm_tolerance=1e-6,
+                                             data_fraction=0.5)]
+        self.fidelity_levels = fidelity_levels
+        self.improvement_tolerance = improvement_tolerance
+        self.max_iterations_per_level = max_iterations_per_level
+        self.random_state = make_random_state(random_state)
+        self.factr = factr
+        self.pgtol = pgtol
+        self.epsilon = epsilon
+        self.maxfun = maxfun
+        self.schedule_table = None
+        self.evaluation_table = None
+        self.evaluation_list = []
+
+    def _run_stage(self, stage_index, stage_score_fcn, parameter_array,
+                   bounds, is_final, noisy):
+        # L-BFGS-B scores each iterate before accepting it, so the
+        # callback looks up the score of the new iterate instead of
+        # paying for another evaluation
+        score_dict = {}
+        start_key = numpy.asarray(parameter_array, dtype=float).tostring()
+        stage_state = {'num_iterations':0, 'previous_score':None,
+                       'x':parameter_array}
+
+        def logged_score_fcn(x):
+            score = float(stage_score_fcn(x))
+            score_dict[x.tostring()] = score
+            self.evaluation_list.append({'stage':stage_index,
+                                         'score':score})
+            return score
+
+        def callback(x):
+            stage_state['num_iterations'] += 1
+            stage_state['x'] = numpy.array(x)
+            score = score_dict.get(numpy.asarray(x, dtype=float).tostring())
+            previous_score = stage_state['previous_score']
+            if previous_score is None:
+                previous_score = score_dict.get(start_key)
+            stage_state['previous_score'] = score
+            if is_final or score is None or previous_score is None:
+                return
+            relative_improvement = (previous_score - score) /\
+                                   max(abs(previous_score), 1e-12)
+            if relative_improvement < self.improvement_tolerance:
+                raise _EscalateFidelity()
+
+        num_evaluations_before = len(self.evaluation_list)
+        if is_final:
+            options = {'factr':self.factr, 'pgtol':self.pgtol,
+                       'maxfun':self.maxfun}
+        else:
+            options = {'maxiter':self.max_iterations_per_level}
+        try:
+            x, score, info = scipy.optimize.fmin_l_bfgs_b(
+                                logged_score_fcn, x0=parameter_array,
+                                bounds=bounds, approx_grad=1,
+                                epsilon=self.epsilon,
+                                iprint=(1 if noisy else -1),
+                                callback=callback, **options)
+            stop_reason = 'converged' if info['warnflag'] == 0 else\
+                          'max_evaluations'
+        except _EscalateFidelity:
+            x = stage_state['x']
+            score = stage_state['previous_score']
+            stop_reason = 'small_improvement'
+        num_evaluations = len(self.evaluation_list) - num_evaluations_before
+        return numpy.array(x), float(score), stage_state['num_iterations'],\
+               num_evaluations, stop_reason
+
+    def optimize_parameters(self, score_fcn, parameter_set, noisy=False):
+        """
+        Parameters
+        ----------
+        score_fcn : ScoreFunction or its `compute_score` method
+        parameter_set : ParameterSet
+            Initial parameters; set to the optimized parameters.
+        noisy : bool, optional
+
+        Returns
+        -------
+        parameter_set : ParameterSet
+        score : float
+            The full fidelity score of the optimized parameters.
+        """
+        score_object = get_score_object(score_fcn)
+        bounds = parameter_set.get_parameter_bounds()
+        parameter_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        num_trajectories = len(score_object.target_data)
+        trajectory_order = self.random_state.permutation(num_trajectories)
+        self.evaluation_list = []
+        row_list = []
+        stage_list = [(level, make_fidelity_score_fcn(score_object, level,
+                                                      trajectory_order))
+                      for level in self.fidelity_levels]
+        stage_list.append((FidelityLevel(), score_object))
+        for stage_index, (level, stage_score_object) in enumerate(stage_list):
+            is_final = (stage_index == len(stage_list) - 1)
+            results = self._run_stage(stage_index,
+                                      stage_score_object.compute_score,
+                                      parameter_array, bounds, is_final,
+                                      noisy)
+            parameter_array, score, num_iterations, num_evaluations,\
+                stop_reason = results
+            row_list.append({'stage':stage_index,
+                             'MAX_A':getattr(stage_score_object.model_factory,
+                                             'MAX_A', None),
+                             'expm_tolerance':level.expm_tolerance,
+                             'num_trajectories':
+                                len(stage_score_object.target_data),
+                             'num_iterations':num_iterations,
+                             'num_evaluations':num_evaluations,
+                             'score':score, 'stop_reason':stop_reason})
+            if noisy:
+                print "stage %d (%s): score %.6f after %d evaluations, %s" %\
+                      (stage_index, level, score, num_evaluations,
+                       stop_reason)
+        self.schedule_table = pandas.DataFrame(
+                                row_list, columns=['stage', 'MAX_A',
+                                                   'expm_tolerance',
+                                                   'num_trajectories',
+                                                   'num_iterations',
+                                                   'num_evaluations',
+                                                   'score', 'stop_reason'])
+        self.evaluation_table = pandas.DataFrame(self.evaluation_list,
+                                                 columns=['stage', 'score'])
+        parameter_set.update_from_array(parameter_array)
+        return parameter_set, score
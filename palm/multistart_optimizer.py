@@ -0,0 +1,174 @@
+import multiprocessing
+import numpy
+import pandas
+import scipy.optimize
+from palm.base.parameter_optimizer import ParameterOptimizer
+from palm.score_function import make_worker_pool, get_pool_worker_state
+from palm.util import make_random_state
+
+def _run_round(args):
+    return run_round(get_pool_worker_state(), *args)
+
+def run_round(score_fcn, start_array, bounds, optimizer_options):
+    x, score, info = scipy.optimize.fmin_l_bfgs_b(
+                        score_fcn, x0=start_array, bounds=bounds,
+                        approx_grad=1, iprint=-1, **optimizer_options)
+    return x, float(score), info['warnflag'], info['funcalls']
+
+
+class MultiStartOptimizer(ParameterOptimizer):
+    """
+    Runs bounded BFGS from several starting points in a process pool.
+    The first start is the given parameter set; the others are drawn
+    uniformly within the parameter bounds.
+
+    The optimization proceeds in rounds of at most `round_maxfun`
+    score evaluations per start. After each round past the first
+    `num_warmup_rounds`, starts whose score is worse than the best
+    score so far by more than `cull_margin` are dropped, so later rounds
+    only spend time on promising starts. Each round restarts BFGS from
+    the point reached in the previous round, which discards the
+    curvature estimate but not the progress.
+
+    Attributes
+    ----------
+    start_table : pandas.DataFrame
+        One row per start, with its start and end arrays, score,
+        status ('converged', 'culled' or 'max_rounds'), number of
+        rounds and number of score evaluations.
+
+    Parameters
+    ----------
+    num_starts : int, optional
+    num_processes : int, optional
+        Defaults to the number of cpus. With one process, the starts
+        run in this process and `score_fcn` need not be picklable.
+    round_maxfun : int, optional
+    max_rounds : int, optional
+    cull_margin : float, optional
+    num_warmup_rounds : int, optional
+    default_bounds : tuple, optional
+        Range for drawing starting values of parameters without bounds.
+    random_state : None, int or numpy.random.RandomState, optional
+    factr : float, optional
+    pgtol : float, optional
+    epsilon : float, optional
+    """
+    def __init__(self, num_starts=8, num_processes=None, round_maxfun=50,
+                 max_rounds=20, cull_margin=0.5, num_warmup_rounds=1,
+                 default_bounds=(-3.0, 3.0),
+                 random_state=None, factr=1e6, pgtol=1e-5, epsilon=1e-8):
+        super(MultiStartOptimizer, self).__init__()
+        self.num_starts = num_starts
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+        self.num_processes = num_processes
+        self.round_maxfun = round_maxfun
+        self.max_rounds = max_rounds
+        self.cull_margin = cull_margin
+        self.num_warmup_rounds = num_warmup_rounds
+        self.default_bounds = default_bounds
+        self.random_state = make_random_state(random_state)
+        self.optimizer_options = {'factr':factr, 'pgtol':pgtol,
+                                  'epsilon':epsilon, 'maxfun':round_maxfun}
+        self.start_table = None
+
+    def make_start_arrays(self, parameter_set):
+        """
+        Returns
+        -------
+        start_arrays : ndarray
+            One row per start.
+        """
+        first_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        bounds = parameter_set.get_parameter_bounds()
+        start_arrays = numpy.tile(first_array, (self.num_starts, 1))
+        for j, (lower, upper) in enumerate(bounds):
+            if lower is not None and lower == upper:
+                continue
+            if lower is None:
+                lower = self.default_bounds[0]
+            if upper is None:
+                upper = self.default_bounds[1]
+            start_arrays[1:, j] = self.random_state.uniform(
+                                    lower, upper, self.num_starts - 1)
+        return start_arrays
+
+    def optimize_parameters(self, score_fcn, parameter_set, noisy=False):
+        """
+        Parameters
+        ----------
+        score_fcn : callable f(x)
+            Usually the `compute_score` method of a ScoreFunction.
+        parameter_set : ParameterSet
+            The first start; set to the best parameters found.
+        noisy : bool, optional
+
+        Returns
+        -------
+        parameter_set : ParameterSet
+        score : float
+        """
+        bounds = parameter_set.get_parameter_bounds()
+        start_arrays = self.make_start_arrays(parameter_set)
+        current_arrays = start_arrays.copy()
+        scores = numpy.inf * numpy.ones(self.num_starts)
+        num_rounds = numpy.zeros(self.num_starts, dtype=int)
+        num_evaluations = numpy.zeros(self.num_starts, dtype=int)
+        status = numpy.array(['max_rounds'] * self.num_starts, dtype=object)
+        is_running = numpy.ones(self.num_starts, dtype=bool)
+        if self.num_processes > 1:
+            pool = make_worker_pool(self.num_processes, score_fcn)
+            def map_rounds(task_list):
+                return pool.map(_run_round, task_list)
+        else:
+            pool = None
+            def map_rounds(task_list):
+                return [run_round(score_fcn, *task) for task in task_list]
+        try:
+            for round_index in xrange(self.max_rounds):
+                running_inds = numpy.flatnonzero(is_running)
+                if len(running_inds) == 0:
+                    break
+                results = map_rounds([(current_arrays[i], bounds,
+                                       self.optimizer_options)
+                                      for i in running_inds])
+                for i, (x, score, warnflag, funcalls) in zip(running_inds,
+                                                            results):
+                    current_arrays[i] = x
+                    scores[i] = score
+                    num_rounds[i] += 1
+                    num_evaluations[i] += funcalls
+                    # warnflag 1 means BFGS ran out of evaluations
+                    if warnflag != 1:
+                        status[i] = 'converged'
+                        is_running[i] = False
+                is_culled = is_running &\
+                            (scores > scores.min() + self.cull_margin)
+                if round_index < self.num_warmup_rounds:
+                    is_culled[:] = False
+                status[is_culled] = 'culled'
+                is_running &= ~is_culled
+                if noisy:
+                    print "Round %d: best %.6f, %d running, %d culled" %\
+                          (round_index, scores.min(), is_running.sum(),
+                           is_culled.sum())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.start_table = pandas.DataFrame(
+                            {'start_array':list(start_arrays),
+                             'end_array':list(current_arrays),
+                             'score':scores, 'status':status,
+                             'num_rounds':num_rounds,
+                             'num_evaluations':num_evaluations},
+                            columns=['start_array', 'end_array', 'score',
+                                     'status', 'num_rounds',
+                                     'num_evaluations'])
+        best_index = numpy.argmin(scores)
+        parameter_set.update_from_array(current_arrays[best_index])
+        return parameter_set, float(scores[best_index])
+
+    def get_start_table(self):
+        return self.start_table
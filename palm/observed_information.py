@@ -0,0 +1,195 @@
+import numpy
+import pandas
+from palm.score_function import get_score_object, compute_scores,\
+                                make_central_difference_stencil
+
+def get_free_parameter_inds(parameter_set):
+    """
+    Returns
+    -------
+    free_inds : ndarray
+        Indices in `as_array` of the parameters that are not fixed by
+        equal lower and upper bounds.
+    """
+    return numpy.array([j for j, (lower, upper) in
+                        enumerate(parameter_set.get_parameter_bounds())
+                        if lower is None or lower != upper], dtype=int)
+
+def get_parameter_names(parameter_set):
+    if hasattr(parameter_set, 'get_parameter_names'):
+        return parameter_set.get_parameter_names()
+    else:
+        return ['p%d' % j for j in xrange(len(parameter_set.as_array()))]
+
+
+class UncertaintyEstimate(object):
+    """
+    Asymptotic uncertainty of maximum likelihood estimates of the free
+    parameters, from the observed information matrix.
+
+    Attributes
+    ----------
+    estimates : pandas.Series
+    information_matrix : pandas.DataFrame
+        Second derivatives of minus the natural log likelihood.
+    covariance_matrix : pandas.DataFrame
+        Inverse of the information matrix.
+    standard_errors : pandas.Series
+    correlation_matrix : pandas.DataFrame
+    is_positive_definite : bool
+        False if the point is not a strict maximum of the likelihood,
+        for instance at a bound or along a ridge. The covariance is then
+        the pseudo-inverse of the information, and the standard errors
+        of the poorly determined parameters are not reliable.
+
+    Parameters
+    ----------
+    parameter_names : list
+    estimates : ndarray
+    information_matrix : ndarray
+    """
+    def __init__(self, parameter_names, estimates, information_matrix):
+        super(UncertaintyEstimate, self).__init__()
+        self.estimates = pandas.Series(estimates, index=parameter_names)
+        self.information_matrix = pandas.DataFrame(information_matrix,
+                                                   index=parameter_names,
+                                                   columns=parameter_names)
+        eig_vals = numpy.linalg.eigvalsh(information_matrix)
+        self.is_positive_definite = bool((eig_vals > 0.0).all())
+        if self.is_positive_definite:
+            covariance = numpy.linalg.inv(information_matrix)
+        else:
+            covariance = numpy.linalg.pinv(information_matrix)
+        variances = numpy.diag(covariance)
+        standard_errors = numpy.sqrt(numpy.maximum(variances, 0.0))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            correlation = covariance / numpy.outer(standard_errors,
+                                                   standard_errors)
+        self.covariance_matrix = pandas.DataFrame(covariance,
+                                                  index=parameter_names,
+                                                  columns=parameter_names)
+        self.standard_errors = pandas.Series(standard_errors,
+                                             index=parameter_names)
+        self.correlation_matrix = pandas.DataFrame(correlation,
+                                                   index=parameter_names,
+                                                   columns=parameter_names)
+
+    def __str__(self):
+        summary = pandas.DataFrame({'estimate':self.estimates,
+                                    'standard error':self.standard_errors},
+                                   columns=['estimate', 'standard error'])
+        return "%s\ncorrelations:\n%s" % (summary, self.correlation_matrix)
+
+    def get_confidence_intervals(self, num_standard_errors=1.96):
+        """
+        Returns
+        -------
+        intervals : pandas.DataFrame
+            Columns `lower` and `upper`; 95% intervals by default.
+        """
+        half_widths = num_standard_errors * self.standard_errors
+        return pandas.DataFrame({'lower':self.estimates - half_widths,
+                                 'upper':self.estimates + half_widths},
+                                columns=['lower', 'upper'])
+
+
+class ObservedInformationEstimator(object):
+    """
+    Computes the observed Fisher information of the free parameters,
+    the Hessian of minus the natural log likelihood, by central finite
+    differences of the score. All `1 + 2 d**2` points of the stencil
+    for `d` free parameters are scored in one call to
+    `ScoreFunction.compute_scores`, which is one pass over the data
+    when the judge and predictor support batches.
+
+    The score is minus the average log10 likelihood per trajectory, so
+    the log likelihood is ``-score * total_weight * ln(10)``.
+
+    Parameters
+    ----------
+    step : float, optional
+        Finite difference step in each free parameter.
+    total_weight : float, optional
+        Defaults to the sum of the weights of the target data of the
+        score function. Required when the score function is a plain
+        callable without `target_data`.
+    """
+    def __init__(self, step=1e-3, total_weight=None):
+        super(ObservedInformationEstimator, self).__init__()
+        self.step = step
+        self.total_weight = total_weight
+
+    def make_stencil(self, parameter_array, free_inds):
+        """
+        Returns
+        -------
+        parameter_matrix : ndarray
+            The center, then the two points along each free parameter,
+            then the four points of each pair of free parameters.
+        """
+        return make_central_difference_stencil(parameter_array, free_inds,
+                                               self.step, include_pairs=True)
+
+    def compute_information(self, score_fcn, parameter_set):
+        """
+        Parameters
+        ----------
+        score_fcn : ScoreFunction, its `compute_score` method or callable f(x)
+            A plain callable needs `total_weight`.
+        parameter_set : ParameterSet
+            The maximum likelihood estimate. Not modified.
+
+        Returns
+        -------
+        information_matrix : ndarray
+        free_inds : ndarray
+        """
+        score_object = get_score_object(score_fcn)
+        total_weight = self.total_weight
+        if total_weight is None:
+            assert hasattr(score_object, 'target_data'),\
+                   "Give total_weight to score a callable without target_data."
+            total_weight = float(score_object.target_data.get_weights().sum())
+        parameter_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        free_inds = get_free_parameter_inds(parameter_set)
+        num_free = len(free_inds)
+        scores = compute_scores(score_object,
+                                self.make_stencil(parameter_array, free_inds))
+        h = self.step
+        hessian = numpy.zeros((num_free, num_free))
+        center = scores[0]
+        for a in xrange(num_free):
+            plus, minus = scores[1 + 2 * a], scores[2 + 2 * a]
+            hessian[a, a] = (plus - 2.0 * center + minus) / h**2
+        position = 1 + 2 * num_free
+        for a in xrange(num_free):
+            for b in xrange(a + 1, num_free):
+                pp, pm, mp, mm = scores[position:position + 4]
+                hessian[a, b] = hessian[b, a] = (pp - pm - mp + mm) /\
+                                                (4.0 * h**2)
+                position += 4
+        information_matrix = total_weight * numpy.log(10.0) * hessian
+        return information_matrix, free_inds
+
+    def estimate_uncertainty(self, score_fcn, parameter_set):
+        """
+        Parameters
+        ----------
+        score_fcn : ScoreFunction, its `compute_score` method or callable f(x)
+            A plain callable needs `total_weight`.
+        parameter_set : ParameterSet
+            The maximum likelihood estimate.
+
+        Returns
+        -------
+        uncertainty_estimate : UncertaintyEstimate
+        """
+        parameter_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        information_matrix, free_inds = self.compute_information(
+                                            score_fcn, parameter_set)
+        # scoring moves the parameter set of a ScoreFunction
+        parameter_set.update_from_array(parameter_array)
+        all_names = get_parameter_names(parameter_set)
+        parameter_names = [all_names[j] for j in free_inds]
+        return UncertaintyEstimate(parameter_names, parameter_array[free_inds],
+                                   information_matrix)
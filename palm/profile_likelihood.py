@@ -0,0 +1,270 @@
+import multiprocessing
+import numpy
+import pandas
+import scipy.optimize
+import scipy.stats
+from palm.observed_information import get_free_parameter_inds,\
+                                      get_parameter_names
+from palm.score_function import get_score_object, make_worker_pool,\
+                                get_pool_worker_state
+
+def _walk_profile(args):
+    return walk_profile(get_pool_worker_state(), *args)
+
+def walk_profile(score_fcn, parameter_index, direction, optimum_array,
+                 bounds, step, max_steps, max_score, optimizer_options):
+    """
+    Fixes one parameter at values further and further from the optimum
+    and fits the others, each fit starting from the previous one.
+
+    Parameters
+    ----------
+    score_fcn : callable f(x)
+    parameter_index : int
+    direction : int
+        1 to walk up, -1 to walk down.
+    optimum_array : ndarray
+    bounds : list
+        Bounds of every parameter, with no None.
+    step : float
+    max_steps : int
+    max_score : float
+        The walk stops after the first fit that scores above this.
+    optimizer_options : dict
+
+    Returns
+    -------
+    point_list : list
+        Tuples of the fixed value, the score, the number of score
+        evaluations and the fitted parameter array.
+    """
+    lower, upper = bounds[parameter_index]
+    current_array = numpy.array(optimum_array, dtype=float)
+    center = current_array[parameter_index]
+    point_list = []
+    for k in xrange(1, max_steps + 1):
+        value = center + direction * k * step
+        if value < lower or value > upper:
+            break
+        current_array[parameter_index] = value
+        fixed_bounds = list(bounds)
+        fixed_bounds[parameter_index] = (value, value)
+        x, score, info = scipy.optimize.fmin_l_bfgs_b(
+                            score_fcn, x0=current_array, bounds=fixed_bounds,
+                            approx_grad=1, iprint=-1, **optimizer_options)
+        current_array = numpy.array(x, dtype=float)
+        point_list.append((value, float(score), info['funcalls'],
+                           current_array.copy()))
+        if score > max_score:
+            break
+    return point_list
+
+
+class ProfileLikelihoodResult(object):
+    """
+    Attributes
+    ----------
+    profile_table : pandas.DataFrame
+        One row per point of every profile, including the optimum, with
+        the parameter name, the fixed value, the score, the deviance
+        ``2 * (max log likelihood - profile log likelihood)``, the
+        number of score evaluations and the fitted parameter array.
+    interval_table : pandas.DataFrame
+        One row per parameter, with the estimate and the lower and upper
+        limits of the likelihood-ratio confidence interval. A limit is
+        NaN if the profile did not reach the critical deviance.
+    critical_deviance : float
+    """
+    def __init__(self, profile_table, interval_table, critical_deviance):
+        super(ProfileLikelihoodResult, self).__init__()
+        self.profile_table = profile_table
+        self.interval_table = interval_table
+        self.critical_deviance = critical_deviance
+
+    def get_profile(self, parameter_name):
+        """
+        Returns
+        -------
+        profile : pandas.DataFrame
+            The points of the profile of `parameter_name`, ordered by value.
+        """
+        is_parameter = self.profile_table['parameter'] == parameter_name
+        return self.profile_table[is_parameter].sort_index(by='value')
+
+
+class ProfileLikelihoodCalculator(object):
+    """
+    Computes profile likelihoods of the free parameters. For each
+    parameter, the profile is walked up and down from the optimum in
+    steps of `step`: the parameter is fixed by equal bounds and the other
+    parameters are fitted by bounded BFGS, starting from the fit at the
+    previous step. A walk stops once the deviance exceeds the critical
+    value of the likelihood-ratio test, so that the confidence limit is
+    bracketed, or at the parameter bounds. The walks of all parameters
+    and directions run in a process pool.
+
+    The log likelihood is ``-score * total_weight * ln(10)``, where the
+    score is minus the average log10 likelihood per trajectory.
+
+    Parameters
+    ----------
+    step : float, optional
+    max_steps : int, optional
+        Maximum number of steps of each walk.
+    confidence_level : float, optional
+    num_processes : int, optional
+        Defaults to the number of cpus. With one process, the walks run
+        in this process and `score_fcn` need not be picklable.
+    default_bounds : tuple, optional
+        Range for parameters without bounds.
+    total_weight : float, optional
+        Defaults to the sum of the weights of the target data of the
+        score function.
+    factr : float, optional
+    pgtol : float, optional
+    epsilon : float, optional
+    maxfun : int, optional
+    """
+    def __init__(self, step=0.05, max_steps=40, confidence_level=0.95,
+                 num_processes=None, default_bounds=(-3.0, 3.0),
+                 total_weight=None, factr=1e6, pgtol=1e-5, epsilon=1e-8,
+                 maxfun=1000):
+        super(ProfileLikelihoodCalculator, self).__init__()
+        self.step = step
+        self.max_steps = max_steps
+        self.confidence_level = confidence_level
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+        self.num_processes = num_processes
+        self.default_bounds = default_bounds
+        self.total_weight = total_weight
+        self.optimizer_options = {'factr':factr, 'pgtol':pgtol,
+                                  'epsilon':epsilon, 'maxfun':maxfun}
+
+    def _get_total_weight(self, score_fcn):
+        if self.total_weight is not None:
+            return self.total_weight
+        score_object = get_score_object(score_fcn)
+        return float(score_object.target_data.get_weights().sum())
+
+    def find_interval_limit(self, values, deviances, critical_deviance):
+        """
+        Linearly interpolates the value where the deviance first crosses
+        `critical_deviance`, walking away from the optimum.
+
+        Parameters
+        ----------
+        values : ndarray
+            Starting at the optimum.
+        deviances : ndarray
+
+        Returns
+        -------
+        limit : float
+            NaN if the deviance never reaches `critical_deviance`.
+        """
+        for k in xrange(1, len(values)):
+            if deviances[k] >= critical_deviance:
+                d0, d1 = deviances[k - 1], deviances[k]
+                fraction = (critical_deviance - d0) / (d1 - d0)
+                return values[k - 1] + fraction * (values[k] - values[k - 1])
+        return numpy.nan
+
+    def compute_profiles(self, score_fcn, parameter_set, parameter_names=None,
+                         noisy=False):
+        """
+        Parameters
+        ----------
+        score_fcn : callable f(x)
+            Usually the `compute_score` method of a ScoreFunction.
+        parameter_set : ParameterSet
+            The maximum likelihood estimate. Not modified.
+        parameter_names : list, optional
+            Defaults to all free parameters.
+        noisy : bool, optional
+
+        Returns
+        -------
+        result : ProfileLikelihoodResult
+        """
+        optimum_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        all_names = get_parameter_names(parameter_set)
+        if parameter_names is None:
+            parameter_names = [all_names[j] for j in
+                               get_free_parameter_inds(parameter_set)]
+        bounds = []
+        for lower, upper in parameter_set.get_parameter_bounds():
+            bounds.append((self.default_bounds[0] if lower is None else lower,
+                           self.default_bounds[1] if upper is None else upper))
+        log_likelihood_scale = self._get_total_weight(score_fcn) *\
+                               numpy.log(10.0)
+        critical_deviance = scipy.stats.chi2.ppf(self.confidence_level, 1)
+        optimum_score = float(score_fcn(optimum_array))
+        max_score = optimum_score +\
+                    critical_deviance / (2.0 * log_likelihood_scale)
+        task_list = []
+        for p_name in parameter_names:
+            for direction in [-1, 1]:
+                task_list.append((all_names.index(p_name), direction,
+                                  optimum_array, bounds, self.step,
+                                  self.max_steps, max_score,
+                                  self.optimizer_options))
+        if self.num_processes > 1:
+            pool = make_worker_pool(self.num_processes, score_fcn)
+            try:
+                walk_list = pool.map(_walk_profile, task_list)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            walk_list = [walk_profile(score_fcn, *task) for task in task_list]
+            parameter_set.update_from_array(optimum_array)
+
+        # a constrained fit may improve on the optimum we were given
+        best_score = min([optimum_score] +
+                         [point[1] for walk in walk_list for point in walk])
+        if noisy and best_score < optimum_score:
+            print "Profiles found a better score: %.6f < %.6f" %\
+                  (best_score, optimum_score)
+        row_list = []
+        interval_list = []
+        for i, p_name in enumerate(parameter_names):
+            j = all_names.index(p_name)
+            center_row = {'parameter':p_name, 'value':optimum_array[j],
+                          'score':optimum_score, 'num_evaluations':0,
+                          'end_array':optimum_array}
+            row_list.append(center_row)
+            limits = []
+            for walk in walk_list[2 * i:2 * i + 2]:
+                values = [optimum_array[j]]
+                scores = [optimum_score]
+                for value, score, funcalls, end_array in walk:
+                    row_list.append({'parameter':p_name, 'value':value,
+                                     'score':score,
+                                     'num_evaluations':funcalls,
+                                     'end_array':end_array})
+                    values.append(value)
+                    scores.append(score)
+                deviances = 2.0 * log_likelihood_scale *\
+                            (numpy.array(scores) - best_score)
+                limits.append(self.find_interval_limit(
+                                numpy.array(values), deviances,
+                                critical_deviance))
+            interval_list.append({'parameter':p_name,
+                                  'estimate':optimum_array[j],
+                                  'lower':limits[0], 'upper':limits[1]})
+            if noisy:
+                print "%s: %.4f (%.4f, %.4f)" % (p_name, optimum_array[j],
+                                                 limits[0], limits[1])
+        profile_table = pandas.DataFrame(
+                            row_list, columns=['parameter', 'value', 'score',
+                                               'num_evaluations',
+                                               'end_array'])
+        profile_table['deviance'] = 2.0 * log_likelihood_scale *\
+                                    (profile_table['score'] - best_score)
+        interval_table = pandas.DataFrame(
+                            interval_list, columns=['parameter', 'estimate',
+                                                    'lower', 'upper'])
+        interval_table = interval_table.set_index('parameter')
+        return ProfileLikelihoodResult(profile_table, interval_table,
+                                       critical_deviance)
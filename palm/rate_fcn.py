@@ -5,17 +5,29 @@ PARAM_NAME_DICT = {'ka':'log_ka', 'kd':'log_kd', 'kd1':'log_kd1',
                    'kr2b':'log_kr2', 'kb':'log_kb', 'A_to_B':'log_k1',
                    'B_to_A':'log_k2'}
 
+def fermi_activation_rate(t, parameter_set):
+    """
+    Time-dependent activation rate. It rises with `t` and is held
+    constant after `fermi_tf + fermi_tf / fermi_T`, for numerical
+    stability. `t` may be a float or an array.
+    """
+    T = parameter_set.get_parameter('fermi_T')
+    tf = parameter_set.get_parameter('fermi_tf')
+    stability_limit = tf + tf/T
+    t = numpy.minimum(t, stability_limit)
+    numerator = numpy.exp(-(t - tf) / T)
+    denominator = ((1 + numerator) * numpy.log(1 + numerator)) * T
+    ka = numerator / denominator
+    return ka
+
+def get_max_fermi_activation_rate(parameter_set):
+    T = parameter_set.get_parameter('fermi_T')
+    tf = parameter_set.get_parameter('fermi_tf')
+    return fermi_activation_rate(tf + tf/T, parameter_set)
+
 def rate_from_rate_id(rate_id, t, parameter_set, fermi_activation):
     if rate_id == 'ka' and fermi_activation:
-        T = parameter_set.get_parameter('fermi_T')
-        tf = parameter_set.get_parameter('fermi_tf')
-        stability_limit = tf + tf/T
-        if t > stability_limit:
-            t = stability_limit
-        numerator = numpy.exp(-(t - tf) / T)
-        denominator = ((1 + numerator) * numpy.log(1 + numerator)) * T
-        ka = numerator / denominator
-        return ka
+        return fermi_activation_rate(t, parameter_set)
     elif rate_id == 'kr2':
         log_kr_diff = parameter_set.get_parameter('log_kr_diff')
         log_kr1 = parameter_set.get_parameter('log_kr1')
@@ -18,14 +18,21 @@ class ScipyOptimizer(ParameterOptimizer):
     pgtol : float, optional
     epsilon : float, optional
     maxfun : int, optional
+    uncertainty_estimator : ObservedInformationEstimator, optional
+        If given, the uncertainty of the optimized parameters is
+        estimated after each optimization and kept as
+        `uncertainty_estimate`.
     """
-    def __init__(self, factr=1e6, pgtol=1e-5, epsilon=1e-8, maxfun=1000):
+    def __init__(self, factr=1e6, pgtol=1e-5, epsilon=1e-8, maxfun=1000,
+                 uncertainty_estimator=None):
         super(ScipyOptimizer, self).__init__()
         self.optimization_fcn = scipy.optimize.fmin_l_bfgs_b
         self.factr = factr
         self.pgtol = pgtol
         self.epsilon = epsilon
         self.maxfun = maxfun
+        self.uncertainty_estimator = uncertainty_estimator
+        self.uncertainty_estimate = None
 
     def optimize_parameters(self, score_fcn, parameter_set, noisy=False):
         """
@@ -61,5 +68,9 @@ class ScipyOptimizer(ParameterOptimizer):
         optimal_parameter_array = results[0]
         parameter_set.update_from_array(optimal_parameter_array)
         score = float(results[1])
+        if self.uncertainty_estimator is not None:
+            self.uncertainty_estimate =\
+                self.uncertainty_estimator.estimate_uncertainty(
+                    score_fcn, parameter_set)
         return parameter_set, score
 
@@ -1,3 +1,11 @@
+import collections
+import copy
+import hashlib
+import multiprocessing
+import shelve
+import cPickle
+import numpy
+
 class ScoreFunction(object):
     """
     Computes score of a model.
@@ -41,6 +49,67 @@ class ScoreFunction(object):
             print "%.6f,%s" % (score, self.parameter_set)
         return score
 
+    def can_compute_batch(self):
+        return hasattr(self.judge, 'judge_predictions') and\
+               hasattr(self.data_predictor, 'can_predict_batch') and\
+               self.data_predictor.can_predict_batch(self.model_factory)
+
+    def compute_scores(self, parameter_matrix):
+        """
+        Computes the scores of many parameter arrays. If the judge and
+        the data predictor support batches, all models are judged in one
+        pass over the data; otherwise `compute_score` is called for each
+        array.
+
+        Parameters
+        ----------
+        parameter_matrix : ndarray
+            One parameter array per row.
+
+        Returns
+        -------
+        scores : ndarray
+        """
+        parameter_matrix = numpy.atleast_2d(parameter_matrix)
+        if not self.can_compute_batch():
+            return numpy.array([self.compute_score(parameter_array)
+                                for parameter_array in parameter_matrix])
+        model_list = []
+        for parameter_array in parameter_matrix:
+            # models read their rates from the parameter set when rate
+            # matrices are built, so each model needs its own copy
+            self.parameter_set.update_from_array(parameter_array)
+            model_list.append(self.model_factory.create_model(
+                                copy.deepcopy(self.parameter_set)))
+        scores = self.judge.judge_predictions(model_list, self.data_predictor,
+                                              self.target_data)
+        if self.noisy:
+            for parameter_array, score in zip(parameter_matrix, scores):
+                print "%.6f,%s" % (score, parameter_array)
+        return scores
+
+    def compute_trajectory_contributions(self, current_parameter_array):
+        """
+        Computes the log likelihood of each trajectory of the target data,
+        with a judge that has `compute_contributions`, such as
+        `CollectionLikelihoodJudge`.
+
+        Parameters
+        ----------
+        current_parameter_array : ndarray
+
+        Returns
+        -------
+        contributions : TrajectoryContributions
+        """
+        assert hasattr(self.judge, 'compute_contributions'),\
+               "The judge cannot compute per-trajectory contributions."
+        self.parameter_set.update_from_array(current_parameter_array)
+        current_model = self.model_factory.create_model(self.parameter_set)
+        return self.judge.compute_contributions(current_model,
+                                                self.data_predictor,
+                                                self.target_data)
+
 
 class CutoffScoreFunction(object):
     """
@@ -84,3 +153,402 @@ class CutoffScoreFunction(object):
         if self.noisy:
             print "%.6f,%s" % (score, self.parameter_set)
         return score
+
+
+def compute_data_fingerprint(target_data):
+    """
+    Identifies a dataset by its content, so that equal data loaded in
+    different runs, or from csv files and from a store, match. The
+    weights of the trajectories, and the selected indices of a view,
+    are part of the identity, so bootstrap samples that draw the same
+    trajectories different numbers of times differ.
+
+    Returns
+    -------
+    fingerprint : string
+    """
+    if hasattr(target_data, 'get_segment_arrays'):
+        digest = hashlib.sha1(
+                    target_data.get_segment_arrays().get_fingerprint())
+    else:
+        digest = hashlib.sha1(cPickle.dumps(target_data, 2))
+    if hasattr(target_data, 'get_weights'):
+        digest.update(numpy.ascontiguousarray(target_data.get_weights(),
+                                              dtype=numpy.float64).tostring())
+    inds = getattr(target_data, 'inds', None)
+    if inds is not None:
+        digest.update(numpy.ascontiguousarray(inds,
+                                              dtype=numpy.int64).tostring())
+    return digest.hexdigest()
+
+# caches and results of the last calculation, which do not change scores
+TRANSIENT_ATTRIBUTES = ('vector_trajectory', 'rate_matrix_trajectory',
+                        'scaling_factor_set', 'pool', 'histogram_dict',
+                        'histogram_target')
+
+def compute_configuration_fingerprint(obj):
+    """
+    Identifies a judge or data predictor by its class and settings, such
+    as the number of histogram bins or the tolerance of the matrix
+    exponential, ignoring transient state.
+
+    Returns
+    -------
+    fingerprint : string
+    """
+    if hasattr(obj, '__getstate__'):
+        state = obj.__getstate__()
+    else:
+        state = getattr(obj, '__dict__', {})
+    state = [(name, value) for name, value in sorted(state.iteritems())
+             if name not in TRANSIENT_ATTRIBUTES]
+    digest = hashlib.sha1(obj.__class__.__name__)
+    digest.update(cPickle.dumps(state, 2))
+    return digest.hexdigest()
+
+def copy_score_function(score_fcn):
+    """
+    Returns a shallow copy of a ScoreFunction, whose target data, model
+    factory or data predictor may then be replaced. A memoized score
+    function is copied without its cache, whose scores belong to the
+    original settings.
+
+    Returns
+    -------
+    score_fcn_copy : ScoreFunction
+    """
+    if isinstance(score_fcn, MemoizedScoreFunction):
+        score_fcn = score_fcn.score_fcn
+    return copy.copy(score_fcn)
+
+
+def get_score_object(score_fcn):
+    """
+    Optimizers are usually given the bound method `compute_score` of a
+    score function.
+
+    Returns
+    -------
+    score_object : ScoreFunction or callable f(x)
+        The object of a bound method, or else `score_fcn`.
+    """
+    if hasattr(score_fcn, 'im_self') and score_fcn.im_self is not None:
+        return score_fcn.im_self
+    else:
+        return score_fcn
+
+def compute_scores(score_fcn, parameter_matrix):
+    """
+    Scores every row of `parameter_matrix`, in one call to
+    `compute_scores` when the score function has it.
+
+    Parameters
+    ----------
+    score_fcn : ScoreFunction, its `compute_score` method or callable f(x)
+    parameter_matrix : ndarray
+
+    Returns
+    -------
+    scores : ndarray
+    """
+    score_object = get_score_object(score_fcn)
+    if hasattr(score_object, 'compute_scores'):
+        scores = score_object.compute_scores(parameter_matrix)
+    elif hasattr(score_object, 'compute_score'):
+        scores = [score_object.compute_score(parameter_array)
+                  for parameter_array in parameter_matrix]
+    else:
+        scores = [score_object(parameter_array)
+                  for parameter_array in parameter_matrix]
+    return numpy.asarray(scores, dtype=float)
+
+def make_central_difference_stencil(parameter_array, free_inds, step,
+                                    include_pairs=False):
+    """
+    Returns
+    -------
+    parameter_matrix : ndarray
+        `parameter_array`, then the points `step` above and below it
+        along each free parameter, then, if `include_pairs`, the four
+        points of each pair of free parameters, for mixed derivatives.
+    """
+    point_list = [parameter_array]
+    for i in free_inds:
+        for sign in [1.0, -1.0]:
+            point = parameter_array.copy()
+            point[i] += sign * step
+            point_list.append(point)
+    if include_pairs:
+        for a in xrange(len(free_inds)):
+            for b in xrange(a + 1, len(free_inds)):
+                for sign_i, sign_j in [(1, 1), (1, -1), (-1, 1), (-1, -1)]:
+                    point = parameter_array.copy()
+                    point[free_inds[a]] += sign_i * step
+                    point[free_inds[b]] += sign_j * step
+                    point_list.append(point)
+    return numpy.array(point_list)
+
+
+class PicklableScoreCallable(object):
+    """
+    Bound methods cannot be pickled in Python 2, so a score function
+    given as `score_fcn.compute_score` is sent to worker processes as
+    the object and the name of the method.
+    """
+    def __init__(self, score_object, method_name):
+        self.score_object = score_object
+        self.method_name = method_name
+
+    def __call__(self, parameter_array):
+        return getattr(self.score_object, self.method_name)(parameter_array)
+
+def make_picklable_score_fcn(score_fcn):
+    if hasattr(score_fcn, 'im_self') and score_fcn.im_self is not None:
+        return PicklableScoreCallable(score_fcn.im_self,
+                                      score_fcn.im_func.__name__)
+    else:
+        return score_fcn
+
+_pool_worker_state = None
+
+def _init_pool_worker(worker_state):
+    global _pool_worker_state
+    _pool_worker_state = worker_state
+
+def get_pool_worker_state():
+    """
+    The `worker_state` given to `make_worker_pool`, in a worker process.
+    """
+    return _pool_worker_state
+
+def make_worker_pool(num_processes, worker_state):
+    """
+    Makes a process pool whose workers receive `worker_state`, usually
+    a score function, once when they start rather than with every task.
+    Tasks read it with `get_pool_worker_state`.
+
+    Parameters
+    ----------
+    num_processes : int
+    worker_state : object
+        Picklable, or a bound method.
+
+    Returns
+    -------
+    pool : multiprocessing.Pool
+    """
+    return multiprocessing.Pool(
+                num_processes, initializer=_init_pool_worker,
+                initargs=(make_picklable_score_fcn(worker_state),))
+
+class MemoizedScoreFunction(object):
+    """
+    Caches the scores of a ScoreFunction by the exact parameter array.
+    Optimizers revisit points during line searches, and when bounds
+    clip a finite-difference step; those repeats are served from the
+    cache instead of recomputing the likelihood of the collection.
+
+    The most recently used `max_cache_size` scores are kept in memory.
+    With `cache_file`, every score is also written to a shelve
+    database, so that restarted or repeated runs on the same data reuse
+    earlier evaluations. Keys combine the parameter array with a
+    fingerprint of the data, the model factory, the settings of the
+    judge and predictor and the class and bounds of the parameter set,
+    so one file can be shared by different fits.
+
+    The target data, parameter set, model factory, judge and data
+    predictor of `score_fcn` are available as attributes, so the wrapper
+    can be used wherever a ScoreFunction is expected.
+
+    Attributes
+    ----------
+    num_hits : int
+        Scores found in memory.
+    num_disk_hits : int
+        Scores found in `cache_file` but not in memory.
+    num_misses : int
+        Scores computed by `score_fcn`.
+
+    Parameters
+    ----------
+    score_fcn : ScoreFunction
+    max_cache_size : int, optional
+    cache_file : string, optional
+    """
+    def __init__(self, score_fcn, max_cache_size=10000, cache_file=None):
+        super(MemoizedScoreFunction, self).__init__()
+        self.score_fcn = score_fcn
+        self.max_cache_size = max_cache_size
+        self.cache = collections.OrderedDict()
+        self.cache_file = cache_file
+        if cache_file is None:
+            self.disk_cache = None
+        else:
+            self.disk_cache = shelve.open(cache_file, protocol=2)
+        self.context_fingerprint = self._compute_context_fingerprint()
+        self.num_hits = 0
+        self.num_disk_hits = 0
+        self.num_misses = 0
+
+    def __getstate__(self):
+        # worker processes keep their own memory caches and do not
+        # share the shelve database
+        state = self.__dict__.copy()
+        state['disk_cache'] = None
+        return state
+
+    @property
+    def target_data(self):
+        return self.score_fcn.target_data
+
+    @property
+    def parameter_set(self):
+        return self.score_fcn.parameter_set
+
+    @property
+    def model_factory(self):
+        return self.score_fcn.model_factory
+
+    @property
+    def judge(self):
+        return self.score_fcn.judge
+
+    @property
+    def data_predictor(self):
+        return self.score_fcn.data_predictor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _compute_context_fingerprint(self):
+        score_fcn = self.score_fcn
+        digest = hashlib.sha1()
+        digest.update(compute_data_fingerprint(score_fcn.target_data))
+        digest.update(cPickle.dumps(score_fcn.model_factory, 2))
+        for obj in [score_fcn.judge, score_fcn.data_predictor]:
+            digest.update(compute_configuration_fingerprint(obj))
+        # parameter values are overwritten by each parameter array
+        parameter_set = score_fcn.parameter_set
+        digest.update(parameter_set.__class__.__name__)
+        bounds = [tuple(None if b is None else float(b) for b in bound_pair)
+                  for bound_pair in parameter_set.get_parameter_bounds()]
+        digest.update(cPickle.dumps(bounds, 2))
+        return digest.hexdigest()
+
+    def make_key(self, current_parameter_array):
+        parameter_array = numpy.ascontiguousarray(current_parameter_array,
+                                                  dtype=numpy.float64)
+        digest = hashlib.sha1(self.context_fingerprint)
+        digest.update(parameter_array.tostring())
+        return digest.hexdigest()
+
+    def compute_score(self, current_parameter_array):
+        """
+        Parameters
+        ----------
+        current_parameter_array : ndarray
+
+        Returns
+        -------
+        score : float
+        """
+        key = self.make_key(current_parameter_array)
+        if key in self.cache:
+            score = self.cache.pop(key)
+            self.num_hits += 1
+        elif self.disk_cache is not None and key in self.disk_cache:
+            score = self.disk_cache[key]
+            self.num_disk_hits += 1
+        else:
+            score = self.score_fcn.compute_score(current_parameter_array)
+            self.num_misses += 1
+            if self.disk_cache is not None:
+                self.disk_cache[key] = score
+        # the wrapped function leaves its parameter set at the last
+        # evaluated point; keep doing so for cached scores
+        self.score_fcn.parameter_set.update_from_array(current_parameter_array)
+        self.cache[key] = score
+        if len(self.cache) > self.max_cache_size:
+            self.cache.popitem(last=False)
+        return score
+
+    def compute_scores(self, parameter_matrix):
+        """
+        Scores many parameter arrays, computing those not found in the
+        caches with one call to `compute_scores` of `score_fcn`.
+
+        Parameters
+        ----------
+        parameter_matrix : ndarray
+            One parameter array per row.
+
+        Returns
+        -------
+        scores : ndarray
+        """
+        parameter_matrix = numpy.atleast_2d(parameter_matrix)
+        key_list = [self.make_key(p) for p in parameter_matrix]
+        scores = numpy.zeros(len(parameter_matrix))
+        miss_inds = []
+        for i, key in enumerate(key_list):
+            if key in self.cache:
+                scores[i] = self.cache.pop(key)
+                self.num_hits += 1
+            elif self.disk_cache is not None and key in self.disk_cache:
+                scores[i] = self.disk_cache[key]
+                self.num_disk_hits += 1
+            else:
+                miss_inds.append(i)
+        if miss_inds:
+            if hasattr(self.score_fcn, 'compute_scores'):
+                scores[miss_inds] = self.score_fcn.compute_scores(
+                                        parameter_matrix[miss_inds])
+            else:
+                scores[miss_inds] = [self.score_fcn.compute_score(p) for p in
+                                     parameter_matrix[miss_inds]]
+            self.num_misses += len(miss_inds)
+            if self.disk_cache is not None:
+                for i in miss_inds:
+                    self.disk_cache[key_list[i]] = float(scores[i])
+        self.score_fcn.parameter_set.update_from_array(parameter_matrix[-1])
+        for key, score in zip(key_list, scores):
+            self.cache.pop(key, None)
+            self.cache[key] = float(score)
+        while len(self.cache) > self.max_cache_size:
+            self.cache.popitem(last=False)
+        return scores
+
+    def get_hit_statistics(self):
+        """
+        Returns
+        -------
+        statistics : dict
+            Counts of hits, disk hits and misses, and the fraction of
+            calls served from a cache.
+        """
+        num_calls = self.num_hits + self.num_disk_hits + self.num_misses
+        if num_calls > 0:
+            hit_rate = (self.num_hits + self.num_disk_hits) / float(num_calls)
+        else:
+            hit_rate = 0.0
+        return {'num_hits':self.num_hits, 'num_disk_hits':self.num_disk_hits,
+                'num_misses':self.num_misses, 'num_calls':num_calls,
+                'hit_rate':hit_rate}
+
+    def clear(self):
+        """
+        Empties the in-memory cache and resets the statistics. The disk
+        cache is kept.
+        """
+        self.cache.clear()
+        self.num_hits = 0
+        self.num_disk_hits = 0
+        self.num_misses = 0
+
+    def close(self):
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+            self.disk_cache = None
@@ -7,7 +7,8 @@ from palm.base.parameter_set import ParameterSet
 from palm.base.target_data import TargetData
 from palm.aggregated_kinetic_model import AggregatedKineticModel
 from palm.discrete_state_trajectory import DiscreteStateTrajectory,\
-                                           DiscreteDwellSegment
+                                           DiscreteDwellSegment,\
+                                           load_trajectory_from_csv
 from palm.state_collection import StateCollectionFactory
 from palm.route_collection import RouteCollectionFactory
 from palm.probability_vector import make_prob_vec_from_state_ids
@@ -233,14 +234,9 @@ class SimpleTargetData(TargetData):
         self.segment_factory = DiscreteDwellSegment
 
     def load_data(self, data_file):
-        data_table = pandas.read_csv(data_file, header=0)
-        self.trajectory = self.trajectory_factory()
-        for segment_data in data_table.itertuples():
-            segment_class = str(segment_data[1])
-            segment_dwell_time = float(segment_data[2])
-            new_segment = self.segment_factory(segment_class,
-                                               segment_dwell_time)
-            self.trajectory.add_segment(new_segment)
+        self.trajectory = load_trajectory_from_csv(data_file,
+                                                   self.trajectory_factory)
+        self.trajectory.segment_factory = self.segment_factory
 
     def get_feature(self):
         return self.trajectory
@@ -0,0 +1,219 @@
+import numpy
+import pandas
+import scipy.optimize
+from palm.base.parameter_optimizer import ParameterOptimizer
+from palm.score_function import copy_score_function, get_score_object,\
+                                compute_scores, make_central_difference_stencil
+from palm.util import make_random_state
+
+class StochasticOptimizer(ParameterOptimizer):
+    """
+    Optimizes parameters with Adam steps on scores of random minibatches
+    of trajectories, for collections too large for a full pass at every
+    step of BFGS.
+
+    At each iteration, a minibatch is drawn without replacement and the
+    gradient of its score is estimated by central finite differences,
+    with the center and the `2 d` points for `d` free parameters scored
+    together by `ScoreFunction.compute_scores`, on the same trajectories.
+    The learning rate decays as ``learning_rate / (1 + decay * t)``.
+
+    The ratio of the Adam first moment to the root of its second moment
+    measures the signal-to-noise ratio of the gradient. When it drops
+    below `grow_tolerance`, the steps are dominated by minibatch noise,
+    and the batch size is multiplied by `batch_growth`. The stochastic
+    phase ends when this happens with the full collection, or after
+    `max_iterations`, and a few iterations of bounded BFGS on the full
+    collection polish the result, with gradients from the same batched
+    finite differences.
+
+    Attributes
+    ----------
+    history : pandas.DataFrame
+        One row per stochastic iteration, with the batch size, the
+        minibatch score, the learning rate and the signal-to-noise ratio.
+
+    Parameters
+    ----------
+    initial_batch_size : int, optional
+    batch_growth : float, optional
+    learning_rate : float, optional
+    learning_rate_decay : float, optional
+    beta1 : float, optional
+    beta2 : float, optional
+    gradient_step : float, optional
+        Finite difference step in each free parameter.
+    grow_tolerance : float, optional
+    min_iterations_per_batch : int, optional
+        Iterations at each batch size before it may grow again.
+    max_iterations : int, optional
+    num_polish_iterations : int, optional
+        BFGS iterations on the full collection; 0 to skip the polish.
+    default_bounds : tuple, optional
+        Range for parameters without bounds.
+    random_state : None, int or numpy.random.RandomState, optional
+    """
+    def __init__(self, initial_batch_size=256, batch_growth=2.0,
+                 learning_rate=0.05, learning_rate_decay=0.01, beta1=0.9,
+                 beta2=0.999, gradient_step=1e-3, grow_tolerance=0.3,
+                 min_iterations_per_batch=10, max_iterations=500,
+                 num_polish_iterations=5, default_bounds=(-3.0, 3.0),
+                 random_state=None):
+        super(StochasticOptimizer, self).__init__()
+        self.initial_batch_size = initial_batch_size
+        self.batch_growth = batch_growth
+        self.learning_rate = learning_rate
+        self.learning_rate_decay = learning_rate_decay
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.adam_epsilon = 1e-8
+        self.gradient_step = gradient_step
+        self.grow_tolerance = grow_tolerance
+        self.min_iterations_per_batch = min_iterations_per_batch
+        self.max_iterations = max_iterations
+        self.num_polish_iterations = num_polish_iterations
+        self.default_bounds = default_bounds
+        self.random_state = make_random_state(random_state)
+        self.history = None
+
+    def make_minibatch_score_fcn(self, score_object, batch_size):
+        """
+        Returns
+        -------
+        minibatch_score_fcn : ScoreFunction
+            A shallow copy of `score_object` that scores a random subset
+            of `batch_size` trajectories of its target data.
+        """
+        target_data = score_object.target_data
+        if batch_size >= len(target_data):
+            return score_object
+        inds = numpy.sort(self.random_state.choice(len(target_data),
+                                                   batch_size, replace=False))
+        minibatch_score_fcn = copy_score_function(score_object)
+        minibatch_score_fcn.target_data =\
+            target_data.make_copy_from_selection(inds)
+        return minibatch_score_fcn
+
+    def estimate_gradient(self, minibatch_score_fcn, parameter_array,
+                          free_inds):
+        """
+        Returns
+        -------
+        score : float
+            The minibatch score at `parameter_array`.
+        gradient : ndarray
+            With respect to the free parameters.
+        """
+        h = self.gradient_step
+        scores = compute_scores(minibatch_score_fcn,
+                                make_central_difference_stencil(
+                                    parameter_array, free_inds, h))
+        gradient = (scores[1::2] - scores[2::2]) / (2.0 * h)
+        return float(scores[0]), gradient
+
+    def compute_full_score_and_gradient(self, parameter_array, score_object,
+                                        free_inds):
+        """
+        The score on the full collection and its gradient with respect to
+        every parameter, zero for fixed parameters, for BFGS polishing.
+        """
+        score, free_gradient = self.estimate_gradient(
+                                    score_object, numpy.asarray(
+                                        parameter_array, dtype=float),
+                                    free_inds)
+        gradient = numpy.zeros(len(parameter_array))
+        gradient[free_inds] = free_gradient
+        return score, gradient
+
+    def optimize_parameters(self, score_fcn, parameter_set, noisy=False):
+        """
+        Parameters
+        ----------
+        score_fcn : ScoreFunction or its `compute_score` method
+            Must have `target_data` that supports
+            `make_copy_from_selection`.
+        parameter_set : ParameterSet
+            Initial parameters; set to the optimized parameters.
+        noisy : bool, optional
+
+        Returns
+        -------
+        parameter_set : ParameterSet
+        score : float
+            The score of the optimized parameters on the full collection.
+        """
+        score_object = get_score_object(score_fcn)
+        num_trajectories = len(score_object.target_data)
+        bounds = parameter_set.get_parameter_bounds()
+        parameter_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        free_inds = []
+        lower_list = []
+        upper_list = []
+        for j, (lower, upper) in enumerate(bounds):
+            if lower is not None and lower == upper:
+                continue
+            free_inds.append(j)
+            lower_list.append(self.default_bounds[0] if lower is None
+                              else lower)
+            upper_list.append(self.default_bounds[1] if upper is None
+                              else upper)
+        free_inds = numpy.array(free_inds, dtype=int)
+        # keep the finite difference stencil inside the bounds
+        lower = numpy.array(lower_list, dtype=float) + self.gradient_step
+        upper = numpy.array(upper_list, dtype=float) - self.gradient_step
+        x = numpy.clip(parameter_array[free_inds], lower, upper)
+        m = numpy.zeros(len(free_inds))
+        v = numpy.zeros(len(free_inds))
+        batch_size = min(self.initial_batch_size, num_trajectories)
+        iterations_at_batch_size = 0
+        row_list = []
+        for t in xrange(1, self.max_iterations + 1):
+            parameter_array[free_inds] = x
+            minibatch_score_fcn = self.make_minibatch_score_fcn(score_object,
+                                                                batch_size)
+            score, gradient = self.estimate_gradient(minibatch_score_fcn,
+                                                     parameter_array,
+                                                     free_inds)
+            m = self.beta1 * m + (1.0 - self.beta1) * gradient
+            v = self.beta2 * v + (1.0 - self.beta2) * gradient**2
+            m_hat = m / (1.0 - self.beta1**t)
+            v_hat = v / (1.0 - self.beta2**t)
+            direction = m_hat / (numpy.sqrt(v_hat) + self.adam_epsilon)
+            learning_rate = self.learning_rate /\
+                            (1.0 + self.learning_rate_decay * t)
+            x = numpy.clip(x - learning_rate * direction, lower, upper)
+            signal_to_noise = numpy.sqrt(numpy.mean(direction**2))
+            row_list.append({'iteration':t, 'batch_size':batch_size,
+                             'score':score, 'learning_rate':learning_rate,
+                             'signal_to_noise':signal_to_noise})
+            if noisy:
+                print "%d,%d,%.6f,%.4f" % (t, batch_size, score,
+                                           signal_to_noise)
+            iterations_at_batch_size += 1
+            if iterations_at_batch_size >= self.min_iterations_per_batch and\
+               signal_to_noise < self.grow_tolerance:
+                if batch_size >= num_trajectories:
+                    break
+                batch_size = min(int(batch_size * self.batch_growth),
+                                 num_trajectories)
+                iterations_at_batch_size = 0
+        self.history = pandas.DataFrame(
+                        row_list, columns=['iteration', 'batch_size', 'score',
+                                           'learning_rate',
+                                           'signal_to_noise'])
+        parameter_array[free_inds] = x
+        if self.num_polish_iterations > 0:
+            polish_bounds = list(bounds)
+            for k, j in enumerate(free_inds):
+                polish_bounds[j] = (lower[k], upper[k])
+            results = scipy.optimize.fmin_l_bfgs_b(
+                        self.compute_full_score_and_gradient,
+                        x0=parameter_array, args=(score_object, free_inds),
+                        bounds=polish_bounds, iprint=(1 if noisy else -1),
+                        maxiter=self.num_polish_iterations)
+            parameter_array = results[0]
+            score = float(results[1])
+        else:
+            score = float(score_object.compute_score(parameter_array))
+        parameter_set.update_from_array(parameter_array)
+        return parameter_set, score
@@ -0,0 +1,356 @@
+import numpy
+import pandas
+import scipy.linalg
+import scipy.optimize
+import scipy.stats
+from palm.base.parameter_optimizer import ParameterOptimizer
+from palm.score_function import make_worker_pool, get_pool_worker_state
+from palm.util import make_random_state
+
+class GaussianProcessSurrogate(object):
+    """
+    Gaussian process regression with a Matern 5/2 kernel that has one
+    length scale per input dimension. Inputs are expected in the unit
+    cube; outputs are standardized internally. The length scales,
+    signal variance and noise variance maximize the log marginal
+    likelihood.
+
+    Parameters
+    ----------
+    num_restarts : int, optional
+        Number of random starts of the hyperparameter fit, besides the
+        previous hyperparameters.
+    random_state : None, int or numpy.random.RandomState, optional
+    """
+    def __init__(self, num_restarts=3, random_state=None):
+        super(GaussianProcessSurrogate, self).__init__()
+        self.num_restarts = num_restarts
+        self.random_state = make_random_state(random_state)
+        self.log_hyperparameters = None
+        self.X = None
+
+    def _compute_kernel(self, X1, X2, length_scales, signal_variance):
+        scaled_diffs = (X1[:, None, :] - X2[None, :, :]) / length_scales
+        r = numpy.sqrt(5.0 * (scaled_diffs**2).sum(axis=2))
+        return signal_variance * (1.0 + r + r**2 / 3.0) * numpy.exp(-r)
+
+    def _unpack(self, log_hyperparameters):
+        hyperparameters = numpy.exp(log_hyperparameters)
+        return hyperparameters[:-2], hyperparameters[-2], hyperparameters[-1]
+
+    def _compute_negative_log_likelihood(self, log_hyperparameters, X, y):
+        length_scales, signal_variance, noise_variance =\
+            self._unpack(log_hyperparameters)
+        K = self._compute_kernel(X, X, length_scales, signal_variance)
+        K[numpy.diag_indices_from(K)] += noise_variance + 1e-10
+        try:
+            cholesky = scipy.linalg.cho_factor(K, lower=True)
+        except numpy.linalg.LinAlgError:
+            return 1e10
+        alpha = scipy.linalg.cho_solve(cholesky, y)
+        return 0.5 * numpy.dot(y, alpha) +\
+               numpy.log(numpy.diag(cholesky[0])).sum()
+
+    def fit(self, X, y, optimize_hyperparameters=True):
+        """
+        Parameters
+        ----------
+        X : ndarray
+            Points in the unit cube, one per row.
+        y : ndarray
+        optimize_hyperparameters : bool, optional
+            If False, the previous hyperparameters are kept.
+        """
+        X = numpy.asarray(X, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        self.y_mean = y.mean()
+        self.y_std = max(y.std(), 1e-12)
+        y_standard = (y - self.y_mean) / self.y_std
+        num_dims = X.shape[1]
+        log_bounds = [(numpy.log(1e-2), numpy.log(10.0))] * num_dims +\
+                     [(numpy.log(1e-2), numpy.log(100.0)),
+                      (numpy.log(1e-8), numpy.log(1.0))]
+        if self.log_hyperparameters is None:
+            self.log_hyperparameters = numpy.append(
+                numpy.log(0.3) * numpy.ones(num_dims),
+                [0.0, numpy.log(1e-4)])
+            optimize_hyperparameters = True
+        if optimize_hyperparameters:
+            start_list = [self.log_hyperparameters] +\
+                [numpy.array([self.random_state.uniform(lower, upper)
+                              for lower, upper in log_bounds])
+                 for i in xrange(self.num_restarts)]
+            best_value = numpy.inf
+            for start in start_list:
+                result = scipy.optimize.fmin_l_bfgs_b(
+                            self._compute_negative_log_likelihood, x0=start,
+                            args=(X, y_standard), bounds=log_bounds,
+                            approx_grad=1, maxfun=200)
+                if result[1] < best_value:
+                    best_value = result[1]
+                    self.log_hyperparameters = result[0]
+        length_scales, signal_variance, noise_variance =\
+            self._unpack(self.log_hyperparameters)
+        K = self._compute_kernel(X, X, length_scales, signal_variance)
+        K[numpy.diag_indices_from(K)] += noise_variance + 1e-10
+        self.cholesky = scipy.linalg.cho_factor(K, lower=True)
+        self.alpha = scipy.linalg.cho_solve(self.cholesky, y_standard)
+        self.X = X
+
+    def predict(self, X_new):
+        """
+        Returns
+        -------
+        mean, std : ndarray
+            Predicted mean and standard deviation at each row of `X_new`.
+        """
+        X_new = numpy.atleast_2d(X_new)
+        length_scales, signal_variance, noise_variance =\
+            self._unpack(self.log_hyperparameters)
+        K_new = self._compute_kernel(X_new, self.X, length_scales,
+                                     signal_variance)
+        mean = numpy.dot(K_new, self.alpha)
+        v = scipy.linalg.cho_solve(self.cholesky, K_new.T)
+        variance = signal_variance - (K_new * v.T).sum(axis=1)
+        std = numpy.sqrt(numpy.maximum(variance, 1e-12))
+        return self.y_mean + self.y_std * mean, self.y_std * std
+
+
+def compute_expected_improvement(mean, std, best_score, xi=0.0):
+    """
+    Expected improvement below `best_score`, for minimization.
+    """
+    improvement = best_score - mean - xi
+    z = improvement / std
+    return improvement * scipy.stats.norm.cdf(z) +\
+           std * scipy.stats.norm.pdf(z)
+
+def _evaluate_point(parameter_array):
+    return float(get_pool_worker_state()(parameter_array))
+
+
+class SurrogateOptimizer(ParameterOptimizer):
+    """
+    Bayesian optimization for expensive score functions. A Gaussian
+    process surrogate of the score is fit over the box given by the
+    parameter bounds, and new points are chosen by expected improvement,
+    `batch_size` at a time so that they can be scored in parallel. The
+    points of a batch are chosen one after the other, each time adding
+    the surrogate mean at the chosen point as if it had been scored
+    ("kriging believer"), which spreads the batch out.
+
+    The search stops when `max_evaluations` scores have been computed or
+    when the largest expected improvement falls below
+    `ei_tolerance`; the best point is then refined by bounded BFGS.
+
+    Attributes
+    ----------
+    evaluation_table : pandas.DataFrame
+        Every scored parameter array, its score and the stage
+        ('initial', 'acquisition' or 'local') in which it was scored.
+
+    Parameters
+    ----------
+    num_initial_points : int, optional
+        Size of the initial Latin hypercube design, which also includes
+        the given parameter set. Defaults to twice the number of free
+        parameters plus one.
+    batch_size : int, optional
+    max_evaluations : int, optional
+        Evaluations before the local refinement.
+    ei_tolerance : float, optional
+    num_processes : int, optional
+        With more than one process, `score_fcn` is sent to a process
+        pool, like in `MultiStartOptimizer`.
+    default_bounds : tuple, optional
+        Search range for parameters without bounds.
+    num_candidates : int, optional
+        Random points at which the expected improvement is evaluated
+        before refining the best few.
+    local_maxfun : int, optional
+        Evaluations allowed to the local refinement; 0 skips it.
+    random_state : None, int or numpy.random.RandomState, optional
+    factr : float, optional
+    pgtol : float, optional
+    epsilon : float, optional
+    """
+    def __init__(self, num_initial_points=None, batch_size=4,
+                 max_evaluations=60, ei_tolerance=1e-4, num_processes=1,
+                 default_bounds=(-3.0, 3.0), num_candidates=2000,
+                 local_maxfun=200, random_state=None, factr=1e6,
+                 pgtol=1e-5, epsilon=1e-8):
+        super(SurrogateOptimizer, self).__init__()
+        self.num_initial_points = num_initial_points
+        self.batch_size = batch_size
+        self.max_evaluations = max_evaluations
+        self.ei_tolerance = ei_tolerance
+        self.num_processes = num_processes
+        self.default_bounds = default_bounds
+        self.num_candidates = num_candidates
+        self.local_maxfun = local_maxfun
+        self.random_state = make_random_state(random_state)
+        self.factr = factr
+        self.pgtol = pgtol
+        self.epsilon = epsilon
+        self.evaluation_table = None
+
+    def _get_search_box(self, parameter_set):
+        bounds = parameter_set.get_parameter_bounds()
+        free_inds = []
+        lower_list = []
+        upper_list = []
+        for j, (lower, upper) in enumerate(bounds):
+            if lower is not None and lower == upper:
+                continue
+            free_inds.append(j)
+            lower_list.append(self.default_bounds[0] if lower is None
+                              else lower)
+            upper_list.append(self.default_bounds[1] if upper is None
+                              else upper)
+        return (numpy.array(free_inds), numpy.array(lower_list, dtype=float),
+                numpy.array(upper_list, dtype=float))
+
+    def _make_initial_design(self, num_points, num_dims):
+        # Latin hypercube: one point in each of `num_points` slices of
+        # every dimension
+        design = numpy.zeros((num_points, num_dims))
+        for j in xrange(num_dims):
+            slices = self.random_state.permutation(num_points)
+            design[:, j] = (slices + self.random_state.rand(num_points)) /\
+                           num_points
+        return design
+
+    def _choose_batch(self, surrogate, U, scores, num_points):
+        num_dims = U.shape[1]
+        U_fantasy = U.copy()
+        scores_fantasy = scores.copy()
+        batch = []
+        best_ei = 0.0
+        for i in xrange(num_points):
+            if i > 0:
+                surrogate.fit(U_fantasy, scores_fantasy,
+                              optimize_hyperparameters=False)
+            best_score = scores_fantasy.min()
+            def negative_ei(u):
+                mean, std = surrogate.predict(u)
+                return -compute_expected_improvement(mean, std,
+                                                     best_score)[0]
+            candidates = self.random_state.rand(self.num_candidates,
+                                                num_dims)
+            mean, std = surrogate.predict(candidates)
+            ei = compute_expected_improvement(mean, std, best_score)
+            best_u = None
+            best_value = numpy.inf
+            for start in candidates[numpy.argsort(ei)[-3:]]:
+                result = scipy.optimize.fmin_l_bfgs_b(
+                            negative_ei, x0=start, approx_grad=1,
+                            bounds=[(0.0, 1.0)] * num_dims, maxfun=100)
+                if result[1] < best_value:
+                    best_value = result[1]
+                    best_u = result[0]
+            if i == 0:
+                best_ei = -best_value
+            batch.append(best_u)
+            believed_mean = surrogate.predict(best_u)[0][0]
+            U_fantasy = numpy.vstack([U_fantasy, best_u])
+            scores_fantasy = numpy.append(scores_fantasy, believed_mean)
+        return numpy.array(batch), best_ei
+
+    def optimize_parameters(self, score_fcn, parameter_set, noisy=False):
+        """
+        Parameters
+        ----------
+        score_fcn : callable f(x)
+        parameter_set : ParameterSet
+            Included in the initial design; set to the best parameters
+            found.
+        noisy : bool, optional
+
+        Returns
+        -------
+        parameter_set : ParameterSet
+        score : float
+        """
+        free_inds, lower, upper = self._get_search_box(parameter_set)
+        num_dims = len(free_inds)
+        template_array = numpy.asarray(parameter_set.as_array(), dtype=float)
+        def to_parameter_array(u):
+            parameter_array = template_array.copy()
+            parameter_array[free_inds] = lower + u * (upper - lower)
+            return parameter_array
+        if self.num_processes > 1:
+            pool = make_worker_pool(self.num_processes, score_fcn)
+        else:
+            pool = None
+        array_list = []
+        score_list = []
+        stage_list = []
+        def evaluate(U_batch, stage):
+            parameter_arrays = [to_parameter_array(u) for u in U_batch]
+            if pool is None:
+                batch_scores = [float(score_fcn(parameter_array))
+                                for parameter_array in parameter_arrays]
+            else:
+                batch_scores = pool.map(_evaluate_point, parameter_arrays)
+            array_list.extend(parameter_arrays)
+            score_list.extend(batch_scores)
+            stage_list.extend([stage] * len(parameter_arrays))
+            return numpy.array(batch_scores)
+        try:
+            num_initial_points = self.num_initial_points
+            if num_initial_points is None:
+                num_initial_points = 2 * num_dims + 1
+            start_u = numpy.clip((template_array[free_inds] - lower) /
+                                 (upper - lower), 0.0, 1.0)
+            U = numpy.vstack([start_u,
+                              self._make_initial_design(
+                                num_initial_points - 1, num_dims)])
+            scores = evaluate(U, 'initial')
+            surrogate = GaussianProcessSurrogate(random_state=self.random_state)
+            while len(scores) < self.max_evaluations:
+                surrogate.fit(U, scores)
+                num_points = min(self.batch_size,
+                                 self.max_evaluations - len(scores))
+                U_batch, best_ei = self._choose_batch(surrogate, U, scores,
+                                                      num_points)
+                if noisy:
+                    print "%d evaluations, best %.6f, expected improvement"\
+                          " %.3e" % (len(scores), scores.min(), best_ei)
+                if best_ei < self.ei_tolerance:
+                    break
+                U = numpy.vstack([U, U_batch])
+                scores = numpy.append(scores, evaluate(U_batch, 'acquisition'))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        best_index = numpy.argmin(score_list)
+        best_array = array_list[best_index]
+        best_score = score_list[best_index]
+        if self.local_maxfun > 0:
+            local_scores = []
+            local_arrays = []
+            def local_score_fcn(parameter_array):
+                score = float(score_fcn(parameter_array))
+                local_arrays.append(numpy.array(parameter_array))
+                local_scores.append(score)
+                return score
+            results = scipy.optimize.fmin_l_bfgs_b(
+                        local_score_fcn, x0=best_array,
+                        bounds=parameter_set.get_parameter_bounds(),
+                        approx_grad=1, iprint=(1 if noisy else -1),
+                        factr=self.factr, pgtol=self.pgtol,
+                        epsilon=self.epsilon, maxfun=self.local_maxfun)
+            array_list.extend(local_arrays)
+            score_list.extend(local_scores)
+            stage_list.extend(['local'] * len(local_arrays))
+            if results[1] < best_score:
+                best_array = results[0]
+                best_score = float(results[1])
+        self.evaluation_table = pandas.DataFrame(
+                                    {'parameter_array':array_list,
+                                     'score':score_list, 'stage':stage_list},
+                                    columns=['parameter_array', 'score',
+                                             'stage'])
+        parameter_set.update_from_array(best_array)
+        return parameter_set, best_score
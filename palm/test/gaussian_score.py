@@ -0,0 +1,30 @@
+import numpy
+from palm.blink_parameter_set import SingleDarkParameterSet
+
+MEAN = numpy.array([0.5, -0.5, 0.0, -1.0])
+COVARIANCE = numpy.array([[0.01, 0.01, 0.0, 0.0],
+                          [0.01, 0.04, 0.0, 0.0],
+                          [0.0, 0.0, 0.09, 0.0],
+                          [0.0, 0.0, 0.0, 0.01]])
+
+class UnweightedData(object):
+    def get_weights(self):
+        return numpy.ones(1)
+
+class GaussianScore(object):
+    # minus the log10 likelihood of one trajectory, Gaussian in the
+    # four rates, so the posterior is Gaussian too
+    def __init__(self, covariance=COVARIANCE, start_at_mean=True):
+        self.parameter_set = SingleDarkParameterSet()
+        for p_name, value in zip(['log_ka', 'log_kd', 'log_kr', 'log_kb'],
+                                 MEAN):
+            if start_at_mean:
+                self.parameter_set.set_parameter(p_name, value)
+            self.parameter_set.set_parameter_bounds(p_name, -3.0, 3.0)
+        self.target_data = UnweightedData()
+        self.precision = numpy.linalg.inv(covariance)
+
+    def compute_score(self, parameter_array):
+        x = numpy.asarray(parameter_array[:4]) - MEAN
+        return numpy.dot(x, numpy.dot(self.precision, x)) /\
+               (2.0 * numpy.log(10.0))
@@ -0,0 +1,55 @@
+import nose.tools
+import numpy
+from palm.blink_distributions import BlinkDistributionEngine
+from palm.blink_simulator import BlinkSimulator
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet
+
+@nose.tools.nottest
+def make_model(N):
+    model_factory = SingleDarkBlinkFactory(MAX_A=2)
+    model_parameters = SingleDarkParameterSet()
+    model_parameters.set_parameter('N', N)
+    model_parameters.set_parameter('log_kd', -0.5)
+    return model_factory.create_model(model_parameters)
+
+@nose.tools.istest
+def single_fluorophore_distributions_are_exponential_and_geometric():
+    engine = BlinkDistributionEngine(make_model(1))
+    ka = kr = kb = 0.1
+    kd = 10**-0.5
+    time_array = numpy.linspace(0.0, 30.0, 7)
+    dark_pdf, dark_cdf = engine.get_dark_time_distribution(time_array)
+    nose.tools.ok_(numpy.allclose(dark_pdf, kr * numpy.exp(-kr * time_array)))
+    nose.tools.ok_(numpy.allclose(dark_cdf, 1 - numpy.exp(-kr * time_array)))
+    bright_pdf, bright_cdf = engine.get_bright_time_distribution(time_array)
+    nose.tools.ok_(numpy.allclose(
+        bright_pdf, (kd + kb) * numpy.exp(-(kd + kb) * time_array)))
+    activation_pdf, activation_cdf =\
+        engine.get_activation_time_distribution(time_array)
+    nose.tools.ok_(numpy.allclose(activation_pdf,
+                                  ka * numpy.exp(-ka * time_array)))
+    blink_prob = kd / (kd + kb)
+    expected_pmf = (1 - blink_prob) * blink_prob**numpy.arange(5)
+    nose.tools.ok_(numpy.allclose(engine.get_num_blink_distribution(4),
+                                  expected_pmf))
+
+@nose.tools.istest
+def distributions_agree_with_simulated_trajectories():
+    model = make_model(2)
+    engine = BlinkDistributionEngine(model)
+    segment_arrays = BlinkSimulator(model, random_state=0).simulate(20000)
+    observed_dict = {'dark':segment_arrays.get_dark_times(),
+                     'bright':segment_arrays.get_bright_times(),
+                     'activation':segment_arrays.get_activation_times(),
+                     'bleach':segment_arrays.get_bleach_times()}
+    for name, observed in observed_dict.iteritems():
+        median_time = numpy.median(observed)
+        distribution_fcn = getattr(engine, 'get_%s_time_distribution' % name)
+        pdf, cdf = distribution_fcn(numpy.array([median_time]))
+        error_msg = "%s: expected cdf 0.5 at median, got %.3f" % (name, cdf[0])
+        nose.tools.ok_(abs(cdf[0] - 0.5) < 0.02, error_msg)
+    num_blinks = segment_arrays.get_num_blinks()
+    observed_pmf = numpy.bincount(num_blinks)[:5] / float(len(num_blinks))
+    predicted_pmf = engine.get_num_blink_distribution(4)
+    nose.tools.ok_(numpy.allclose(observed_pmf, predicted_pmf, atol=0.01))
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import nose.tools
+import numpy
+from palm.blink_simulator import BlinkSimulator
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.blink_target_data import BlinkCollectionTargetData
+from palm.trajectory_store import StoredBlinkCollectionTargetData
+
+@nose.tools.nottest
+def make_model(N, fermi_activation=False):
+    model_factory = SingleDarkBlinkFactory(fermi_activation=fermi_activation,
+                                           MAX_A=2)
+    model_parameters = SingleDarkParameterSet()
+    model_parameters.set_parameter('N', N)
+    model_parameters.set_parameter('fermi_T', 5.0)
+    model_parameters.set_parameter('fermi_tf', 20.0)
+    return model_factory.create_model(model_parameters)
+
+@nose.tools.istest
+def simulated_dwells_have_expected_means():
+    # one fluorophore: activation at ka, bright dwells end at kd + kb,
+    # dark dwells end at kr; all rates are 10**-1 by default
+    simulator = BlinkSimulator(make_model(1), random_state=0)
+    segment_arrays = simulator.simulate(10000)
+    mean_activation_time = segment_arrays.get_activation_times().mean()
+    mean_bright_time = segment_arrays.get_bright_times().mean()
+    mean_dark_time = segment_arrays.get_dark_times().mean()
+    nose.tools.ok_(abs(mean_activation_time - 10.0) < 0.5,
+                   "Got activation time %.3f" % mean_activation_time)
+    nose.tools.ok_(abs(mean_bright_time - 5.0) < 0.25,
+                   "Got bright time %.3f" % mean_bright_time)
+    nose.tools.ok_(abs(mean_dark_time - 10.0) < 0.5,
+                   "Got dark time %.3f" % mean_dark_time)
+    last_durations = segment_arrays.durations[
+                        segment_arrays.get_last_segment_inds()]
+    nose.tools.ok_(numpy.allclose(last_durations, 1.0))
+
+@nose.tools.istest
+def seeded_simulations_are_reproducible():
+    for fermi_activation in [False, True]:
+        model = make_model(2, fermi_activation)
+        first = BlinkSimulator(model, random_state=3).simulate(50)
+        second = BlinkSimulator(model, random_state=3).simulate(50)
+        nose.tools.ok_(numpy.array_equal(first.offsets, second.offsets))
+        nose.tools.ok_(numpy.array_equal(first.durations, second.durations))
+        # every trajectory is a valid dark, bright, ..., dark trace
+        nose.tools.ok_((first.get_bleach_times() > 0.0).all())
+
+@nose.tools.istest
+def simulator_writes_loadable_trajectories():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        simulator = BlinkSimulator(make_model(2), random_state=5)
+        directory_file = simulator.simulate_to_csv_files(5, temp_dir)
+        csv_data = BlinkCollectionTargetData()
+        csv_data.load_data(directory_file)
+        nose.tools.eq_(len(csv_data), 5)
+        store_file = os.path.join(temp_dir, 'sim.store')
+        simulator.simulate_to_store(7, store_file)
+        stored_data = StoredBlinkCollectionTargetData()
+        stored_data.load_data(store_file)
+        nose.tools.eq_(len(stored_data), 7)
+        collection = simulator.simulate_collection(3)
+        nose.tools.eq_(len(collection), 3)
+        nose.tools.eq_(len(collection.get_activation_time_distribution()), 3)
+    finally:
+        shutil.rmtree(temp_dir)
@@ -1,4 +1,6 @@
+import pickle
 import nose.tools
+import numpy
 from palm.blink_target_data import BlinkTargetData, BlinkCollectionTargetData
 
 @nose.tools.istest
@@ -49,3 +51,80 @@ def loads_many_trajectories_with_correct_number_of_trajectories():
     expected_length = len(lines)
     error_msg = "Expected %d, got %d" % (expected_length, length_of_collection)
     nose.tools.eq_(length_of_collection, expected_length, error_msg)
+
+@nose.tools.istest
+def selection_is_a_view_that_shares_trajectories_with_parent():
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data("./palm/test/test_data/traj_directory.txt")
+    inds = [3, 0, 0]
+    selection = target_data.make_copy_from_selection(inds)
+    nose.tools.eq_(len(selection), len(inds))
+    for i, trajectory in zip(inds, selection.iter_feature()):
+        parent_trajectory = target_data.get_feature_by_index(i).get_feature()
+        nose.tools.ok_(trajectory is parent_trajectory)
+    nose.tools.eq_(selection.get_paths(),
+                   [target_data.get_paths()[i] for i in inds])
+
+@nose.tools.istest
+def pickled_view_holds_only_selected_trajectories():
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data("./palm/test/test_data/traj_directory.txt")
+    inds = [3, 0, 0]
+    selection = target_data.make_weighted_copy_from_selection(inds,
+                                                              [1, 2, 1])
+    full_size = len(pickle.dumps(target_data, 2))
+    view_size = len(pickle.dumps(target_data.make_copy_from_selection([1]),
+                                 2))
+    nose.tools.ok_(view_size < full_size,
+                   "%d, %d" % (view_size, full_size))
+    unpickled_selection = pickle.loads(pickle.dumps(selection, 2))
+    nose.tools.eq_(len(unpickled_selection), len(inds))
+    nose.tools.eq_(unpickled_selection.get_paths(), selection.get_paths())
+    nose.tools.ok_(numpy.array_equal(unpickled_selection.get_weights(),
+                                     selection.get_weights()))
+    for trajectory, expected in zip(unpickled_selection.iter_feature(),
+                                    selection.iter_feature()):
+        nose.tools.ok_(trajectory == expected)
+
+@nose.tools.istest
+def view_of_a_view_refers_to_original_collection():
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data("./palm/test/test_data/traj_directory.txt")
+    selection = target_data.make_copy_from_selection([4, 2, 1])
+    sub_selection = selection.make_copy_from_selection([2, 0])
+    nose.tools.ok_(sub_selection.parent_collection is target_data)
+    nose.tools.eq_(list(sub_selection.inds), [1, 4])
+    expected_dist = target_data.make_copy_from_selection(
+                        [1, 4]).get_bright_time_distribution()
+    actual_dist = sub_selection.get_bright_time_distribution()
+    nose.tools.ok_(numpy.allclose(expected_dist.values, actual_dist.values))
+
+@nose.tools.istest
+def collection_statistics_match_per_trajectory_statistics():
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data("./palm/test/test_data/traj_directory.txt")
+    selection = target_data.make_copy_from_selection([3, 0, 3])
+    for collection in [target_data, selection]:
+        bright_times = []
+        dark_times = []
+        num_blinks = []
+        bleach_times = []
+        activation_times = []
+        for traj in collection:
+            excluded_dwells = [0, traj.get_last_segment_number()]
+            bright_times.extend(traj.get_bright_time_distribution())
+            dark_times.extend(traj.get_dark_time_distribution(excluded_dwells))
+            num_blinks.append(traj.get_num_blink(excluded_dwells))
+            bleach_times.append(traj.get_bleach_time())
+            activation_times.append(traj.get_activation_time())
+        nose.tools.ok_(numpy.allclose(
+            collection.get_bright_time_distribution().values, bright_times))
+        nose.tools.ok_(numpy.allclose(
+            collection.get_dark_time_distribution().values, dark_times))
+        nose.tools.eq_(list(collection.get_num_blink_distribution().values),
+                       num_blinks)
+        nose.tools.ok_(numpy.allclose(
+            collection.get_bleach_time_distribution().values, bleach_times))
+        nose.tools.ok_(numpy.allclose(
+            collection.get_activation_time_distribution().values,
+            activation_times))
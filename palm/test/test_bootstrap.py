@@ -1,6 +1,12 @@
 import nose.tools
+import numpy
 from palm.blink_target_data import BlinkCollectionTargetData
 from palm.bootstrap_selector import BootstrapSelector
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.likelihood_judge import CollectionLikelihoodJudge
+from palm.backward_likelihood import BackwardPredictor
+from palm.linalg import QitMatrixExponential
 
 @nose.tools.istest
 def resampled_target_data_has_expected_size():
@@ -25,3 +31,60 @@ def all_elements_of_resampled_data_are_elements_of_original_data():
         error_message = "%s not found in original data" % str(data_element)
         nose.tools.ok_(target_data.has_element(data_element), error_message)
 
+@nose.tools.istest
+def weighted_selections_have_unique_indices_and_expected_total_weight():
+    bs_selector = BootstrapSelector(random_state=0)
+    n = 10
+    bs_size = 25
+    selection_list = bs_selector.draw_selections(n, bs_size, num_replicates=50)
+    nose.tools.eq_(len(selection_list), 50)
+    for selection in selection_list:
+        nose.tools.eq_(len(selection), bs_size)
+        nose.tools.eq_(len(numpy.unique(selection.inds)),
+                       selection.get_num_unique())
+        nose.tools.ok_(selection.inds.min() >= 0)
+        nose.tools.ok_(selection.inds.max() < n)
+
+@nose.tools.istest
+def seeded_selector_draws_reproducible_selections():
+    selection_list1 = BootstrapSelector(random_state=42).draw_selections(
+                        10, 10, num_replicates=5)
+    selection_list2 = BootstrapSelector(random_state=42).draw_selections(
+                        10, 10, num_replicates=5)
+    for s1, s2 in zip(selection_list1, selection_list2):
+        nose.tools.ok_(numpy.array_equal(s1.inds, s2.inds))
+        nose.tools.ok_(numpy.array_equal(s1.weights, s2.weights))
+
+@nose.tools.istest
+def weighted_resample_has_same_score_as_materialized_resample():
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data('./palm/test/test_data/traj_directory.txt')
+    # make the trajectories distinguishable
+    target_data.target_data_collection[1].load_data(
+        './palm/test/test_data/stochpy_blink10_traj.csv')
+    target_data.target_data_collection[3].load_data(
+        './palm/test/test_data/cutoff_traj.csv')
+    bs_selector = BootstrapSelector(random_state=3)
+    selection = bs_selector.draw_selections(len(target_data), 8)[0]
+    materialized_data = target_data.make_copy_from_selection(
+                            list(selection.as_index_array()))
+    weighted_data = target_data.make_weighted_copy_from_selection(
+                        selection.inds, selection.weights)
+    nose.tools.eq_(len(weighted_data), selection.get_num_unique())
+    nose.tools.eq_(weighted_data.get_total_weight(), 8)
+
+    model_factory = SingleDarkBlinkFactory(MAX_A=2)
+    model_parameters = SingleDarkParameterSet()
+    model_parameters.set_parameter('N', 2)
+    model = model_factory.create_model(model_parameters)
+    data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                       always_rebuild_rate_matrix=False)
+    judge = CollectionLikelihoodJudge()
+    materialized_score = judge.judge_prediction(model, data_predictor,
+                                                materialized_data)
+    weighted_score = judge.judge_prediction(model, data_predictor,
+                                            weighted_data)
+    error_message = "Expected %.6f, got %.6f" % (materialized_score,
+                                                 weighted_score)
+    nose.tools.ok_(abs(materialized_score - weighted_score) < 1e-8,
+                   error_message)
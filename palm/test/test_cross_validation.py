@@ -0,0 +1,68 @@
+import nose.tools
+import numpy
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.blink_simulator import BlinkSimulator
+from palm.backward_likelihood import BackwardPredictor
+from palm.linalg import QitMatrixExponential
+from palm.base.parameter_optimizer import ParameterOptimizer
+from palm.cross_validation import CrossValidator
+
+class LogKdGridOptimizer(ParameterOptimizer):
+    # a few likelihood evaluations per fit, to keep the test fast
+    def optimize_parameters(self, score_fcn, parameter_set):
+        best_score = numpy.inf
+        best_array = None
+        for log_kd in numpy.linspace(-1.5, 0.5, 5):
+            parameter_set.set_parameter('log_kd', log_kd)
+            parameter_array = parameter_set.as_array()
+            score = score_fcn(parameter_array)
+            if score < best_score:
+                best_score = score
+                best_array = parameter_array
+        parameter_set.update_from_array(best_array)
+        return parameter_set, best_score
+
+@nose.tools.nottest
+def make_cross_validator(num_processes):
+    model_factory = SingleDarkBlinkFactory(MAX_A=2)
+    parameter_set = SingleDarkParameterSet()
+    parameter_set.set_parameter('N', 1)
+    model = model_factory.create_model(parameter_set)
+    target_data = BlinkSimulator(model, random_state=0).\
+                    simulate_collection(40)
+    data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                       always_rebuild_rate_matrix=False)
+    cross_validator = CrossValidator([('single', model_factory,
+                                       parameter_set)],
+                                     [1, 2], data_predictor, num_folds=2,
+                                     optimizer=LogKdGridOptimizer(),
+                                     num_processes=num_processes,
+                                     random_state=0)
+    return cross_validator, target_data
+
+@nose.tools.istest
+def cross_validation_prefers_true_number_of_fluorophores():
+    cross_validator, target_data = make_cross_validator(num_processes=1)
+    summary_table = cross_validator.cross_validate(target_data)
+    nose.tools.eq_(summary_table['N'][0], 1)
+    fold_table = cross_validator.fold_table
+    nose.tools.eq_(len(fold_table), 4)
+    nose.tools.eq_(sorted(numpy.concatenate(cross_validator.fold_list)),
+                   range(40))
+    for N, group in fold_table.groupby('N'):
+        nose.tools.eq_(group['held_out_weight'].sum(), 40)
+    # the held out score is minus the mean held out log likelihood
+    nose.tools.ok_(numpy.allclose(fold_table['held_out_score'],
+                                  -fold_table['held_out_log_likelihood'] /
+                                  fold_table['held_out_weight']))
+
+@nose.tools.istest
+def parallel_cross_validation_matches_serial():
+    serial_validator, target_data = make_cross_validator(num_processes=1)
+    serial_table = serial_validator.cross_validate(target_data)
+    parallel_validator, target_data = make_cross_validator(num_processes=2)
+    parallel_table = parallel_validator.cross_validate(target_data)
+    nose.tools.ok_(numpy.allclose(
+        serial_table['mean_held_out_log_likelihood'],
+        parallel_table['mean_held_out_log_likelihood']))
@@ -1,7 +1,10 @@
 import nose.tools
-from palm.blink_target_data import BlinkTargetData
+import numpy
+from palm.blink_target_data import BlinkTargetData, BlinkCollectionTargetData
 from palm.cutoff_parameter_set import CutoffParameterSet
-from palm.cutoff_predictor import CutoffPredictor, CutoffPrediction
+from palm.cutoff_predictor import CutoffPredictor, CutoffPrediction,\
+                                  make_cutoff_engine
+from palm.cutoff_optimizer import ExactCutoffOptimizer
 from palm.cutoff_judge import CutoffJudge
 from palm.score_function import CutoffScoreFunction
 from palm.cutoff_model import CutoffModelFactory
@@ -67,3 +70,60 @@ def cutoff_method_should_find_correct_number_of_bundles():
                 (expected_prediction, actual_prediction)
     nose.tools.eq_(expected_prediction, actual_prediction, error_msg)
     print error_msg
+
+@nose.tools.istest
+def cutoff_engine_counts_match_predictor():
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data("./palm/test/test_data/traj_directory.txt")
+    selection = target_data.make_copy_from_selection([0, 3])
+    cutoff_engine = make_cutoff_engine(selection)
+    cp = CutoffPredictor()
+    tau_array = numpy.array([5.0, 0.0, 0.1, 0.3, 1.0])
+    num_bundles = cutoff_engine.count_bundles_for_taus(tau_array)
+    for i, trajectory in enumerate(selection):
+        for j, tau in enumerate(tau_array):
+            expected = cp.predict_data(trajectory, tau).num_bundles
+            nose.tools.eq_(num_bundles[i, j], expected)
+            nose.tools.eq_(cutoff_engine.count_bundles(tau)[i], expected)
+
+@nose.tools.istest
+def exact_cutoff_optimizer_finds_best_tau_interval():
+    target_data = BlinkTargetData()
+    target_data.load_data(data_file="./palm/test/test_data/cutoff_traj.csv")
+    cutoff_engine = make_cutoff_engine(target_data)
+    lower, upper, score = cutoff_engine.find_best_tau_interval(4)
+    nose.tools.eq_((lower, upper, score), (0.5, 1.0, 1.0))
+    lower, upper, score = cutoff_engine.find_best_tau_interval(1)
+    nose.tools.eq_((lower, upper, score), (12.0, numpy.inf, 0.0))
+    parameters = CutoffParameterSet()
+    parameters.set_parameter('N', 2)
+    score_fcn = CutoffScoreFunction(
+                    CutoffModelFactory(), parameters, CutoffJudge(),
+                    CutoffPredictor(), target_data, noisy=False)
+    optimizer = ExactCutoffOptimizer()
+    parameters, score = optimizer.optimize_parameters(score_fcn, parameters)
+    nose.tools.eq_(score, 0.0)
+    nose.tools.eq_(score_fcn.compute_score(parameters.as_array()), 0.0)
+
+@nose.tools.istest
+def exact_cutoff_optimizer_respects_tau_bounds():
+    target_data = BlinkTargetData()
+    target_data.load_data(data_file="./palm/test/test_data/cutoff_traj.csv")
+    optimizer = ExactCutoffOptimizer()
+    for N, tau_bounds in [(1, (0.0, 5.0)), (4, (2.0, 3600.)),
+                          (4, (0.7, 0.8)), (1, (13.0, 20.0))]:
+        parameters = CutoffParameterSet()
+        parameters.set_parameter('N', N)
+        parameters.set_parameter_bounds('tau', *tau_bounds)
+        score_fcn = CutoffScoreFunction(
+                        CutoffModelFactory(), parameters, CutoffJudge(),
+                        CutoffPredictor(), target_data, noisy=False)
+        parameters, score = optimizer.optimize_parameters(score_fcn,
+                                                          parameters)
+        tau = parameters.get_parameter('tau')
+        nose.tools.ok_(tau_bounds[0] <= tau <= tau_bounds[1], tau)
+        nose.tools.eq_(score_fcn.compute_score(parameters.as_array()), score)
+        grid_scores = [score_fcn.compute_score(numpy.array([t, N]))
+                       for t in numpy.linspace(tau_bounds[0], tau_bounds[1],
+                                               101)]
+        nose.tools.eq_(score, min(grid_scores))
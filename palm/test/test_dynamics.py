@@ -0,0 +1,34 @@
+import nose.tools
+import numpy
+import scipy.linalg
+from palm.dynamics import Dynamics
+from palm.linalg import EigenGridExpm
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet
+
+@nose.tools.istest
+def grid_dynamics_match_expm_at_each_time():
+    model_factory = SingleDarkBlinkFactory(MAX_A=2)
+    model_parameters = SingleDarkParameterSet()
+    model_parameters.set_parameter('N', 3)
+    model = model_factory.create_model(model_parameters)
+    time_array = numpy.linspace(0.0, 50.0, 101)
+    occupancy_frame = Dynamics().compute_trajectory(model, time_array)
+    nose.tools.eq_(occupancy_frame.shape,
+                   (len(time_array), model.get_num_states()))
+    nose.tools.ok_(numpy.allclose(occupancy_frame.sum(axis=1).values, 1.0))
+
+    Q = model.build_rate_matrix(0.0)
+    init_prob_array = model.get_initial_probability_vector().series.reindex(
+                        Q.get_index_id_list()).fillna(0.0).values
+    for i in [0, 7, 100]:
+        expected = numpy.dot(init_prob_array,
+                             scipy.linalg.expm(Q.as_npy_array() *
+                                               time_array[i]))
+        nose.tools.ok_(numpy.allclose(occupancy_frame.values[i], expected))
+    # force the fallback that steps through the times
+    stepped_array = EigenGridExpm(max_relative_error=-1.0).\
+                        compute_vector_expm_grid(Q.as_npy_array(),
+                                                 init_prob_array,
+                                                 time_array[::-1])
+    nose.tools.ok_(numpy.allclose(stepped_array[::-1], occupancy_frame.values))
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import nose.tools
+import numpy
+from palm.ensemble_sampler import EnsembleSampler
+from palm.test.gaussian_score import MEAN, GaussianScore
+
+STD = numpy.array([0.1, 0.2, 0.3, 0.1])
+
+def make_gaussian_score():
+    return GaussianScore(numpy.diag(STD**2))
+
+@nose.tools.istest
+def sampler_recovers_gaussian_posterior():
+    sampler = EnsembleSampler(make_gaussian_score(), num_walkers=16,
+                              initial_spread=0.05, random_state=0)
+    sampler.run(1500)
+    samples = sampler.get_chain()[500:, :, :4].reshape(-1, 4)
+    nose.tools.ok_(numpy.allclose(samples.mean(axis=0), MEAN,
+                                  atol=0.05), str(samples.mean(axis=0)))
+    nose.tools.ok_(numpy.allclose(samples.std(axis=0), STD, rtol=0.2),
+                   str(samples.std(axis=0)))
+    acceptance_fraction = sampler.get_acceptance_fraction().mean()
+    nose.tools.ok_(0.2 < acceptance_fraction < 0.8)
+    psd = sampler.make_parameter_set_distribution(burn_in=1400, thin=10)
+    nose.tools.eq_(len(psd), 10 * 16)
+    for column in ['log_ka', 'N', 'log_posterior', 'walker', 'step']:
+        nose.tools.ok_(column in psd.data_frame.columns)
+
+@nose.tools.istest
+def sampler_continues_from_checkpoint():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        checkpoint_file = os.path.join(temp_dir, 'chain.pkl')
+        full_sampler = EnsembleSampler(make_gaussian_score(), random_state=1)
+        full_sampler.run(30)
+        first_sampler = EnsembleSampler(make_gaussian_score(), random_state=1)
+        first_sampler.run(20, checkpoint_file=checkpoint_file)
+        resumed_sampler = EnsembleSampler(make_gaussian_score(), random_state=7)
+        resumed_sampler.load_checkpoint(checkpoint_file)
+        resumed_sampler.run(10)
+        nose.tools.ok_(numpy.array_equal(full_sampler.get_chain(),
+                                         resumed_sampler.get_chain()))
+    finally:
+        shutil.rmtree(temp_dir)
+
+@nose.tools.istest
+def parallel_walkers_match_serial_walkers():
+    serial_sampler = EnsembleSampler(make_gaussian_score(), random_state=2)
+    serial_sampler.run(5)
+    parallel_sampler = EnsembleSampler(make_gaussian_score(), num_processes=2,
+                                       random_state=2)
+    parallel_sampler.run(5)
+    nose.tools.ok_(numpy.allclose(serial_sampler.get_chain(),
+                                  parallel_sampler.get_chain()))
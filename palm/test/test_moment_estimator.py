@@ -0,0 +1,43 @@
+import nose.tools
+from palm.moment_estimator import MomentEstimator
+from palm.blink_simulator import BlinkSimulator
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet,\
+                                     DoubleDarkParameterSet
+
+@nose.tools.nottest
+def simulate_data(N, log_kd):
+    model_parameters = SingleDarkParameterSet()
+    model_parameters.set_parameter('N', N)
+    model_parameters.set_parameter('log_kd', log_kd)
+    model_parameters.set_parameter('log_kr', -0.5)
+    model = SingleDarkBlinkFactory(MAX_A=N).create_model(model_parameters)
+    simulator = BlinkSimulator(model, random_state=1)
+    return model_parameters, simulator.simulate_collection(3000)
+
+@nose.tools.istest
+def estimates_are_near_simulated_rates():
+    for N, log_kd in [(1, -1.0), (2, -0.5), (3, -0.5)]:
+        true_parameters, target_data = simulate_data(N, log_kd)
+        estimator = MomentEstimator()
+        parameter_set, N_range = estimator.fill_parameter_set(
+                                    SingleDarkParameterSet(), target_data)
+        nose.tools.eq_(parameter_set.get_parameter('N'), N)
+        nose.tools.ok_(N_range[0] <= N <= N_range[1], str(N_range))
+        for p_name in ['log_ka', 'log_kd', 'log_kr', 'log_kb']:
+            error = abs(parameter_set.get_parameter(p_name) -
+                        true_parameters.get_parameter(p_name))
+            nose.tools.ok_(error < 0.2, "%s off by %.3f for N=%d" %\
+                                        (p_name, error, N))
+
+@nose.tools.istest
+def estimator_fills_double_dark_parameter_set():
+    true_parameters, target_data = simulate_data(2, -0.5)
+    estimator = MomentEstimator()
+    parameter_set, N_range = estimator.fill_parameter_set(
+                                DoubleDarkParameterSet(), target_data, N=2)
+    nose.tools.eq_(parameter_set.get_parameter('N'), 2)
+    # the two dark states split the blinks and the dark dwells
+    nose.tools.ok_(parameter_set.get_parameter('log_kd1') <
+                   true_parameters.get_parameter('log_kd'))
+    nose.tools.ok_(parameter_set.get_parameter('log_kr_diff') < 0.0)
@@ -0,0 +1,81 @@
+import nose.tools
+import numpy
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.multifidelity_optimizer import MultiFidelityOptimizer,\
+                                         FidelityLevel
+
+class SampleData(object):
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def make_copy_from_selection(self, inds):
+        return SampleData(self.samples[inds])
+
+class FakeFactory(object):
+    def __init__(self, MAX_A):
+        self.MAX_A = MAX_A
+
+class FakeExpm(object):
+    def __init__(self, tol):
+        self.tol = tol
+
+class FakeCalculator(object):
+    def __init__(self, expm_calculator):
+        self.expm_calculator = expm_calculator
+
+class FakePredictor(object):
+    def __init__(self):
+        self.backward_calculator = FakeCalculator(FakeExpm(1e-10))
+
+class ApproximateScore(object):
+    # a Gaussian fit of the samples whose optimum moves with MAX_A, so
+    # only the full fidelity stage finds the true optimum
+    def __init__(self, samples):
+        self.parameter_set = SingleDarkParameterSet()
+        for p_name in ['log_ka', 'log_kd', 'log_kr', 'log_kb']:
+            self.parameter_set.set_parameter_bounds(p_name, -3.0, 3.0)
+        self.model_factory = FakeFactory(10)
+        self.data_predictor = FakePredictor()
+        self.target_data = SampleData(samples)
+
+    def compute_score(self, parameter_array):
+        shift = 1.0 / self.model_factory.MAX_A
+        tol = self.data_predictor.backward_calculator.expm_calculator.tol
+        x = numpy.asarray(parameter_array[:4]) - shift
+        return ((self.target_data.samples - x)**2).sum(axis=1).mean() + tol
+
+@nose.tools.istest
+def multifidelity_optimum_is_certified_at_full_fidelity():
+    random_state = numpy.random.RandomState(0)
+    samples = random_state.randn(400, 4)
+    score_fcn = ApproximateScore(samples)
+    optimizer = MultiFidelityOptimizer(
+                    [FidelityLevel(MAX_A=2, expm_tolerance=1e-2,
+                                   data_fraction=0.25),
+                     FidelityLevel(MAX_A=5, expm_tolerance=1e-4,
+                                   data_fraction=0.5)],
+                    random_state=0)
+    parameter_set, score = optimizer.optimize_parameters(
+                                score_fcn.compute_score,
+                                score_fcn.parameter_set)
+    expected_array = samples.mean(axis=0) + 0.1
+    nose.tools.ok_(numpy.allclose(parameter_set.as_array()[:4],
+                                  expected_array, atol=1e-4))
+    nose.tools.assert_almost_equal(
+        score, score_fcn.compute_score(parameter_set.as_array()))
+    schedule = optimizer.schedule_table
+    nose.tools.eq_(list(schedule['MAX_A']), [2, 5, 10])
+    nose.tools.eq_(list(schedule['num_trajectories']), [100, 200, 400])
+    nose.tools.eq_(list(schedule['stop_reason'])[-1], 'converged')
+    nose.tools.eq_(len(optimizer.evaluation_table),
+                   schedule['num_evaluations'].sum())
+    nose.tools.ok_((numpy.diff(optimizer.evaluation_table['stage']) >= 0).
+                   all())
+    # the cheap levels work on copies
+    nose.tools.eq_(score_fcn.model_factory.MAX_A, 10)
+    nose.tools.eq_(score_fcn.data_predictor.backward_calculator.
+                   expm_calculator.tol, 1e-10)
+    nose.tools.eq_(len(score_fcn.target_data), 400)
@@ -0,0 +1,43 @@
+import nose.tools
+import numpy
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.multistart_optimizer import MultiStartOptimizer
+
+class DoubleWellScore(object):
+    # minima at +-1 in each rate; the minimum at -1 of log_ka is lower
+    def compute_score(self, parameter_array):
+        x = numpy.asarray(parameter_array[:4])
+        return ((x**2 - 1.0)**2).sum() + 0.5 * x[0]
+
+@nose.tools.nottest
+def make_parameter_set():
+    parameter_set = SingleDarkParameterSet()
+    for p_name in ['log_ka', 'log_kd', 'log_kr', 'log_kb']:
+        parameter_set.set_parameter(p_name, 1.0)
+        parameter_set.set_parameter_bounds(p_name, -2.0, 2.0)
+    return parameter_set
+
+@nose.tools.istest
+def multistart_escapes_local_minimum():
+    for num_processes in [1, 2]:
+        optimizer = MultiStartOptimizer(num_starts=6,
+                                        num_processes=num_processes,
+                                        round_maxfun=40, cull_margin=0.4,
+                                        random_state=0)
+        parameter_set, score = optimizer.optimize_parameters(
+                                DoubleWellScore().compute_score,
+                                make_parameter_set())
+        # the first start sits in the local minimum at +1
+        nose.tools.ok_(parameter_set.get_parameter('log_ka') < -0.9,
+                       str(parameter_set))
+        start_table = optimizer.get_start_table()
+        nose.tools.eq_(len(start_table), 6)
+        nose.tools.eq_(start_table['score'].min(), score)
+        nose.tools.ok_(numpy.array_equal(start_table['start_array'][0],
+                                         make_parameter_set().as_array()))
+        # fixed parameters are not randomized
+        N = make_parameter_set().get_parameter('N')
+        for start_array in start_table['start_array']:
+            nose.tools.eq_(start_array[4], N)
+        nose.tools.ok_(set(start_table['status']) <=
+                       set(['converged', 'culled', 'max_rounds']))
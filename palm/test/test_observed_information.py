@@ -0,0 +1,58 @@
+import nose.tools
+import numpy
+from palm.observed_information import ObservedInformationEstimator
+from palm.scipy_optimizer import ScipyOptimizer
+from palm.test.gaussian_score import MEAN, COVARIANCE, GaussianScore
+
+@nose.tools.istest
+def information_of_gaussian_is_inverse_covariance():
+    score_fcn = GaussianScore(start_at_mean=False)
+    parameter_set = score_fcn.parameter_set
+    parameter_set.update_from_array(numpy.r_[MEAN, parameter_set.as_array()[4:]])
+    estimator = ObservedInformationEstimator()
+    estimate = estimator.estimate_uncertainty(score_fcn.compute_score,
+                                              parameter_set)
+    nose.tools.eq_(list(estimate.estimates.index),
+                   ['log_ka', 'log_kd', 'log_kr', 'log_kb'])
+    nose.tools.ok_(estimate.is_positive_definite)
+    nose.tools.ok_(numpy.allclose(estimate.covariance_matrix.values,
+                                  COVARIANCE, rtol=1e-4, atol=1e-8))
+    nose.tools.ok_(numpy.allclose(estimate.standard_errors.values,
+                                  numpy.sqrt(numpy.diag(COVARIANCE))))
+    nose.tools.assert_almost_equal(
+        estimate.correlation_matrix.loc['log_ka', 'log_kd'], 0.5, places=4)
+    intervals = estimate.get_confidence_intervals()
+    nose.tools.assert_almost_equal(intervals.loc['log_kr', 'upper'],
+                                   1.96 * 0.3, places=4)
+
+@nose.tools.istest
+def scipy_optimizer_reports_uncertainty():
+    score_fcn = GaussianScore(start_at_mean=False)
+    optimizer = ScipyOptimizer(
+                    uncertainty_estimator=ObservedInformationEstimator())
+    parameter_set, score = optimizer.optimize_parameters(
+                                score_fcn.compute_score,
+                                score_fcn.parameter_set)
+    estimate = optimizer.uncertainty_estimate
+    nose.tools.ok_(numpy.allclose(estimate.estimates.values, MEAN,
+                                  atol=1e-3))
+    nose.tools.ok_(numpy.allclose(estimate.standard_errors.values,
+                                  numpy.sqrt(numpy.diag(COVARIANCE)),
+                                  rtol=1e-3))
+    nose.tools.ok_(numpy.allclose(parameter_set.as_array()[:4],
+                                  estimate.estimates.values))
+
+@nose.tools.istest
+def plain_callable_needs_total_weight():
+    score_fcn = GaussianScore()
+    bare_score_fcn = lambda parameter_array:\
+                        score_fcn.compute_score(parameter_array)
+    estimator = ObservedInformationEstimator()
+    nose.tools.assert_raises(AssertionError, estimator.compute_information,
+                             bare_score_fcn, score_fcn.parameter_set)
+    estimator = ObservedInformationEstimator(total_weight=1.0)
+    information_matrix, free_inds = estimator.compute_information(
+                                        bare_score_fcn,
+                                        score_fcn.parameter_set)
+    nose.tools.ok_(numpy.allclose(information_matrix,
+                                  numpy.linalg.inv(COVARIANCE), rtol=1e-4))
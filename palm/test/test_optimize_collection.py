@@ -5,7 +5,10 @@ import scipy.linalg
 import pandas
 from palm.blink_factory import SingleDarkBlinkFactory
 from palm.blink_parameter_set import SingleDarkParameterSet
-from palm.likelihood_judge import CollectionLikelihoodJudge
+from palm.likelihood_judge import CollectionLikelihoodJudge,\
+                                  HistogramLikelihoodJudge
+from palm.score_function import ScoreFunction
+from palm.blink_simulator import BlinkSimulator
 from palm.backward_likelihood import BackwardPredictor
 from palm.blink_target_data import BlinkCollectionTargetData
 from palm.scipy_optimizer import ScipyOptimizer
@@ -101,3 +104,30 @@ class TestComputeLikelihoodOfBlinkCollectionWithShortTrajectories(object):
             nose.tools.ok_(abs(delta_LL) < EPSILON, error_message)
         except:
             raise SkipTest
+
+
+@nose.tools.istest
+def histogram_judge_recovers_simulated_rates():
+    model_factory = SingleDarkBlinkFactory(MAX_A=2)
+    true_parameters = SingleDarkParameterSet()
+    true_parameters.set_parameter('N', 2)
+    true_parameters.set_parameter('log_kd', -0.5)
+    model = model_factory.create_model(true_parameters)
+    target_data = BlinkSimulator(model, random_state=0).simulate_collection(5000)
+    initial_parameters = SingleDarkParameterSet()
+    initial_parameters.set_parameter('N', 2)
+    initial_parameters.set_parameter('log_ka', -0.6)
+    initial_parameters.set_parameter('log_kd', 0.0)
+    initial_parameters.set_parameter('log_kr', -0.5)
+    initial_parameters.set_parameter('log_kb', -1.4)
+    score_fcn = ScoreFunction(model_factory, initial_parameters,
+                              HistogramLikelihoodJudge(), None, target_data)
+    optimizer = ScipyOptimizer()
+    fit_parameters, score = optimizer.optimize_parameters(
+                                score_fcn.compute_score, initial_parameters)
+    for parameter_name in ['log_ka', 'log_kd', 'log_kr', 'log_kb']:
+        expected = true_parameters.get_parameter(parameter_name)
+        actual = fit_parameters.get_parameter(parameter_name)
+        error_message = "%s: expected %.2f, got %.2f" % (parameter_name,
+                                                        expected, actual)
+        nose.tools.ok_(abs(expected - actual) < EPSILON, error_message)
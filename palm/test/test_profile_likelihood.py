@@ -0,0 +1,44 @@
+import nose.tools
+import numpy
+from palm.profile_likelihood import ProfileLikelihoodCalculator
+from palm.test.gaussian_score import MEAN, COVARIANCE, GaussianScore
+
+@nose.tools.nottest
+def check_intervals(num_processes):
+    score_fcn = GaussianScore()
+    calculator = ProfileLikelihoodCalculator(step=0.05,
+                                             num_processes=num_processes)
+    result = calculator.compute_profiles(score_fcn.compute_score,
+                                         score_fcn.parameter_set,
+                                         ['log_ka', 'log_kd'])
+    # the profile of a Gaussian gives the marginal interval, which is
+    # wider than the conditional one when parameters are correlated
+    half_widths = 1.96 * numpy.sqrt(numpy.diag(COVARIANCE)[:2])
+    intervals = result.interval_table
+    nose.tools.ok_(numpy.allclose(intervals['lower'].values,
+                                  MEAN[:2] - half_widths, atol=2e-3),
+                   str(intervals))
+    nose.tools.ok_(numpy.allclose(intervals['upper'].values,
+                                  MEAN[:2] + half_widths, atol=2e-3),
+                   str(intervals))
+    profile = result.get_profile('log_kd')
+    nose.tools.ok_((numpy.diff(profile['value'].values) > 0).all())
+    nose.tools.ok_(profile['deviance'].max() >= result.critical_deviance)
+    # warm starts follow the ridge: log_ka is refitted to its
+    # conditional mean given log_kd
+    for value, end_array in zip(profile['value'], profile['end_array']):
+        nose.tools.assert_almost_equal(end_array[0],
+                                       MEAN[0] + 0.25 * (value - MEAN[1]),
+                                       places=3)
+    return result
+
+@nose.tools.istest
+def profiles_give_likelihood_ratio_intervals():
+    check_intervals(num_processes=1)
+
+@nose.tools.istest
+def parallel_profiles_match_serial_profiles():
+    serial_result = check_intervals(num_processes=1)
+    parallel_result = check_intervals(num_processes=2)
+    nose.tools.ok_(numpy.allclose(serial_result.interval_table.values,
+                                  parallel_result.interval_table.values))
@@ -0,0 +1,246 @@
+import os
+import shutil
+import tempfile
+import nose.tools
+import numpy
+from palm.blink_factory import SingleDarkBlinkFactory, DoubleDarkBlinkFactory,\
+                               ConnectedDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet,\
+                                     DoubleDarkParameterSet,\
+                                     ConnectedDarkParameterSet
+from palm.blink_simulator import BlinkSimulator
+from palm.blink_target_data import BlinkCollectionTargetData
+from palm.likelihood_judge import HistogramLikelihoodJudge,\
+                                  CollectionLikelihoodJudge
+from palm.backward_likelihood import BackwardPredictor
+from palm.linalg import QitMatrixExponential, ScipyMatrixExponential2
+from palm.score_function import ScoreFunction, MemoizedScoreFunction
+
+@nose.tools.nottest
+def make_score_function(random_state=0, judge=None):
+    if judge is None:
+        judge = HistogramLikelihoodJudge()
+    model_factory = SingleDarkBlinkFactory(MAX_A=1)
+    parameter_set = SingleDarkParameterSet()
+    parameter_set.set_parameter('N', 1)
+    model = model_factory.create_model(parameter_set)
+    target_data = BlinkSimulator(model, random_state=random_state).\
+                    simulate_collection(200)
+    return ScoreFunction(model_factory, parameter_set, judge, None,
+                         target_data)
+
+@nose.tools.istest
+def memoized_scores_match_and_are_reused():
+    score_fcn = make_score_function()
+    memoized_fcn = MemoizedScoreFunction(score_fcn, max_cache_size=2)
+    first_array = score_fcn.parameter_set.as_array()
+    second_array = first_array.copy()
+    second_array[0] = -0.5
+    third_array = first_array.copy()
+    third_array[1] = -0.5
+    expected_score = score_fcn.compute_score(first_array)
+    nose.tools.eq_(memoized_fcn.compute_score(first_array), expected_score)
+    nose.tools.eq_(memoized_fcn.compute_score(first_array.copy()),
+                   expected_score)
+    memoized_fcn.compute_score(second_array)
+    # the parameter set follows the last requested point, cached or not
+    memoized_fcn.compute_score(first_array)
+    nose.tools.ok_(numpy.array_equal(score_fcn.parameter_set.as_array(),
+                                     first_array))
+    # the least recently used entry, second_array, is evicted
+    memoized_fcn.compute_score(third_array)
+    memoized_fcn.compute_score(second_array)
+    statistics = memoized_fcn.get_hit_statistics()
+    nose.tools.eq_(statistics['num_hits'], 2)
+    nose.tools.eq_(statistics['num_misses'], 4)
+    nose.tools.eq_(statistics['num_calls'], 6)
+
+@nose.tools.istest
+def disk_cache_is_reused_only_for_the_same_data():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cache_file = os.path.join(temp_dir, 'scores.db')
+        score_fcn = make_score_function()
+        parameter_array = score_fcn.parameter_set.as_array()
+        with MemoizedScoreFunction(score_fcn, cache_file=cache_file) as m:
+            expected_score = m.compute_score(parameter_array)
+        with MemoizedScoreFunction(make_score_function(),
+                                   cache_file=cache_file) as m:
+            nose.tools.eq_(m.compute_score(parameter_array), expected_score)
+            nose.tools.eq_(m.num_disk_hits, 1)
+        with MemoizedScoreFunction(make_score_function(random_state=1),
+                                   cache_file=cache_file) as m:
+            m.compute_score(parameter_array)
+            nose.tools.eq_(m.num_disk_hits, 0)
+            nose.tools.eq_(m.num_misses, 1)
+    finally:
+        shutil.rmtree(temp_dir)
+
+@nose.tools.istest
+def disk_cache_distinguishes_views_with_different_weights():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cache_file = os.path.join(temp_dir, 'scores.db')
+        score_fcn = make_score_function(judge=CollectionLikelihoodJudge())
+        score_fcn.data_predictor = BackwardPredictor(
+                                    QitMatrixExponential(), False)
+        target_data = score_fcn.target_data
+        parameter_array = score_fcn.parameter_set.as_array()
+        score_list = []
+        for weights in [[5, 1], [1, 5]]:
+            score_fcn.target_data =\
+                target_data.make_weighted_copy_from_selection([0, 1],
+                                                              weights)
+            expected_score = score_fcn.compute_score(parameter_array)
+            with MemoizedScoreFunction(score_fcn,
+                                       cache_file=cache_file) as m:
+                nose.tools.eq_(m.compute_score(parameter_array),
+                               expected_score)
+                nose.tools.eq_(m.num_disk_hits, 0)
+            score_list.append(expected_score)
+        nose.tools.ok_(score_list[0] != score_list[1])
+    finally:
+        shutil.rmtree(temp_dir)
+
+@nose.tools.istest
+def disk_cache_keys_depend_on_judge_and_predictor_settings():
+    make_key = lambda score_fcn: MemoizedScoreFunction(score_fcn).make_key(
+                                    score_fcn.parameter_set.as_array())
+    reference_key = make_key(make_score_function())
+    nose.tools.ok_(reference_key != make_key(make_score_function(
+                        judge=HistogramLikelihoodJudge(num_bins=20))))
+    used_fcn = make_score_function()
+    used_fcn.compute_score(used_fcn.parameter_set.as_array())
+    nose.tools.eq_(make_key(used_fcn), reference_key)
+    predictor_keys = set()
+    for tol, always_rebuild in [(1e-7, False), (1e-4, False), (1e-7, True)]:
+        score_fcn = make_score_function()
+        score_fcn.data_predictor = BackwardPredictor(
+                                    QitMatrixExponential(tol=tol),
+                                    always_rebuild)
+        predictor_keys.add(make_key(score_fcn))
+    nose.tools.eq_(len(predictor_keys), 3)
+
+@nose.tools.istest
+def memoized_batch_scores_reuse_cached_scores():
+    score_fcn = make_score_function()
+    memoized_fcn = MemoizedScoreFunction(score_fcn)
+    nose.tools.ok_(memoized_fcn.target_data is score_fcn.target_data)
+    nose.tools.ok_(memoized_fcn.parameter_set is score_fcn.parameter_set)
+    parameter_matrix = numpy.tile(score_fcn.parameter_set.as_array(), (3, 1))
+    parameter_matrix[1, 0] = -0.5
+    parameter_matrix[2, 1] = -0.5
+    first_score = memoized_fcn.compute_score(parameter_matrix[0])
+    scores = memoized_fcn.compute_scores(parameter_matrix)
+    nose.tools.eq_(scores[0], first_score)
+    nose.tools.eq_(scores[2], score_fcn.compute_score(parameter_matrix[2]))
+    nose.tools.eq_(memoized_fcn.num_hits, 1)
+    nose.tools.eq_(memoized_fcn.num_misses, 3)
+    memoized_fcn.compute_scores(parameter_matrix)
+    nose.tools.eq_(memoized_fcn.num_hits, 4)
+
+@nose.tools.istest
+def batch_scores_match_single_scores():
+    random_state = numpy.random.RandomState(0)
+    for model_factory, parameter_set, diagonal_dark in\
+            [(SingleDarkBlinkFactory(MAX_A=2), SingleDarkParameterSet(),
+              False),
+             (DoubleDarkBlinkFactory(MAX_A=2), DoubleDarkParameterSet(),
+              False),
+             (ConnectedDarkBlinkFactory(MAX_A=2),
+              ConnectedDarkParameterSet(), True)]:
+        parameter_set.set_parameter('N', 2)
+        model = model_factory.create_model(parameter_set)
+        target_data = BlinkSimulator(model, random_state=0).\
+                        simulate_collection(20)
+        # an exact matrix exponential, so that the paths agree to
+        # rounding error rather than to the tolerance of an approximation
+        data_predictor = BackwardPredictor(ScipyMatrixExponential2(),
+                                           always_rebuild_rate_matrix=False,
+                                           diagonal_dark=diagonal_dark)
+        score_fcn = ScoreFunction(model_factory, parameter_set,
+                                  CollectionLikelihoodJudge(),
+                                  data_predictor, target_data)
+        nose.tools.ok_(score_fcn.can_compute_batch())
+        parameter_matrix = numpy.tile(parameter_set.as_array(), (4, 1))
+        parameter_matrix[:, :4] += random_state.uniform(-0.5, 0.5, (4, 4))
+        batch_scores = score_fcn.compute_scores(parameter_matrix)
+        single_scores = [score_fcn.compute_score(parameter_array)
+                         for parameter_array in parameter_matrix]
+        nose.tools.ok_(numpy.allclose(batch_scores, single_scores,
+                                      rtol=1e-10, atol=0.0),
+                       "%s != %s" % (batch_scores, single_scores))
+
+@nose.tools.istest
+def batch_scores_match_single_scores_with_time_dependent_rates():
+    model_factory = SingleDarkBlinkFactory(fermi_activation=True, MAX_A=2)
+    parameter_set = SingleDarkParameterSet()
+    parameter_set.set_parameter('N', 2)
+    target_data = BlinkCollectionTargetData()
+    target_data.load_data("./palm/test/test_data/traj_directory.txt")
+    data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                       always_rebuild_rate_matrix=False)
+    score_fcn = ScoreFunction(model_factory, parameter_set,
+                              CollectionLikelihoodJudge(), data_predictor,
+                              target_data)
+    nose.tools.ok_(not score_fcn.can_compute_batch())
+    parameter_matrix = numpy.tile(parameter_set.as_array(), (2, 1))
+    parameter_matrix[1, 0] = -0.5
+    batch_scores = score_fcn.compute_scores(parameter_matrix)
+    single_scores = [score_fcn.compute_score(parameter_array)
+                     for parameter_array in parameter_matrix]
+    nose.tools.ok_(numpy.array_equal(batch_scores, single_scores))
+    model = model_factory.create_model(parameter_set)
+    nose.tools.assert_raises(AssertionError, data_predictor.prepare_batch,
+                             [model])
+
+@nose.tools.istest
+def batch_scores_fall_back_to_single_scores():
+    score_fcn = make_score_function()
+    nose.tools.ok_(not score_fcn.can_compute_batch())
+    parameter_matrix = numpy.tile(score_fcn.parameter_set.as_array(), (2, 1))
+    parameter_matrix[1, 0] = -0.5
+    scores = score_fcn.compute_scores(parameter_matrix)
+    nose.tools.eq_(scores[1], score_fcn.compute_score(parameter_matrix[1]))
+
+@nose.tools.istest
+def trajectory_contributions_reproduce_subset_scores():
+    model_factory = SingleDarkBlinkFactory(MAX_A=2)
+    parameter_set = SingleDarkParameterSet()
+    parameter_set.set_parameter('N', 2)
+    model = model_factory.create_model(parameter_set)
+    target_data = BlinkSimulator(model, random_state=0).\
+                    simulate_collection(20)
+    data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                       always_rebuild_rate_matrix=False)
+    score_fcn = ScoreFunction(model_factory, parameter_set,
+                              CollectionLikelihoodJudge(), data_predictor,
+                              target_data)
+    parameter_array = parameter_set.as_array()
+    contributions = score_fcn.compute_trajectory_contributions(
+                        parameter_array)
+    nose.tools.eq_(len(contributions), 20)
+    nose.tools.assert_almost_equal(contributions.compute_score(),
+                                   score_fcn.compute_score(parameter_array))
+    table = contributions.contribution_table
+    nose.tools.eq_(list(table['num_segments']),
+                   [len(t) for t in target_data.iter_feature()])
+    nose.tools.ok_((table['evaluation_time'] >= 0.0).all())
+    inds = [0, 3, 4, 11]
+    weights = [2.0, 1.0, 3.0, 1.0]
+    subset_fcn = ScoreFunction(model_factory, parameter_set,
+                               CollectionLikelihoodJudge(), data_predictor,
+                               target_data.make_weighted_copy_from_selection(
+                                    inds, weights))
+    all_weights = numpy.zeros(20)
+    all_weights[inds] = weights
+    nose.tools.assert_almost_equal(contributions.compute_score(all_weights),
+                                   subset_fcn.compute_score(parameter_array))
+    jackknife_fcn = ScoreFunction(model_factory, parameter_set,
+                                  CollectionLikelihoodJudge(), data_predictor,
+                                  target_data.make_copy_from_selection(
+                                        range(1, 20)))
+    nose.tools.assert_almost_equal(contributions.compute_jackknife_scores()[0],
+                                   jackknife_fcn.compute_score(
+                                        parameter_array))
+    nose.tools.eq_(len(contributions.find_outliers(3)), 3)
@@ -0,0 +1,62 @@
+import nose.tools
+import numpy
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.stochastic_optimizer import StochasticOptimizer
+
+class SampleData(object):
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def get_weights(self):
+        return numpy.ones(len(self))
+
+    def make_copy_from_selection(self, inds):
+        return SampleData(self.samples[inds])
+
+class GaussianMeanScore(object):
+    # minus the average log10 likelihood of the samples under a unit
+    # Gaussian centered on the first four parameters
+    def __init__(self, samples):
+        self.parameter_set = SingleDarkParameterSet()
+        for p_name in ['log_ka', 'log_kd', 'log_kr', 'log_kb']:
+            self.parameter_set.set_parameter_bounds(p_name, -3.0, 3.0)
+        self.target_data = SampleData(samples)
+        self.num_calls = 0
+
+    def compute_scores(self, parameter_matrix):
+        self.num_calls += 1
+        x = numpy.atleast_2d(parameter_matrix)[:, :4]
+        samples = self.target_data.samples
+        squared_distances = ((samples[None, :, :] - x[:, None, :])**2).\
+                            sum(axis=2).mean(axis=1)
+        return squared_distances / (2.0 * numpy.log(10.0))
+
+    def compute_score(self, parameter_array):
+        return float(self.compute_scores(parameter_array)[0])
+
+@nose.tools.istest
+def stochastic_optimizer_finds_full_batch_optimum():
+    random_state = numpy.random.RandomState(0)
+    true_mean = numpy.array([0.5, -0.5, 1.0, -1.0])
+    samples = true_mean + random_state.randn(5000, 4)
+    score_fcn = GaussianMeanScore(samples)
+    optimizer = StochasticOptimizer(initial_batch_size=32,
+                                    min_iterations_per_batch=5,
+                                    random_state=0)
+    parameter_set, score = optimizer.optimize_parameters(
+                                score_fcn.compute_score,
+                                score_fcn.parameter_set)
+    nose.tools.ok_(numpy.allclose(parameter_set.as_array()[:4],
+                                  samples.mean(axis=0), atol=1e-3),
+                   str(parameter_set.as_array()[:4]))
+    nose.tools.assert_almost_equal(
+        score, score_fcn.compute_score(samples.mean(axis=0)), places=6)
+    batch_sizes = optimizer.history['batch_size'].values
+    nose.tools.eq_(batch_sizes[0], 32)
+    nose.tools.ok_((numpy.diff(batch_sizes) >= 0).all())
+    nose.tools.ok_(batch_sizes[-1] > 32)
+    # the fixed parameters are not moved
+    nose.tools.eq_(parameter_set.get_parameter('N'), 5)
@@ -0,0 +1,50 @@
+import nose.tools
+import numpy
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.surrogate_optimizer import SurrogateOptimizer,\
+                                     GaussianProcessSurrogate
+
+OPTIMUM = numpy.array([0.3, -0.7, 0.2, -1.1])
+
+class BowlScore(object):
+    def compute_score(self, parameter_array):
+        return ((numpy.asarray(parameter_array[:4]) - OPTIMUM)**2).sum()
+
+@nose.tools.nottest
+def make_parameter_set():
+    parameter_set = SingleDarkParameterSet()
+    for p_name in ['log_ka', 'log_kd', 'log_kr', 'log_kb']:
+        parameter_set.set_parameter(p_name, 1.5)
+        parameter_set.set_parameter_bounds(p_name, -2.0, 2.0)
+    return parameter_set
+
+@nose.tools.istest
+def surrogate_interpolates_smooth_function():
+    random_state = numpy.random.RandomState(0)
+    X = random_state.rand(30, 2)
+    y = numpy.sin(3.0 * X[:, 0]) + X[:, 1]**2
+    surrogate = GaussianProcessSurrogate(random_state=0)
+    surrogate.fit(X, y)
+    X_new = random_state.rand(10, 2)
+    mean, std = surrogate.predict(X_new)
+    expected = numpy.sin(3.0 * X_new[:, 0]) + X_new[:, 1]**2
+    nose.tools.ok_(numpy.abs(mean - expected).max() < 0.05)
+    nose.tools.ok_((std < 0.1).all())
+
+@nose.tools.istest
+def surrogate_search_localizes_optimum_before_refinement():
+    optimizer = SurrogateOptimizer(max_evaluations=30, local_maxfun=0,
+                                   random_state=0)
+    parameter_set, score = optimizer.optimize_parameters(
+                                BowlScore().compute_score,
+                                make_parameter_set())
+    nose.tools.ok_(score < 0.1, "Got score %.3f" % score)
+    evaluation_table = optimizer.evaluation_table
+    nose.tools.ok_(len(evaluation_table) <= 30)
+    nose.tools.eq_((evaluation_table['stage'] == 'initial').sum(), 9)
+    optimizer = SurrogateOptimizer(max_evaluations=30, random_state=0)
+    parameter_set, score = optimizer.optimize_parameters(
+                                BowlScore().compute_score,
+                                make_parameter_set())
+    nose.tools.ok_(numpy.allclose(parameter_set.as_array()[:4], OPTIMUM,
+                                  atol=1e-3), str(parameter_set))
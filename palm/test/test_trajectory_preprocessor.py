@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import nose.tools
+import numpy
+from palm.blink_target_data import BlinkTargetData, BlinkCollectionTargetData
+from palm.trajectory_preprocessor import TrajectoryPreprocessor
+
+@nose.tools.istest
+class TestTrajectoryPreprocessor(object):
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.messy_file = os.path.join(self.temp_dir, 'messy.csv')
+        with open(self.messy_file, 'w') as f:
+            f.write("class,dwell time\n")
+            f.write("dark,1.0\n")
+            f.write("dark,0.5\n")
+            f.write("bright,0.0\n")
+            f.write("bright,2.0\n")
+            f.write("dark,0.01\n")
+            f.write("bright,1.0\n")
+            f.write("dark,3.0\n")
+        # no trailing dark dwell
+        self.unbleached_file = os.path.join(self.temp_dir, 'unbleached.csv')
+        with open(self.unbleached_file, 'w') as f:
+            f.write("class,dwell time\n")
+            f.write("dark,1.0\n")
+            f.write("bright,2.0\n")
+        self.directory_file = os.path.join(self.temp_dir, 'traj_paths.txt')
+        with open(self.directory_file, 'w') as f:
+            f.write("%s\n" % self.messy_file)
+            f.write("%s\n" % self.unbleached_file)
+            f.write("./palm/test/test_data/cutoff_traj.csv\n")
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @nose.tools.istest
+    def coalesces_and_absorbs_short_dwells(self):
+        target_data = BlinkTargetData()
+        target_data.preprocessor = TrajectoryPreprocessor(min_duration=0.05)
+        target_data.load_data(self.messy_file)
+        trajectory = target_data.get_feature()
+        nose.tools.eq_(list(trajectory.get_class_array()),
+                       ['dark', 'bright', 'dark'])
+        nose.tools.ok_(numpy.allclose(trajectory.durations, [1.5, 3.01, 3.0]))
+        nose.tools.eq_(list(target_data.preprocessing_report.num_removed), [4])
+        nose.tools.eq_(trajectory.get_activation_time(), 1.5)
+
+    @nose.tools.istest
+    def drops_short_dwells_without_absorbing(self):
+        target_data = BlinkTargetData()
+        target_data.preprocessor = TrajectoryPreprocessor(
+                                    min_duration=0.05,
+                                    absorb_short_dwells=False)
+        target_data.load_data(self.messy_file)
+        trajectory = target_data.get_feature()
+        nose.tools.ok_(numpy.allclose(trajectory.durations, [1.5, 3.0, 3.0]))
+
+    @nose.tools.istest
+    def collection_drops_invalid_trajectories(self):
+        target_data = BlinkCollectionTargetData()
+        target_data.preprocessor = TrajectoryPreprocessor(
+                                    min_duration=0.05, invalid_policy='drop')
+        target_data.load_data(self.directory_file)
+        report = target_data.preprocessing_report
+        nose.tools.eq_(list(report.is_valid), [True, False, True])
+        nose.tools.eq_(list(report.num_removed), [4, 0, 0])
+        nose.tools.eq_(len(target_data), 2)
+        nose.tools.eq_(target_data.get_paths()[0], self.messy_file)
+        bleach_times = target_data.get_bleach_time_distribution().values
+        nose.tools.ok_(numpy.allclose(bleach_times, [3.01, 26.5]))
+
+    @nose.tools.istest
+    def invalid_trajectories_fail_by_default(self):
+        target_data = BlinkCollectionTargetData()
+        target_data.preprocessor = TrajectoryPreprocessor()
+        nose.tools.assert_raises(AssertionError, target_data.load_data,
+                                 self.directory_file)
@@ -0,0 +1,148 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import nose.tools
+import numpy
+from palm.blink_target_data import BlinkCollectionTargetData
+from palm.trajectory_store import convert_directory_file_to_store,\
+                                  StoredBlinkCollectionTargetData,\
+                                  StreamingBlinkCollectionTargetData,\
+                                  SharedTrajectoryBuffer
+from palm.blink_factory import SingleDarkBlinkFactory
+from palm.blink_parameter_set import SingleDarkParameterSet
+from palm.likelihood_judge import CollectionLikelihoodJudge,\
+                                  StreamingCollectionLikelihoodJudge,\
+                                  ParallelCollectionLikelihoodJudge
+from palm.backward_likelihood import BackwardPredictor
+from palm.linalg import QitMatrixExponential
+
+@nose.tools.istest
+class TestTrajectoryStore(object):
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # mix trajectories of different lengths into the collection
+        self.directory_file = os.path.join(self.temp_dir, 'traj_paths.txt')
+        with open(self.directory_file, 'w') as f:
+            f.write("./palm/test/test_data/short_blink_traj.csv\n")
+            f.write("./palm/test/test_data/stochpy_blink10_traj.csv\n")
+            f.write("./palm/test/test_data/cutoff_traj.csv\n")
+        self.store_file = os.path.join(self.temp_dir, 'trajs.store')
+        convert_directory_file_to_store(self.directory_file, self.store_file)
+        self.csv_data = BlinkCollectionTargetData()
+        self.csv_data.load_data(self.directory_file)
+        self.stored_data = StoredBlinkCollectionTargetData()
+        self.stored_data.load_data(self.store_file)
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    @nose.tools.istest
+    def stored_trajectories_match_csv_trajectories(self):
+        nose.tools.eq_(len(self.csv_data), len(self.stored_data))
+        nose.tools.eq_(self.csv_data.get_paths(), self.stored_data.get_paths())
+        for csv_traj, stored_traj in zip(self.csv_data, self.stored_data):
+            nose.tools.ok_(csv_traj == stored_traj)
+            nose.tools.ok_(numpy.allclose(csv_traj.cumulative_times,
+                                          stored_traj.cumulative_times))
+        streaming_data = StreamingBlinkCollectionTargetData()
+        streaming_data.load_data(self.store_file)
+        for collection in [self.stored_data, streaming_data]:
+            nose.tools.ok_(numpy.allclose(
+                collection.get_bleach_time_distribution().values,
+                self.csv_data.get_bleach_time_distribution().values))
+            nose.tools.ok_(numpy.array_equal(
+                collection.get_activation_time_distribution().values,
+                self.csv_data.get_activation_time_distribution().values))
+
+    @nose.tools.istest
+    def stored_collection_survives_pickling_and_selection(self):
+        unpickled_data = pickle.loads(pickle.dumps(self.stored_data))
+        nose.tools.eq_(len(unpickled_data), len(self.stored_data))
+        selection = unpickled_data.make_copy_from_selection([2, 0])
+        expected_trajectory = self.csv_data.get_feature_by_index(2).get_feature()
+        nose.tools.ok_(selection.iter_feature().next() == expected_trajectory)
+
+    @nose.tools.istest
+    def stored_collection_has_same_score_as_csv_collection(self):
+        model_factory = SingleDarkBlinkFactory(MAX_A=2)
+        model_parameters = SingleDarkParameterSet()
+        model_parameters.set_parameter('N', 2)
+        model = model_factory.create_model(model_parameters)
+        data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                           always_rebuild_rate_matrix=False)
+        judge = CollectionLikelihoodJudge()
+        csv_score = judge.judge_prediction(model, data_predictor,
+                                           self.csv_data)
+        stored_score = judge.judge_prediction(model, data_predictor,
+                                              self.stored_data)
+        error_message = "Expected %.6f, got %.6f" % (csv_score, stored_score)
+        nose.tools.ok_(abs(csv_score - stored_score) < 1e-10, error_message)
+
+    @nose.tools.istest
+    def streaming_collection_has_same_score_as_csv_collection(self):
+        # small chunks, so that each trajectory lands in its own chunk
+        streaming_data = StreamingBlinkCollectionTargetData(
+                            max_segments_per_chunk=10, num_prefetch_chunks=1)
+        streaming_data.load_data(self.store_file)
+        nose.tools.eq_(len(streaming_data.get_chunk_bounds()), 3)
+        for csv_traj, streamed_traj in zip(self.csv_data, streaming_data):
+            nose.tools.ok_(csv_traj == streamed_traj)
+        model_factory = SingleDarkBlinkFactory(MAX_A=2)
+        model_parameters = SingleDarkParameterSet()
+        model_parameters.set_parameter('N', 2)
+        model = model_factory.create_model(model_parameters)
+        data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                           always_rebuild_rate_matrix=False)
+        csv_score = CollectionLikelihoodJudge().judge_prediction(
+                        model, data_predictor, self.csv_data)
+        streaming_score = StreamingCollectionLikelihoodJudge().judge_prediction(
+                            model, data_predictor, streaming_data)
+        error_message = "Expected %.6f, got %.6f" % (csv_score, streaming_score)
+        nose.tools.ok_(abs(csv_score - streaming_score) < 1e-10, error_message)
+
+    @nose.tools.istest
+    def abandoned_streaming_iteration_stops_reader_thread(self):
+        streaming_data = StreamingBlinkCollectionTargetData(
+                            max_segments_per_chunk=10, num_prefetch_chunks=1)
+        streaming_data.load_data(self.store_file)
+        num_threads = threading.active_count()
+        for i in xrange(5):
+            chunk_iter = streaming_data.iter_chunks()
+            chunk_iter.next()
+            chunk_iter.close()
+        nose.tools.eq_(threading.active_count(), num_threads)
+
+    @nose.tools.istest
+    def parallel_judge_scores_shared_collection(self):
+        model_factory = SingleDarkBlinkFactory(MAX_A=2)
+        model_parameters = SingleDarkParameterSet()
+        model_parameters.set_parameter('N', 2)
+        model = model_factory.create_model(model_parameters)
+        data_predictor = BackwardPredictor(QitMatrixExponential(),
+                                           always_rebuild_rate_matrix=False)
+        weighted_data = self.csv_data.make_weighted_copy_from_selection(
+                            [0, 2], [3, 1])
+        expected_score = CollectionLikelihoodJudge().judge_prediction(
+                            model, data_predictor, weighted_data)
+        with SharedTrajectoryBuffer(self.csv_data) as shared_buffer:
+            shared_data = shared_buffer.attach()
+            shared_view = shared_data.make_weighted_copy_from_selection(
+                            [0, 2], [3, 1])
+            # a view of the shared block pickles without its trajectories
+            pickled_view = pickle.dumps(shared_view, 2)
+            nose.tools.ok_(len(pickled_view) < 2048)
+            judge = ParallelCollectionLikelihoodJudge(model_factory,
+                                                      num_processes=2)
+            try:
+                parallel_score = judge.judge_prediction(model, data_predictor,
+                                                        shared_view)
+            finally:
+                judge.stop()
+            store_file = shared_buffer.store_file
+        nose.tools.ok_(not os.path.exists(store_file))
+        error_message = "Expected %.6f, got %.6f" % (expected_score,
+                                                     parallel_score)
+        nose.tools.ok_(abs(expected_score - parallel_score) < 1e-10,
+                       error_message)
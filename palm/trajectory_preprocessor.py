@@ -0,0 +1,180 @@
+import numpy
+from palm.discrete_state_trajectory import TrajectorySegmentArrays,\
+                                           concatenate_trajectories
+
+class PreprocessingReport(object):
+    """
+    What preprocessing did to each trajectory.
+
+    Attributes
+    ----------
+    num_removed : ndarray
+        Number of segments removed from each trajectory, by dropping
+        or absorbing short dwells and by merging same-class neighbors.
+    is_valid : ndarray
+        Whether each trajectory starts dark, ends dark and has at least
+        one bright dwell, after preprocessing.
+    """
+    def __init__(self, num_removed, is_valid):
+        super(PreprocessingReport, self).__init__()
+        self.num_removed = num_removed
+        self.is_valid = is_valid
+
+    def __len__(self):
+        return len(self.num_removed)
+
+    def __str__(self):
+        return "%d segments removed, %d of %d trajectories invalid" %\
+               (self.get_total_removed(), self.get_num_invalid(), len(self))
+
+    def get_total_removed(self):
+        return int(self.num_removed.sum())
+
+    def get_num_invalid(self):
+        return int(numpy.count_nonzero(~self.is_valid))
+
+
+class TrajectoryPreprocessor(object):
+    """
+    Cleans up trajectories in bulk, working on the concatenated segment
+    arrays of all trajectories at once. In order:
+    1. Dwells no longer than `min_duration` are removed. Zero-length
+       dwells are always removed. If `absorb_short_dwells`, the time
+       of a removed dwell is added to the previous remaining dwell of
+       its trajectory (or the next one, at the start of a trajectory),
+       so trajectory durations are unchanged.
+    2. Adjacent dwells of the same class are merged into one.
+    3. Trajectories are checked to start dark, end dark and contain
+       a bright dwell, as the cutoff method and the bleach and
+       activation time statistics require.
+
+    Parameters
+    ----------
+    min_duration : float, optional
+    absorb_short_dwells : bool, optional
+        Whether to absorb short dwells into their neighbors or drop them.
+    invalid_policy : string, optional
+        What to do with trajectories that fail validation:
+        'raise' fails an assertion, 'drop' removes them from collections,
+        'keep' leaves them in place. The report marks them either way.
+    """
+    def __init__(self, min_duration=0.0, absorb_short_dwells=True,
+                 invalid_policy='raise'):
+        super(TrajectoryPreprocessor, self).__init__()
+        assert invalid_policy in ('raise', 'drop', 'keep'),\
+               "Unknown invalid_policy: %s" % invalid_policy
+        self.min_duration = min_duration
+        self.absorb_short_dwells = absorb_short_dwells
+        self.invalid_policy = invalid_policy
+
+    def preprocess_arrays(self, segment_arrays):
+        """
+        Parameters
+        ----------
+        segment_arrays : TrajectorySegmentArrays
+
+        Returns
+        -------
+        new_segment_arrays : TrajectorySegmentArrays
+            Has the same number of trajectories, in the same order.
+        report : PreprocessingReport
+        """
+        num_trajectories = len(segment_arrays)
+        old_counts = segment_arrays.get_segment_counts()
+        class_codes = numpy.asarray(segment_arrays.class_codes)
+        durations = numpy.asarray(segment_arrays.durations, dtype=numpy.float64)
+        trajectory_index = segment_arrays.get_trajectory_index()
+        class_codes, durations, trajectory_index = self._remove_short_dwells(
+            class_codes, durations, trajectory_index, segment_arrays.offsets)
+        class_codes, durations, trajectory_index = self._merge_same_class(
+            class_codes, durations, trajectory_index)
+        new_offsets = numpy.zeros(num_trajectories + 1, dtype=numpy.int64)
+        if num_trajectories > 0:
+            new_offsets[1:] = numpy.cumsum(numpy.bincount(
+                trajectory_index, minlength=num_trajectories))
+        new_segment_arrays = TrajectorySegmentArrays(
+                                class_codes, durations, new_offsets,
+                                segment_arrays.class_names)
+        num_removed = old_counts - new_segment_arrays.get_segment_counts()
+        is_valid = self.validate_arrays(new_segment_arrays)
+        report = PreprocessingReport(num_removed, is_valid)
+        if self.invalid_policy == 'raise':
+            assert is_valid.all(), "Invalid trajectories: %s" %\
+                                   numpy.flatnonzero(~is_valid)
+        return new_segment_arrays, report
+
+    def preprocess_trajectory(self, trajectory):
+        """
+        Parameters
+        ----------
+        trajectory : DiscreteStateTrajectory
+
+        Returns
+        -------
+        new_trajectory : DiscreteStateTrajectory
+        report : PreprocessingReport
+        """
+        segment_arrays = concatenate_trajectories([trajectory],
+                                                  trajectory.class_names)
+        new_segment_arrays, report = self.preprocess_arrays(segment_arrays)
+        new_trajectory = trajectory.__class__(new_segment_arrays.class_names)
+        new_trajectory.segment_factory = trajectory.segment_factory
+        new_trajectory.set_segment_arrays(new_segment_arrays.class_codes,
+                                          new_segment_arrays.durations)
+        return new_trajectory, report
+
+    def validate_arrays(self, segment_arrays):
+        """
+        Returns
+        -------
+        is_valid : ndarray
+            Whether each trajectory starts dark, ends dark and has
+            a bright dwell.
+        """
+        segment_counts = segment_arrays.get_segment_counts()
+        is_valid = segment_counts > 0
+        dark_mask = segment_arrays.get_class_mask('dark')
+        bright_mask = segment_arrays.get_class_mask('bright')
+        first_inds = segment_arrays.get_first_segment_inds()[is_valid]
+        last_inds = segment_arrays.get_last_segment_inds()[is_valid]
+        is_valid[is_valid] = dark_mask[first_inds] & dark_mask[last_inds]
+        num_bright = segment_arrays.sum_by_trajectory(bright_mask)
+        is_valid &= (num_bright > 0)
+        return is_valid
+
+    def _remove_short_dwells(self, class_codes, durations, trajectory_index,
+                             offsets):
+        is_short = (durations <= self.min_duration) | (durations <= 0.0)
+        if not is_short.any():
+            return class_codes, durations, trajectory_index
+        keep = ~is_short
+        if self.absorb_short_dwells:
+            segment_inds = numpy.arange(len(durations))
+            num_segments = len(durations)
+            # nearest kept segment before and after each segment
+            previous_kept = numpy.maximum.accumulate(
+                                numpy.where(keep, segment_inds, -1))
+            next_kept = numpy.minimum.accumulate(
+                            numpy.where(keep, segment_inds,
+                                        num_segments)[::-1])[::-1]
+            has_previous = previous_kept >= offsets[trajectory_index]
+            has_next = next_kept < offsets[trajectory_index + 1]
+            target = numpy.where(has_previous, previous_kept,
+                                 numpy.where(has_next, next_kept,
+                                             segment_inds))
+            # a trajectory made only of short dwells keeps them
+            keep |= (target == segment_inds)
+            durations = numpy.bincount(target, weights=durations,
+                                       minlength=num_segments)
+        return class_codes[keep], durations[keep], trajectory_index[keep]
+
+    def _merge_same_class(self, class_codes, durations, trajectory_index):
+        if len(durations) == 0:
+            return class_codes, durations, trajectory_index
+        is_run_start = numpy.ones(len(durations), dtype=bool)
+        is_run_start[1:] = (class_codes[1:] != class_codes[:-1]) |\
+                           (trajectory_index[1:] != trajectory_index[:-1])
+        run_starts = numpy.flatnonzero(is_run_start)
+        merged_durations = numpy.add.reduceat(durations, run_starts)
+        return class_codes[run_starts], merged_durations,\
+               trajectory_index[run_starts]
@@ -0,0 +1,598 @@
+import os
+import json
+import uuid
+import atexit
+import tempfile
+import threading
+import Queue
+import numpy
+import pandas
+from palm.blink_target_data import BlinkTargetData, BlinkCollectionTargetData
+from palm.discrete_state_trajectory import DiscreteStateTrajectory,\
+                                           TrajectorySegmentArrays,\
+                                           CLASS_CODE_TYPE
+
+STORE_MAGIC = 'PALMTRJ1'
+STORE_ALIGNMENT = 64
+
+def _aligned(position):
+    remainder = position % STORE_ALIGNMENT
+    if remainder:
+        position += STORE_ALIGNMENT - remainder
+    return position
+
+def write_trajectory_store(store_file, collection):
+    """
+    Writes every trajectory of a collection into one binary file.
+
+    File layout:
+        8-byte magic string
+        8-byte little-endian header length
+        json header (class names, paths, array dtypes, shapes and offsets)
+        data section, each array aligned to 64 bytes
+
+    Arrays in the data section:
+        class_codes : uint8, one per segment, all trajectories concatenated
+        durations : float64, one per segment
+        cumulative_times : float64, one per segment, restarts at zero
+            for each trajectory
+        offsets : int64, trajectory `i` is segments
+            `offsets[i]:offsets[i+1]`
+        end_times, first_durations, last_durations : float64, one per
+            trajectory, for activation and bleach times without reading
+            the segments
+
+    Parameters
+    ----------
+    store_file : string
+    collection : BlinkCollectionTargetData
+    """
+    write_segment_arrays_to_store(store_file, collection.get_segment_arrays(),
+                                  collection.get_paths())
+
+def write_segment_arrays_to_store(store_file, segment_arrays, paths=None):
+    """
+    Writes concatenated trajectories into a trajectory store, in the
+    layout described by `write_trajectory_store`.
+
+    Parameters
+    ----------
+    store_file : string
+    segment_arrays : TrajectorySegmentArrays
+    paths : list, optional
+        Source of each trajectory. Empty strings if not given.
+    """
+    class_names = segment_arrays.class_names
+    class_codes = numpy.asarray(segment_arrays.class_codes,
+                                dtype=CLASS_CODE_TYPE)
+    durations = numpy.asarray(segment_arrays.durations, dtype=numpy.float64)
+    offsets = numpy.asarray(segment_arrays.offsets, dtype=numpy.int64)
+    cumulative_times = segment_arrays.get_cumulative_times()
+    segment_counts = segment_arrays.get_segment_counts()
+    nonempty = segment_counts > 0
+    start_inds = offsets[:-1][nonempty]
+    end_inds = offsets[1:][nonempty] - 1
+    end_times = numpy.zeros(len(segment_counts))
+    first_durations = numpy.zeros(len(segment_counts))
+    last_durations = numpy.zeros(len(segment_counts))
+    end_times[nonempty] = cumulative_times[end_inds]
+    first_durations[nonempty] = durations[start_inds]
+    last_durations[nonempty] = durations[end_inds]
+
+    array_dict = {'class_codes':class_codes, 'durations':durations,
+                  'cumulative_times':cumulative_times, 'offsets':offsets,
+                  'end_times':end_times, 'first_durations':first_durations,
+                  'last_durations':last_durations}
+    array_info = {}
+    position = 0
+    for array_name in sorted(array_dict.keys()):
+        this_array = array_dict[array_name]
+        position = _aligned(position)
+        array_info[array_name] = {'dtype':this_array.dtype.str,
+                                  'shape':list(this_array.shape),
+                                  'offset':position}
+        position += this_array.nbytes
+    if paths is None:
+        paths = [''] * len(segment_counts)
+    header = {'class_names':class_names, 'paths':list(paths),
+              'num_trajectories':len(segment_counts),
+              'num_segments':len(durations), 'arrays':array_info}
+    header_str = json.dumps(header)
+    data_start = _aligned(16 + len(header_str))
+    with open(store_file, 'wb') as f:
+        f.write(STORE_MAGIC)
+        f.write(numpy.array([len(header_str)], dtype='<u8').tostring())
+        f.write(header_str)
+        for array_name in sorted(array_dict.keys()):
+            f.seek(data_start + array_info[array_name]['offset'])
+            f.write(array_dict[array_name].tostring())
+
+def convert_directory_file_to_store(directory_file, store_file,
+                                    preprocessor=None):
+    """
+    Converts a text file of csv trajectory paths, as read by
+    `BlinkCollectionTargetData.load_data`, into a trajectory store.
+
+    Parameters
+    ----------
+    directory_file : string
+    store_file : string
+    preprocessor : TrajectoryPreprocessor, optional
+        Applied to the trajectories before they are stored.
+    """
+    collection = BlinkCollectionTargetData()
+    collection.preprocessor = preprocessor
+    collection.load_data(directory_file)
+    write_trajectory_store(store_file, collection)
+
+
+class TrajectoryStore(object):
+    """
+    Read-only, memory-mapped access to a file written by
+    `write_trajectory_store`. Arrays are mapped rather than read, so
+    processes that open the same file share its pages in the page cache.
+
+    Attributes
+    ----------
+    store_file : string
+    class_names : list
+    paths : list
+    arrays : dict
+        Memory-mapped arrays, indexed by name.
+
+    Parameters
+    ----------
+    store_file : string
+    """
+    def __init__(self, store_file):
+        super(TrajectoryStore, self).__init__()
+        self.store_file = store_file
+        with open(store_file, 'rb') as f:
+            magic = f.read(len(STORE_MAGIC))
+            assert magic == STORE_MAGIC, "Not a trajectory store: %s" %\
+                                         store_file
+            header_length = int(numpy.fromstring(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(header_length))
+        data_start = _aligned(16 + header_length)
+        self.data_start = data_start
+        self.array_info = header['arrays']
+        self.class_names = [str(c) for c in header['class_names']]
+        self.paths = [str(p) for p in header['paths']]
+        self.arrays = {}
+        for array_name, info in header['arrays'].iteritems():
+            dtype = numpy.dtype(str(info['dtype']))
+            shape = tuple(info['shape'])
+            if numpy.prod(shape) == 0:
+                this_array = numpy.zeros(shape, dtype=dtype)
+            else:
+                this_array = numpy.memmap(store_file, dtype=dtype, mode='r',
+                                          offset=data_start + info['offset'],
+                                          shape=shape)
+            self.arrays[str(array_name)] = this_array
+
+    def __len__(self):
+        return len(self.arrays['offsets']) - 1
+
+    def get_array(self, array_name):
+        return self.arrays[array_name]
+
+    def read_array_block(self, array_name, start, stop):
+        """
+        Reads elements `start:stop` of an array from disk into memory,
+        rather than mapping them.
+
+        Returns
+        -------
+        block : ndarray
+        """
+        info = self.array_info[array_name]
+        dtype = numpy.dtype(str(info['dtype']))
+        count = stop - start
+        if count <= 0:
+            return numpy.zeros(0, dtype=dtype)
+        with open(self.store_file, 'rb') as f:
+            f.seek(self.data_start + info['offset'] + start * dtype.itemsize)
+            block = numpy.fromfile(f, dtype=dtype, count=count)
+        return block
+
+    def are_dark_segments(self, segment_inds):
+        if 'dark' not in self.class_names:
+            return numpy.zeros(len(segment_inds), dtype=bool)
+        class_codes = self.arrays['class_codes'][segment_inds]
+        return (class_codes == self.class_names.index('dark'))
+
+    def get_activation_times(self):
+        """
+        Returns
+        -------
+        activation_times : ndarray
+            The first dwell of each trajectory, from the per-trajectory
+            arrays; only the class of each first segment is read.
+        """
+        offsets = self.arrays['offsets']
+        assert self.are_dark_segments(offsets[:-1]).all(),\
+               "Expected every trajectory to start dark."
+        return numpy.array(self.arrays['first_durations'])
+
+    def get_bleach_times(self):
+        """
+        Returns
+        -------
+        bleach_times : ndarray
+            Time from activation to the start of the last dark dwell of
+            each trajectory, from the per-trajectory arrays.
+        """
+        offsets = self.arrays['offsets']
+        assert self.are_dark_segments(offsets[1:] - 1).all(),\
+               "Expected every trajectory to end dark."
+        return self.arrays['end_times'] - self.get_activation_times() -\
+               self.arrays['last_durations']
+
+    def get_segment_arrays(self):
+        """
+        Returns
+        -------
+        segment_arrays : TrajectorySegmentArrays
+            Backed by the memory-mapped arrays of the store.
+        """
+        return TrajectorySegmentArrays(self.arrays['class_codes'],
+                                       self.arrays['durations'],
+                                       self.arrays['offsets'],
+                                       self.class_names)
+
+    def get_segment_range(self, index):
+        offsets = self.arrays['offsets']
+        return int(offsets[index]), int(offsets[index + 1])
+
+    def get_trajectory(self, index, trajectory_factory=None):
+        """
+        Makes a trajectory whose segment arrays are slices of the
+        memory-mapped store arrays. No data is copied.
+
+        Returns
+        -------
+        trajectory : DiscreteStateTrajectory
+        """
+        if trajectory_factory is None:
+            trajectory_factory = DiscreteStateTrajectory
+        start, stop = self.get_segment_range(index)
+        trajectory = trajectory_factory(self.class_names)
+        trajectory.set_segment_arrays(
+            self.arrays['class_codes'][start:stop],
+            self.arrays['durations'][start:stop],
+            self.arrays['cumulative_times'][start:stop])
+        return trajectory
+
+
+class StoredBlinkCollectionTargetData(BlinkCollectionTargetData):
+    """
+    A collection of trajectories backed by a trajectory store file.
+    Trajectories are created on demand from memory-mapped arrays,
+    so loading parses no text and keeps no per-trajectory objects.
+    When pickled, only the path of the store is sent.
+
+    Attributes
+    ----------
+    store : TrajectoryStore
+    store_file : string
+    """
+    is_store_backed = True
+
+    def __init__(self):
+        super(StoredBlinkCollectionTargetData, self).__init__()
+        self.store = None
+        self.store_file = None
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['store'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.store_file is not None:
+            self.store = TrajectoryStore(self.store_file)
+
+    def load_data(self, data_file):
+        """
+        Open a trajectory store.
+
+        Parameters
+        ----------
+        data_file : string
+            Path of a file written by `write_trajectory_store`.
+        """
+        self.store_file = data_file
+        self.store = TrajectoryStore(data_file)
+        self.paths = self.store.paths
+
+    def iter_feature(self):
+        for i in xrange(len(self)):
+            yield self.store.get_trajectory(i)
+
+    def get_feature_by_index(self, index):
+        trajectory_data = self.trajectory_data_factory()
+        trajectory_data.trajectory = self.store.get_trajectory(index)
+        trajectory_data.filename = self.paths[index]
+        return trajectory_data
+
+    def get_feature(self):
+        return [self.get_feature_by_index(i) for i in xrange(len(self))]
+
+    def get_segment_arrays(self):
+        return self.store.get_segment_arrays()
+
+    def get_total_number_of_trajectory_segments(self):
+        return len(self.store.get_array('durations'))
+
+    def get_bleach_time_distribution(self):
+        return pandas.Series(self.store.get_bleach_times())
+
+    def get_activation_time_distribution(self):
+        return pandas.Series(self.store.get_activation_times())
+
+
+if os.path.isdir('/dev/shm'):
+    SHARED_MEMORY_DIR = '/dev/shm'
+else:
+    SHARED_MEMORY_DIR = tempfile.gettempdir()
+
+def get_shared_store_file(name, shared_memory_dir=SHARED_MEMORY_DIR):
+    return os.path.join(shared_memory_dir, name)
+
+def attach_shared_collection(name, shared_memory_dir=SHARED_MEMORY_DIR):
+    """
+    Attach to a collection published by `SharedTrajectoryBuffer`.
+    The segment arrays are mapped, not copied.
+
+    Parameters
+    ----------
+    name : string
+        `SharedTrajectoryBuffer.name` of the published block.
+
+    Returns
+    -------
+    collection : StoredBlinkCollectionTargetData
+    """
+    collection = StoredBlinkCollectionTargetData()
+    collection.load_data(get_shared_store_file(name, shared_memory_dir))
+    return collection
+
+
+class SharedTrajectoryBuffer(object):
+    """
+    Publishes the concatenated segment arrays of a collection into OS
+    shared memory (a trajectory store in /dev/shm), so that worker
+    processes can attach to one read-only copy by name instead of each
+    parsing the trajectory files. The process that creates the buffer
+    owns it and removes it on `close`, on leaving a `with` block,
+    or at interpreter exit.
+
+    Collections returned by `attach` pickle as the store name only, and
+    views made from them with `make_copy_from_selection` pickle as that
+    name plus their index and weight arrays.
+
+    Attributes
+    ----------
+    name : string
+    store_file : string
+
+    Parameters
+    ----------
+    collection : BlinkCollectionTargetData
+    name : string, optional
+        Defaults to a unique name.
+    shared_memory_dir : string, optional
+    """
+    def __init__(self, collection, name=None,
+                 shared_memory_dir=SHARED_MEMORY_DIR):
+        super(SharedTrajectoryBuffer, self).__init__()
+        if name is None:
+            name = "palm-%d-%s.store" % (os.getpid(), uuid.uuid4().hex[:12])
+        self.name = name
+        self.shared_memory_dir = shared_memory_dir
+        self.store_file = get_shared_store_file(name, shared_memory_dir)
+        self.owner_pid = os.getpid()
+        write_trajectory_store(self.store_file, collection)
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self):
+        """
+        Returns
+        -------
+        collection : StoredBlinkCollectionTargetData
+        """
+        return attach_shared_collection(self.name, self.shared_memory_dir)
+
+    def is_open(self):
+        return os.path.exists(self.store_file)
+
+    def close(self):
+        """
+        Removes the shared block. Only the owning process removes it,
+        so forked workers that inherit this object leave it alone.
+        Collections that are still attached keep their mapping until
+        they are released.
+        """
+        if os.getpid() != self.owner_pid:
+            return
+        if os.path.exists(self.store_file):
+            os.remove(self.store_file)
+
+
+class StreamingBlinkCollectionTargetData(BlinkCollectionTargetData):
+    """
+    A collection of trajectories that is read from a trajectory store
+    in chunks, so that collections larger than memory can be scored.
+    Each chunk holds at most `max_segments_per_chunk` segments (or a
+    single trajectory, if one trajectory is longer than that). While
+    one chunk is being used, a background thread reads the next ones.
+
+    Attributes
+    ----------
+    store : TrajectoryStore
+        Used only for the header and the offsets array; segment data
+        is read chunk by chunk with `TrajectoryStore.read_array_block`.
+
+    Parameters
+    ----------
+    max_segments_per_chunk : int, optional
+    num_prefetch_chunks : int, optional
+        How many chunks may be read ahead of the chunk in use.
+        Zero disables prefetching.
+    """
+    def __init__(self, max_segments_per_chunk=100000, num_prefetch_chunks=1):
+        super(StreamingBlinkCollectionTargetData, self).__init__()
+        self.max_segments_per_chunk = max_segments_per_chunk
+        self.num_prefetch_chunks = num_prefetch_chunks
+        self.store = None
+        self.store_file = None
+
+    def __len__(self):
+        return len(self.store)
+
+    def load_data(self, data_file):
+        """
+        Open a trajectory store. No segment data is read.
+
+        Parameters
+        ----------
+        data_file : string
+            Path of a file written by `write_trajectory_store`.
+        """
+        self.store_file = data_file
+        self.store = TrajectoryStore(data_file)
+        self.paths = self.store.paths
+
+    def get_chunk_bounds(self):
+        """
+        Groups consecutive trajectories into chunks.
+
+        Returns
+        -------
+        chunk_bounds : list
+            `(first_trajectory, stop_trajectory)` pairs.
+        """
+        offsets = numpy.array(self.store.get_array('offsets'))
+        chunk_bounds = []
+        first = 0
+        num_trajectories = len(self)
+        while first < num_trajectories:
+            segment_limit = offsets[first] + self.max_segments_per_chunk
+            stop = numpy.searchsorted(offsets, segment_limit, side='right') - 1
+            stop = min(max(stop, first + 1), num_trajectories)
+            chunk_bounds.append((first, stop))
+            first = stop
+        return chunk_bounds
+
+    def read_chunk(self, first, stop):
+        """
+        Reads trajectories `first:stop` from disk.
+
+        Returns
+        -------
+        trajectory_list : list
+        """
+        offsets = self.store.get_array('offsets')
+        segment_start = int(offsets[first])
+        segment_stop = int(offsets[stop])
+        class_codes = self.store.read_array_block('class_codes',
+                                                  segment_start, segment_stop)
+        durations = self.store.read_array_block('durations',
+                                                segment_start, segment_stop)
+        cumulative_times = self.store.read_array_block(
+                            'cumulative_times', segment_start, segment_stop)
+        trajectory_list = []
+        for i in xrange(first, stop):
+            a = int(offsets[i]) - segment_start
+            b = int(offsets[i + 1]) - segment_start
+            trajectory = DiscreteStateTrajectory(self.store.class_names)
+            trajectory.set_segment_arrays(class_codes[a:b], durations[a:b],
+                                          cumulative_times[a:b])
+            trajectory_list.append(trajectory)
+        return trajectory_list
+
+    def iter_chunks(self):
+        """
+        Iterate over the collection chunk by chunk.
+
+        Returns
+        -------
+        trajectory_list : list
+            The trajectories of one chunk.
+        """
+        chunk_bounds = self.get_chunk_bounds()
+        if self.num_prefetch_chunks < 1:
+            for first, stop in chunk_bounds:
+                yield self.read_chunk(first, stop)
+            return
+        chunk_queue = Queue.Queue(maxsize=self.num_prefetch_chunks)
+        stop_event = threading.Event()
+        def put_until_stopped(item):
+            # the consumer may abandon the iteration at any time, so the
+            # reader never blocks on a full queue
+            while not stop_event.is_set():
+                try:
+                    chunk_queue.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    continue
+            return False
+        def read_all_chunks():
+            try:
+                for first, stop in chunk_bounds:
+                    chunk = self.read_chunk(first, stop)
+                    if not put_until_stopped(chunk):
+                        return
+                put_until_stopped(None)
+            except Exception as e:
+                put_until_stopped(e)
+        reader_thread = threading.Thread(target=read_all_chunks)
+        reader_thread.daemon = True
+        reader_thread.start()
+        try:
+            while True:
+                chunk = chunk_queue.get()
+                if chunk is None:
+                    break
+                elif isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            stop_event.set()
+            reader_thread.join()
+
+    def iter_feature(self):
+        for trajectory_list in self.iter_chunks():
+            for trajectory in trajectory_list:
+                yield trajectory
+
+    def get_feature_by_index(self, index):
+        trajectory_data = self.trajectory_data_factory()
+        trajectory_data.trajectory = self.read_chunk(index, index + 1)[0]
+        trajectory_data.filename = self.paths[index]
+        return trajectory_data
+
+    def get_feature(self):
+        return self
+
+    def get_segment_arrays(self):
+        return self.store.get_segment_arrays()
+
+    def get_total_number_of_trajectory_segments(self):
+        return int(self.store.get_array('offsets')[-1])
+
+    def get_bleach_time_distribution(self):
+        return pandas.Series(self.store.get_bleach_times())
+
+    def get_activation_time_distribution(self):
+        return pandas.Series(self.store.get_activation_times())
@@ -44,6 +44,27 @@ def randomize_parameter(parameter_set, parameter_name, lower_bound,
     parameter_set.set_parameter(parameter_name, new_value)
     return parameter_set
 
+def make_random_state(seed=None):
+    """
+    Turn `seed` into a numpy RandomState.
+
+    Parameters
+    ----------
+    seed : None, int or numpy.random.RandomState
+        If None, a freshly seeded RandomState is returned. If an int,
+        a RandomState seeded with that value is returned. If already
+        a RandomState, it is returned unchanged so that callers can
+        share one stream of random numbers.
+
+    Returns
+    -------
+    random_state : numpy.random.RandomState
+    """
+    if isinstance(seed, numpy.random.RandomState):
+        return seed
+    else:
+        return numpy.random.RandomState(seed)
+
 class Timer:    
     def __enter__(self):
         self.start = time.time()